@@ -1,67 +1,326 @@
-from flask import Flask, render_template, request, jsonify, send_file, send_from_directory
-import yt_dlp
+from flask import Flask, Response, redirect, request, jsonify, send_file, send_from_directory, stream_with_context
+import contextlib
+import json
+import mimetypes
 import os
 import time
 import uuid
+import shutil
+import threading
 from threading import Thread
+from urllib.parse import quote
+from progress_store import JobProgress, create_progress_store
+from jobs import QueueFull, create_connection_budget, create_download_queue, process_alive
+from info_cache import canonical_url, create_info_cache
+from download_cache import cache_key, create_download_cache
+from streaming import RELAYED_HEADERS, content_disposition, media_filename, open_upstream, plan_stream, relay
+from zipstream import stream_zip
+from ydl_pool import create_ydl_pool, is_download_error
+from metrics import JobTimer, create_metrics, error_class
+from classifier import breaker_reason, classify_error, detect_platform, is_retryable
+from formats import build_formats, format_entry, projected_size, recommend_presets
+from audio import AUDIO_FORMATS, audio_selector, create_audio_converter, plan_audio
+from storage import StorageFull, create_storage_manager
+from throttle import BREAKER_STATES, Throttled, create_platform_guard
+from pages import AssetVersions, create_page_cache
+from thumbnails import create_thumbnail_cache, is_thumbnail_key, thumbnail_key
 
 app = Flask(__name__)
+# Landing pages are rendered once and cached (see PageCache); this lets a
+# changed template file replace the cached copy without a restart
+app.config['TEMPLATES_AUTO_RELOAD'] = True
+
+# Whether clients should follow progress over /progress_stream. A stream
+# holds a sync worker for as long as it is open, so only the ASGI mode,
+# which waits on the event loop instead, turns this on (see asgi.py)
+app.config['PROGRESS_STREAMING'] = False
 
 # Configuration
 DOWNLOAD_FOLDER = 'static/downloads'
 os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
 
-# Global dictionary to store download progress
-download_progress = {}
+# Every job writes into its own JOBS_FOLDER/<download_id> directory
+JOBS_FOLDER = os.path.join(DOWNLOAD_FOLDER, 'jobs')
+os.makedirs(JOBS_FOLDER, exist_ok=True)
+
+# Seconds before an abandoned or uncached job directory is removed, unless
+# a client is still fetching a file from it
+JOB_FOLDER_TTL = 300
+
+# Seconds between storage sweeps (eviction, job recovery) on the leader
+# worker, and seconds a download waits for disk space before failing
+STORAGE_SWEEP_INTERVAL = int(os.environ.get('STORAGE_SWEEP_INTERVAL', 15))
+STORAGE_WAIT = int(os.environ.get('STORAGE_WAIT', 120))
 
-# File cleanup function
-def cleanup_old_files():
-    """Remove files older than 5 minutes"""
-    while True:
-        try:
-            current_time = time.time()
-            for filename in os.listdir(DOWNLOAD_FOLDER):
-                filepath = os.path.join(DOWNLOAD_FOLDER, filename)
-                if os.path.isfile(filepath):
-                    file_age = current_time - os.path.getmtime(filepath)
-                    if file_age > 300:  # 5 minutes
-                        os.remove(filepath)
-                        print(f"Cleaned up old file: {filename}")
-        except Exception as e:
-            print(f"Cleanup error: {e}")
-        time.sleep(60)  # Check every minute
+# Seconds a finished file is pinned for its client to start fetching it,
+# and the longest a file being sent to a client stays pinned
+STORAGE_COLLECT_TTL = int(os.environ.get('STORAGE_COLLECT_TTL', 60))
+STORAGE_PIN_TTL = int(os.environ.get('STORAGE_PIN_TTL', 1800))
+
+# Attempts per job including automatic retries, and the base backoff in
+# seconds between them; each retry resumes from the partial files
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_DELAY = int(os.environ.get('JOB_RETRY_DELAY', 5))
+
+# Seconds a failed job keeps its record and partial files for a manual retry
+JOB_RESUME_TTL = int(os.environ.get('JOB_RESUME_TTL', 3600))
 
-# Start cleanup thread
-cleanup_thread = Thread(target=cleanup_old_files, daemon=True)
-cleanup_thread.start()
+# Longest wait in seconds for a throttled platform before a job fails
+# instead of being deferred
+THROTTLE_MAX_WAIT = int(os.environ.get('THROTTLE_MAX_WAIT', 120))
+
+# Seconds a finished/errored job stays readable by the client
+RESULT_PROGRESS_TTL = 300
+
+# How /file hands a finished download to the client: 'direct' (sendfile
+# from this worker), 'x-accel' (nginx X-Accel-Redirect into
+# FILE_ACCEL_PREFIX, an internal location aliasing DOWNLOAD_FOLDER) or
+# 'x-sendfile' (Apache/lighttpd, absolute path in X-Sendfile)
+FILE_DELIVERY = os.environ.get('FILE_DELIVERY', 'direct')
+FILE_ACCEL_PREFIX = os.environ.get('FILE_ACCEL_PREFIX', '/protected-downloads/')
+
+# Seconds a /file link keeps working, long enough for download managers to resume
+FILE_LINK_TTL = int(os.environ.get('FILE_LINK_TTL', 3600))
+
+# Max progress events per second on /progress_stream, and seconds before the
+# stream (or a batch zip waiting on unfinished items) is closed so a worker
+# is never held past the gunicorn timeout
+PROGRESS_STREAM_RATE = float(os.environ.get('PROGRESS_STREAM_RATE', 2))
+PROGRESS_STREAM_TIMEOUT = int(os.environ.get('PROGRESS_STREAM_TIMEOUT', 120))
+# Cache-Control stops caching, X-Accel-Buffering stops nginx-style proxies from buffering the stream
+PROGRESS_STREAM_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+# Batch limits: items per batch, items of one batch downloading at once,
+# and seconds the batch record stays readable
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 50))
+BATCH_PARALLEL = int(os.environ.get('BATCH_PARALLEL', 3))
+BATCH_TTL = 3600
+
+# Seconds clients are told to wait before asking again for the zip of an unfinished batch
+BATCH_ZIP_RETRY_AFTER = 5
+
+# Seconds a /stream link stays valid, well inside signed media URL lifetimes
+STREAM_TTL = 600
+
+# Seconds a /thumbnail link can still fetch its source image, outliving the
+# cached /fetch_info payload that hands it out, and seconds browsers keep the
+# downscaled image
+THUMBNAIL_SOURCE_TTL = 24 * 3600
+THUMBNAIL_MAX_AGE = int(os.environ.get('THUMBNAIL_MAX_AGE', 7 * 24 * 3600))
+
+# Seconds browsers keep static files linked with a ?v= content hash, and /favicon.ico
+STATIC_VERSIONED_MAX_AGE = 365 * 24 * 3600
+FAVICON_MAX_AGE = int(os.environ.get('FAVICON_MAX_AGE', 7 * 24 * 3600))
+
+# Connections one download may open: byte ranges of a plain HTTP file, or
+# HLS/DASH fragments fetched at once; granted from DOWNLOAD_CONNECTIONS_TOTAL
+DOWNLOAD_CONNECTIONS = int(os.environ.get('DOWNLOAD_CONNECTIONS', 4))
+
+# Download progress, shared across gunicorn workers (see PROGRESS_BACKEND)
+download_progress = create_progress_store()
+
+# Downloads run here instead of inside the HTTP request (see DOWNLOAD_WORKERS)
+download_queue = create_download_queue()
+
+# Warm YoutubeDL instances reused across requests, one set per option profile;
+# yt-dlp is only imported by the first extraction (or a preloading master)
+# Throttled extractions and full queues or disks leave the instance reusable
+ydl_pool = create_ydl_pool(lambda profile: ydl_profile_options(profile), on_load=lambda: install_downloaders(),
+                           reusable=lambda e: isinstance(e, (Throttled, QueueFull)))
+
+# Processed /fetch_info payloads keyed by canonical URL, shared by all workers (see INFO_CACHE_TTL)
+info_cache = create_info_cache()
+
+# Finished files keyed by media + format + postprocessing
+download_cache = create_download_cache(DOWNLOAD_FOLDER)
+
+# Byte budget for everything under DOWNLOAD_FOLDER (see STORAGE_BUDGET_BYTES)
+storage = create_storage_manager(DOWNLOAD_FOLDER)
+storage.protected = download_cache.in_flight
+
+# Per-platform rate limits and circuit breakers around extraction (see PLATFORM_RATE_LIMITS)
+platform_guard = create_platform_guard()
+
+# Remuxes and transcodes, bounded to the CPU core count (see AUDIO_WORKERS)
+audio_converter = create_audio_converter()
+
+# Landing pages rendered once per worker and served precompressed (see PAGE_MAX_AGE)
+landing_pages = create_page_cache()
+asset_versions = AssetVersions(app.static_folder)
+
+# Downscaled /fetch_info thumbnails kept on disk (see THUMBNAIL_CACHE_BYTES)
+thumbnail_cache = create_thumbnail_cache()
+
+# Extra download connections shared by the jobs of all workers (see DOWNLOAD_CONNECTIONS_TOTAL)
+connection_budget = create_connection_budget()
+
+# Counters, histograms and gauges for /metrics, summed over all workers
+metrics = create_metrics()
+
+def install_downloaders():
+    """Runs once yt-dlp is imported: plain HTTP downloads go through RangedHttpFD"""
+    from ranged import install_ranged_downloader
+    install_ranged_downloader()
+
+def cache_metrics():
+    """Cache lookups and queue depth of this worker, sampled on every metrics flush"""
+    samples = []
+    for name, stats in (('info', info_cache.stats()), ('download', download_cache.stats()),
+                        ('thumbnail', thumbnail_cache.stats())):
+        for result in ('hits', 'misses', 'coalesced'):
+            samples.append(('achek_cache_requests_total', {'cache': name, 'result': result}, stats[result]))
+    queue = download_queue.stats()
+    samples.append(('achek_queue_jobs', {'state': 'pending'}, queue['pending']))
+    samples.append(('achek_queue_jobs', {'state': 'running'}, queue['running']))
+    audio = audio_converter.stats()
+    samples.append(('achek_audio_jobs', {'state': 'waiting'}, audio['waiting']))
+    samples.append(('achek_audio_jobs', {'state': 'running'}, audio['running']))
+    for action, count in audio['completed'].items():
+        samples.append(('achek_audio_conversions_total', {'action': action}, count))
+    # Summed over workers; the budget itself is host-wide and sampled in /metrics
+    samples.append(('achek_download_connections', {'state': 'in_use'}, connection_budget.stats()['in_use']))
+    return samples
+
+metrics.add_collector(cache_metrics)
+
+def storage_sweep():
+    """Keep the download folder within its byte budget, resume orphaned jobs and drop stale job directories
+
+    Runs every STORAGE_SWEEP_INTERVAL seconds in the one worker holding
+    the storage leader lock.
+    """
+    storage.purge_reservations()
+    storage.evict()
+    recover_jobs()
+
+def job_folder(download_id):
+    return os.path.join(JOBS_FOLDER, download_id)
+
+def job_key(download_id):
+    return f'job:{download_id}'
+
+def public_progress(download_id, default=None):
+    """Progress record for a download id sent by a client
+
+    Internal records (job:, file:, stream:, batch:, thumb:) share the store,
+    and their keys contain ':', which download ids never do.
+    """
+    if not isinstance(download_id, str) or ':' in download_id:
+        return default
+    return download_progress.get(download_id, default)
+
+def last_activity(path):
+    """Newest mtime of a job folder and its files, .part files are touched on every write"""
+    latest = os.stat(path).st_mtime
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                latest = max(latest, entry.stat().st_mtime)
+            except OSError:
+                pass
+    return latest
+
+def recover_jobs():
+    """Re-adopt jobs whose worker died and remove job folders nobody needs anymore
+
+    Runs on the storage leader. Job state lives in the shared progress
+    store, so any worker can pick up a job whose owning process is gone;
+    the claim is atomic and the job resumes from the partial files left in
+    its folder.
+    """
+    now = time.time()
+    pinned = storage.pinned()
+    with os.scandir(JOBS_FOLDER) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            try:
+                job = download_progress.get(job_key(entry.name))
+                idle = now - last_activity(entry.path)
+                if job is None or job['state'] == 'done':
+                    expired = idle > JOB_FOLDER_TTL
+                elif job['state'] == 'failed':
+                    expired = idle > JOB_RESUME_TTL
+                else:
+                    expired = False
+                    if not process_alive(job['owner']):
+                        adopt_job(entry.name, job)
+                if expired and not any(path.startswith(f'jobs/{entry.name}/') for path in pinned):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    print(f"Cleaned up job folder: {entry.name}")
+            except OSError:
+                # Removed by its job while we were looking
+                continue
+
+def adopt_job(download_id, job):
+    """Claim a queued or running job of a dead worker and queue it here"""
+    owner = job['owner']
+    claimed = download_progress.update_if(
+        job_key(download_id),
+        lambda record: record.get('owner') == owner and record.get('state') in ('queued', 'running'),
+        ttl=JOB_RESUME_TTL, owner=os.getpid(), state='queued')
+    if not claimed:
+        return
+
+    if job.get('attempts', 0) >= JOB_MAX_ATTEMPTS:
+        fail_job(download_id, job['result_ttl'], 'interrupted',
+                 '⚠️ The download was interrupted too many times. Please try again.')
+        return
+
+    print(f"Resuming job {download_id} left by worker {owner}")
+    download_progress.update(download_id, status='queued', message='Resuming interrupted download...')
+    resume_job(download_id)
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return landing_pages.response('index.html')
 
 @app.route('/youtube-downloader')
 def youtube_downloader():
-    return render_template('youtube.html')
+    return landing_pages.response('youtube.html')
 
 @app.route('/tiktok-downloader')
 def tiktok_downloader():
-    return render_template('tiktok.html')
+    return landing_pages.response('tiktok.html')
 
 @app.route('/instagram-downloader')
 def instagram_downloader():
-    return render_template('instagram.html')
+    return landing_pages.response('instagram.html')
 
 @app.route('/facebook-downloader')
 def facebook_downloader():
-    return render_template('facebook.html')
+    return landing_pages.response('facebook.html')
 
 @app.route('/spotify-downloader')
 def spotify_downloader():
-    return render_template('spotify.html')
+    return landing_pages.response('spotify.html')
 
 @app.route('/audiomack-downloader')
 def audiomack_downloader():
-    return render_template('audiomack.html')
+    return landing_pages.response('audiomack.html')
+
+@app.route('/favicon.ico')
+def favicon():
+    return send_from_directory('.', 'favicon.ico', mimetype='image/vnd.microsoft.icon', max_age=FAVICON_MAX_AGE)
+
+@app.url_defaults
+def static_version(endpoint, values):
+    """Add ?v=<content hash> to url_for('static', ...) links so browsers can keep the file for a year"""
+    filename = values.get('filename') if endpoint == 'static' else None
+    if filename and not filename.startswith('downloads/') and 'v' not in values:
+        version = asset_versions.version(filename)
+        if version:
+            values['v'] = version
+
+@app.after_request
+def cache_versioned_static(response):
+    """Long-lived caching for static files requested with their current ?v= hash"""
+    filename = (request.view_args or {}).get('filename', '')
+    version = request.args.get('v')
+    if (request.endpoint == 'static' and version and response.status_code in (200, 206, 304)
+            and version == asset_versions.version(filename)):
+        response.headers['Cache-Control'] = f'public, max-age={STATIC_VERSIONED_MAX_AGE}, immutable'
+    return response
 
 @app.route('/sw.js')
 def service_worker():
@@ -75,10 +334,105 @@ def robots():
 def ads_txt():
     return send_from_directory('.', 'ads.txt', mimetype='text/plain')
 
+def info_options():
+    """yt-dlp options for metadata extraction in /fetch_info"""
+    # Enhanced options for Instagram and other platforms
+    return {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': False,
+        'socket_timeout': 30,
+        'retries': 5,
+        'geo_bypass': True,
+        'geo_bypass_country': 'US',
+        'age_limit': None,
+        'nocheckcertificate': True,
+        'source_address': '0.0.0.0',
+        'force_ipv4': True,
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36',
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
+            'Accept-Language': 'en-US,en;q=0.9',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'Connection': 'keep-alive',
+            'Upgrade-Insecure-Requests': '1',
+            'Sec-Fetch-Dest': 'document',
+            'Sec-Fetch-Mode': '',
+            'Sec-Fetch-Site': 'none',
+            'Sec-Fetch-User': '?1',
+            'Cache-Control': 'max-age=0',
+        },
+        'extractor_args': {
+            'instagram': {
+                'include_stories': True,
+                'include_highlights': True,
+            },
+            'twitter': {
+                'api': 'syndication',
+            },
+            'tiktok': {
+                'api': 'mobile_app',
+                'webpage_download': True,
+            },
+            'youtube': {
+                'player_client': ['android', 'web'],
+            },
+            'facebook': {
+                'legacy_api': False,
+            },
+        },
+        'force_generic_extractor': False,
+    }
+
+def ydl_profile_options(profile):
+    """Base options for each YoutubeDL pool profile: 'info', 'flat', 'audio' or 'video'"""
+    if profile == 'info':
+        return info_options()
+    if profile == 'flat':
+        ydl_opts = download_options('video', None)
+        ydl_opts['extract_flat'] = 'in_playlist'
+        ydl_opts['playlistend'] = BATCH_MAX_ITEMS
+        return ydl_opts
+    return download_options(profile, None)
+
+def extract_media_info(url):
+    """Run yt-dlp extraction for url and build the /fetch_info payload, None if nothing was found"""
+    with ydl_pool.acquire('info') as ydl:
+        with metrics.time('achek_stage_duration_seconds', {'platform': detect_platform(url), 'stage': 'extract'}):
+            with platform_call(detect_platform(url)):
+                info = ydl.extract_info(url, download=False)
+
+        if info is None:
+            return None
+
+        video_formats, audio_formats = build_formats(info)
+
+        return {
+            'success': True,
+            'title': info.get('title', 'Unknown Title'),
+            'thumbnail': thumbnail_url(info),
+            'uploader': info.get('uploader', 'Unknown'),
+            'duration': info.get('duration_string', 'Unknown'),
+            'video_formats': [format_entry(f) for f in video_formats[:15]],
+            'audio_formats': [format_entry(f) for f in audio_formats[:8]],
+            'presets': recommend_presets(video_formats, audio_formats)
+        }
+
+def thumbnail_url(info):
+    """Link to info's thumbnail on our own origin, remembering where the original is"""
+    source = info.get('thumbnail')
+    if not source:
+        return ''
+    key = thumbnail_key(info)
+    download_progress.set(f'thumb:{key}', {
+        'url': source,
+        'http_headers': info.get('http_headers') or {}
+    }, ttl=THUMBNAIL_SOURCE_TTL)
+    return f'/thumbnail/{key}'
+
 @app.route('/fetch_info', methods=['POST'])
 def fetch_info():
     url = ''
-    ydl_opts = {}
     try:
         data = request.get_json()
         url = data.get('url')
@@ -86,501 +440,990 @@ def fetch_info():
         if not url:
             return jsonify({'error': 'URL is required'}), 400
 
-        # Enhanced options for Instagram and other platforms
-        ydl_opts = {
+        # Repeat requests for the same media share one extraction
+        media_info = info_cache.get_or_compute(canonical_url(url), lambda: extract_media_info(url))
+
+        if media_info is None:
+            metrics.inc('achek_fetch_info_total', {'platform': detect_platform(url), 'result': 'empty'})
+            return jsonify({'error': 'Could not extract media information'}), 400
+
+        metrics.inc('achek_fetch_info_total', {'platform': detect_platform(url), 'result': 'ok'})
+        return jsonify(media_info)
+
+    except Throttled as e:
+        metrics.inc('achek_fetch_info_total', {'platform': e.platform, 'result': 'throttled'})
+        return throttled_response(e)
+
+    except Exception as e:
+        if is_download_error(e):
+            print(f"Download Error: {e}")
+            record_fetch_error(url, e)
+            _, message = classify_error(detect_platform(url), e)
+            return jsonify({'error': message}), 400
+
+        print(f"ERROR: {e}")
+        record_fetch_error(url, e)
+        _, message = classify_error(detect_platform(url), e, unexpected=True)
+        return jsonify({'error': message}), 400
+
+@contextlib.contextmanager
+def platform_call(platform):
+    """Run one extraction under the platform's rate limit and circuit breaker, raises Throttled"""
+    try:
+        with platform_guard.guard(platform, lambda e: breaker_reason(platform, e)):
+            yield
+    except Throttled as e:
+        metrics.inc('achek_throttled_total', {'platform': platform, 'reason': e.reason})
+        raise
+
+def throttled_response(e):
+    """503 with Retry-After for a request the platform guard refused without calling the platform"""
+    minutes = max(1, round(e.retry_after / 60))
+    response = jsonify({
+        'error': f'⏰ This platform is limiting our requests right now. Please try again in about {minutes} minute(s).',
+        'reason': e.reason,
+        'retry_after': e.retry_after
+    })
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+def record_fetch_error(url, e):
+    labels = {'platform': detect_platform(url or '')}
+    metrics.inc('achek_fetch_info_total', dict(labels, result='error'))
+    metrics.inc('achek_errors_total', dict(labels, stage='extract', error_class=error_class(e)))
+
+def progress_hook(d, progress, timer=None):
+    """Feed one yt-dlp progress update to the job's progress record and timer"""
+    if timer is not None:
+        timer.progress(d)
+
+    if d['status'] == 'downloading':
+        progress.update(d.get('downloaded_bytes') or 0, d.get('total_bytes') or d.get('total_bytes_estimate') or 0)
+    elif d['status'] == 'finished':
+        progress.finish()
+
+@app.route('/cache_stats')
+def cache_stats():
+    """Hit/miss counters for the server-side caches"""
+    return jsonify({
+        'info_cache': info_cache.stats(),
+        'download_cache': download_cache.stats(),
+        'storage': storage.stats(),
+        'connections': connection_budget.stats(),
+        'pages': landing_pages.stats(),
+        'thumbnails': thumbnail_cache.stats(),
+        'ydl_pool': ydl_pool.stats()
+    })
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of job, cache, queue, disk and platform metrics across all workers"""
+    # Disk usage as of the leader's last scan, so scrapes never walk the folder
+    usage = storage.stats()
+    shared = [
+        ('achek_download_folder_bytes', {}, usage['disk_bytes']),
+        ('achek_storage_reserved_bytes', {}, usage['reserved_bytes']),
+        ('achek_storage_budget_bytes', {}, usage['budget_bytes']),
+        ('achek_download_connections', {'state': 'total'}, connection_budget.total),
+    ]
+    # Breakers and buckets already live in the shared database
+    for platform, status in platform_guard.snapshot().items():
+        shared.append(('achek_breaker_state', {'platform': platform}, BREAKER_STATES[status['state']]))
+        if 'tokens' in status:
+            shared.append(('achek_rate_limit_tokens', {'platform': platform}, status['tokens']))
+    return Response(metrics.render(shared), mimetype='text/plain; version=0.0.4')
+
+@app.route('/platform_status')
+def platform_status():
+    """Circuit breaker and rate limit state per platform, shared by all workers"""
+    return jsonify(platform_guard.snapshot())
+
+@app.route('/file/<download_id>')
+def deliver_file(download_id):
+    """Send a finished download named after its media title, resumable through Range and If-Range"""
+    record = download_progress.get(f'file:{download_id}')
+    if record is None:
+        return jsonify({'error': 'Download link expired. Please start the download again.'}), 404
+
+    path = os.path.abspath(os.path.join(DOWNLOAD_FOLDER, record['file']))
+    if not os.path.isfile(path):
+        return jsonify({'error': 'This file is no longer on the server. Please start the download again.'}), 410
+
+    filename = media_filename(record.get('title'), os.path.splitext(path)[1].lstrip('.'))
+    token = storage.pin(record['file'], STORAGE_PIN_TTL)
+    if FILE_DELIVERY in ('x-accel', 'x-sendfile'):
+        # The proxy streams the bytes and handles Range itself; it reads the
+        # file after we return, so the pin is left to expire
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        if FILE_DELIVERY == 'x-accel':
+            response.headers['X-Accel-Redirect'] = FILE_ACCEL_PREFIX + quote(record['file'].replace(os.sep, '/'))
+        else:
+            response.headers['X-Sendfile'] = path
+    else:
+        # Full responses go out through wsgi.file_wrapper, which gunicorn sends with sendfile()
+        response = send_file(path, mimetype=mimetypes.guess_type(filename)[0], conditional=True, etag=True)
+        # Werkzeug only announces ranges on 206 responses; download managers look for it up front
+        response.headers['Accept-Ranges'] = 'bytes'
+        on_response_close(response, lambda: storage.unpin(token))
+
+    response.headers['Content-Disposition'] = content_disposition(filename)
+    response.headers['Cache-Control'] = f'private, max-age={FILE_LINK_TTL}'
+    return response
+
+@app.route('/thumbnail/<key>')
+def thumbnail(key):
+    """Small WebP or JPEG preview of a /fetch_info thumbnail, fetched from the platform once"""
+    if not is_thumbnail_key(key):
+        return jsonify({'error': 'Thumbnail not found'}), 404
+
+    fmt = thumbnail_cache.format_for(request.headers.get('Accept'))
+    path = thumbnail_cache.lookup(key, fmt)
+    if path is None:
+        record = download_progress.get(f'thumb:{key}')
+        if record is None:
+            return jsonify({'error': 'Thumbnail not found'}), 404
+        try:
+            path, fmt = thumbnail_cache.produce(key, record, fmt)
+        except Exception as e:
+            print(f"Thumbnail Error: {e}")
+            # The platform's own image still makes a preview, just a slower one
+            response = redirect(record['url'])
+            response.headers['Cache-Control'] = 'no-store'
+            return response
+
+    response = send_file(path, mimetype=thumbnail_cache.mimetype(fmt), conditional=True,
+                         etag=f'{key}-{fmt}', max_age=THUMBNAIL_MAX_AGE)
+    response.headers['Vary'] = 'Accept'
+    return response
+
+@app.after_request
+def pin_served_download(response):
+    """Keep a file under DOWNLOAD_FOLDER from being evicted until its response has been sent"""
+    filename = (request.view_args or {}).get('filename', '')
+    if request.endpoint == 'static' and filename.startswith('downloads/') and response.status_code in (200, 206):
+        token = storage.pin(filename[len('downloads/'):], STORAGE_PIN_TTL)
+        on_response_close(response, lambda: storage.unpin(token))
+    return response
+
+def on_response_close(response, callback):
+    """Run callback once the server has finished sending response"""
+    if not response.direct_passthrough:
+        response.call_on_close(callback)
+        return
+    # send_file bodies go to the server's wsgi.file_wrapper as they are,
+    # skipping call_on_close; the server still calls their close()
+    body = response.response
+    close = getattr(body, 'close', None)
+
+    def close_and_unpin():
+        try:
+            if close is not None:
+                close()
+        finally:
+            callback()
+
+    body.close = close_and_unpin
+
+@app.route('/progress/<download_id>')
+def get_progress(download_id):
+    """Endpoint to check download progress"""
+    progress = public_progress(download_id, {'status': 'not_found', 'percentage': 0})
+    return jsonify(progress)
+
+def progress_events(download_id):
+    """Server-Sent Events chunks for a download's progress, None between polls
+
+    The caller waits 1 / PROGRESS_STREAM_RATE seconds on each None, so the
+    same feed serves the threaded route below and the event loop of asgi.py.
+    """
+    deadline = time.time() + PROGRESS_STREAM_TIMEOUT
+    last = None
+    last_sent = time.time()
+    # Browsers reconnect after this many ms when we close at the deadline
+    yield 'retry: 1000\n\n'
+    while time.time() < deadline:
+        progress = public_progress(download_id, {'status': 'not_found', 'percentage': 0})
+        # Only changes are sent, so at most PROGRESS_STREAM_RATE updates per second
+        if progress != last:
+            yield f'data: {json.dumps(progress)}\n\n'
+            last = progress
+            last_sent = time.time()
+        elif time.time() - last_sent > 15:
+            yield ': keep-alive\n\n'
+            last_sent = time.time()
+        if progress['status'] in ('complete', 'error', 'not_found'):
+            return
+        yield None
+
+@app.route('/progress_stream/<download_id>')
+def progress_stream(download_id):
+    """Server-Sent Events feed of download progress, closed once the job finishes"""
+    def events():
+        for chunk in progress_events(download_id):
+            if chunk is None:
+                time.sleep(1.0 / PROGRESS_STREAM_RATE)
+            else:
+                yield chunk
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers.update(PROGRESS_STREAM_HEADERS)
+    return response
+
+def job_started(download_id):
+    """Response for a queued or followed job, with a progress stream link when streams are cheap"""
+    payload = {'success': True, 'download_id': download_id}
+    if app.config['PROGRESS_STREAMING']:
+        payload['progress_stream'] = f'/progress_stream/{download_id}'
+    return jsonify(payload)
+
+@app.route('/retry_download', methods=['POST'])
+def retry_download():
+    """Retry a failed or interrupted download, resuming from the partial files of the last attempt"""
+    data = request.get_json()
+    download_id = data.get('download_id')
+
+    if not download_id:
+        return jsonify({'error': 'Download ID is required'}), 400
+
+    job = download_progress.get(job_key(download_id))
+    if job is None:
+        return jsonify({'error': 'Download not found or expired. Please start the download again.'}), 404
+
+    # Running here or in another worker, or already finished: just follow it
+    if job['state'] == 'done' or (job['state'] != 'failed' and process_alive(job['owner'])):
+        return job_started(download_id)
+
+    claimed = download_progress.update_if(
+        job_key(download_id),
+        lambda record: record.get('state') == job['state'] and record.get('owner') == job['owner'],
+        ttl=JOB_RESUME_TTL, state='queued', owner=os.getpid(), attempts=0)
+    if not claimed:
+        return job_started(download_id)
+
+    download_progress.set(download_id, {
+        'status': 'queued',
+        'percentage': 0,
+        'message': 'Resuming download...',
+        'queued_at': time.time(),
+        'type': job['type']
+    })
+    try:
+        queue_job(download_id, job)
+    except QueueFull as e:
+        download_progress.update(job_key(download_id), ttl=JOB_RESUME_TTL, state='failed')
+        response = jsonify({'error': '⏳ The server is busy right now. Please try again in a moment.',
+                            'retry_after': e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+
+    return job_started(download_id)
+
+@app.route('/start_download', methods=['POST'])
+def start_download():
+    """Queue a download and return download_id for progress tracking"""
+    try:
+        data = request.get_json()
+        url = data.get('url')
+        format_id = data.get('format_id')
+        download_type = data.get('type', 'video')
+        audio_format = data.get('audio_format', 'mp3')
+
+        if not url:
+            return jsonify({'error': 'URL is required'}), 400
+        if audio_format not in AUDIO_FORMATS:
+            return jsonify({'error': f"audio_format must be one of: {', '.join(AUDIO_FORMATS)}"}), 400
+
+        # Refuse up front while the platform's breaker is open
+        blocked = platform_guard.blocked(detect_platform(url))
+        if blocked:
+            return throttled_response(Throttled(detect_platform(url), 'circuit_open', blocked))
+
+        # Generate unique download ID
+        download_id = str(uuid.uuid4())
+        timestamp = int(time.time())
+
+        # Initialize progress
+        download_progress.set(download_id, {
+            'status': 'queued',
+            'percentage': 0,
+            'message': 'Waiting in queue...',
+            'timestamp': timestamp,
+            'queued_at': time.time(),
+            'type': download_type
+        })
+
+        try:
+            queue_job(download_id, save_job(download_id, url, format_id, download_type, audio_format))
+        except QueueFull as e:
+            discard_job(download_id)
+            response = jsonify({'error': '⏳ The server is busy right now. Please try again in a moment.',
+                                'retry_after': e.retry_after})
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 429
+
+        # Return download_id immediately so client can start polling
+        return job_started(download_id)
+
+    except Exception as e:
+        return jsonify({'error': f'Failed to start download: {str(e)}'}), 500
+
+def download_options(download_type, format_id, audio_format='mp3'):
+    """yt-dlp options for downloading format_id as 'audio' or 'video', without output or hooks
+
+    Audio is downloaded as served; the stream that needs the least work to
+    become audio_format is preferred and convert_audio() does the rest.
+    """
+    if download_type == 'audio':
+        return {
+            'format': format_id if format_id else audio_selector(audio_format),
             'quiet': True,
             'no_warnings': True,
-            'extract_flat': False,
             'socket_timeout': 30,
             'retries': 5,
+            # Pick up .part files an interrupted attempt left in the job folder
+            'continuedl': True,
             'geo_bypass': True,
-            'geo_bypass_country': 'US',
-            'age_limit': None,
             'nocheckcertificate': True,
             'source_address': '0.0.0.0',
             'force_ipv4': True,
             'http_headers': {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
+                'Accept': '*/*',
                 'Accept-Language': 'en-US,en;q=0.9',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1',
-                'Sec-Fetch-Dest': 'document',
-                'Sec-Fetch-Mode': '',
-                'Sec-Fetch-Site': 'none',
-                'Sec-Fetch-User': '?1',
-                'Cache-Control': 'max-age=0',
             },
             'extractor_args': {
-                'instagram': {
-                    'include_stories': True,
-                    'include_highlights': True,
-                },
-                'twitter': {
-                    'api': 'syndication',
-                },
-                'tiktok': {
-                    'api': 'mobile_app',
-                    'webpage_download': True,
-                },
                 'youtube': {
                     'player_client': ['android', 'web'],
-                    'skip': ['hls', 'dash'],
                 },
-                'facebook': {
-                    'legacy_api': False,
+            },
+        }
+    else:
+        video_format = format_id if format_id else 'bestvideo+bestaudio/best'
+        return {
+            'format': video_format,
+            'quiet': True,
+            'no_warnings': True,
+            'merge_output_format': 'mp4',
+            'socket_timeout': 30,
+            'retries': 5,
+            # Pick up .part files an interrupted attempt left in the job folder
+            'continuedl': True,
+            'geo_bypass': True,
+            'nocheckcertificate': True,
+            'source_address': '0.0.0.0',
+            'force_ipv4': True,
+            'http_headers': {
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36',
+                'Accept': '*/*',
+                'Accept-Language': 'en-US,en;q=0.9',
+            },
+            'extractor_args': {
+                'youtube': {
+                    'player_client': ['android', 'web'],
                 },
             },
-            'force_generic_extractor': False,
         }
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-
-            if info is None:
-                return jsonify({'error': 'Could not extract media information'}), 400
-
-            # Get video formats
-            video_formats = []
-            audio_formats = []
-
-            if 'formats' in info and info['formats']:
-                for f in info['formats']:
-                    # Video formats (has video and optionally audio)
-                    if f.get('vcodec') != 'none':
-                        quality = f.get('format_note', f.get('quality', 'Unknown'))
-                        height = f.get('height', 0)
-                        ext = f.get('ext', 'mp4')
-                        filesize = f.get('filesize', 0) or f.get('filesize_approx', 0)
-                        filesize_mb = round(filesize / (1024 * 1024), 2) if filesize else 'Unknown'
-
-                        video_formats.append({
-                            'format_id': f.get('format_id'),
-                            'quality': f"{height}p" if height else quality,
-                            'ext': ext,
-                            'filesize': filesize_mb
-                        })
-
-                    # Audio-only formats
-                    elif f.get('acodec') != 'none' and f.get('vcodec') == 'none':
-                        abr = f.get('abr', 0)
-                        ext = f.get('ext', 'mp3')
-                        filesize = f.get('filesize', 0) or f.get('filesize_approx', 0)
-                        filesize_mb = round(filesize / (1024 * 1024), 2) if filesize else 'Unknown'
-
-                        audio_formats.append({
-                            'format_id': f.get('format_id'),
-                            'quality': f"{int(abr)}kbps" if abr else 'Audio',
-                            'ext': ext,
-                            'filesize': filesize_mb
-                        })
-
-                # Remove duplicates and sort
-                video_formats = list({v['format_id']: v for v in video_formats}.values())
-                audio_formats = list({a['format_id']: a for a in audio_formats}.values())
-
-                video_formats = sorted(video_formats, key=lambda x: int(x['quality'].replace('p', '')) if x['quality'].replace('p', '').isdigit() else 0, reverse=True)
-                audio_formats = sorted(audio_formats, key=lambda x: int(x['quality'].replace('kbps', '')) if 'kbps' in x['quality'] else 0, reverse=True)
-
-            return jsonify({
-                'success': True,
-                'title': info.get('title', 'Unknown Title'),
-                'thumbnail': info.get('thumbnail', ''),
-                'uploader': info.get('uploader', 'Unknown'),
-                'duration': info.get('duration_string', 'Unknown'),
-                'video_formats': video_formats[:15],
-                'audio_formats': audio_formats[:8]
-            })
-
-    except yt_dlp.utils.DownloadError as e:
-        error_msg = str(e)
-        print(f"Download Error: {error_msg}")
-
-        # Detect platform from URL for accurate error messages
-        platform = 'unknown'
-        if url:
-            url_lower = url.lower()
-            if 'tiktok.com' in url_lower or 'vm.tiktok.com' in url_lower:
-                platform = 'tiktok'
-            elif 'instagram.com' in url_lower:
-                platform = 'instagram'
-            elif 'youtube.com' in url_lower or 'youtu.be' in url_lower:
-                platform = 'youtube'
-            elif 'twitter.com' in url_lower or 'x.com' in url_lower:
-                platform = 'twitter'
-            elif 'facebook.com' in url_lower or 'fb.watch' in url_lower or 'fb.me' in url_lower:
-                platform = 'facebook'
-            elif 'spotify.com' in url_lower:
-                platform = 'spotify'
-            elif 'audiomack.com' in url_lower:
-                platform = 'audiomack'
-            elif 'soundcloud.com' in url_lower:
-                platform = 'soundcloud'
-            elif 'vimeo.com' in url_lower:
-                platform = 'vimeo'
-            elif 'netflix.com' in url_lower:
-                platform = 'netflix'
-
-        # Platform-specific error handling with detailed messages
-        if platform == 'tiktok':
-            if 'Unable to extract' in error_msg or 'webpage video data' in error_msg or 'video data' in error_msg.lower():
-                return jsonify({'error': '📱 TikTok Error: Unable to access this video. Possible reasons:\n• Video is private or deleted\n• Account is private\n• Video is region-locked\n• TikTok is blocking automated access\n\nSolutions:\n✓ Make sure the video is public\n✓ Try a different TikTok video\n✓ Wait 2-3 minutes and try again\n✓ Copy the link directly from TikTok app/website'}), 400
-            elif 'Login required' in error_msg or 'sign in' in error_msg.lower():
-                return jsonify({'error': '📱 TikTok requires login to access this content. Only public videos from public accounts can be downloaded without authentication.'}), 400
-            else:
-                return jsonify({'error': '📱 TikTok download failed. The video may be unavailable or TikTok is blocking requests. Wait 2-3 minutes and try again with a different video.'}), 400
-
-        elif platform == 'instagram':
-            if 'rate-limit' in error_msg.lower() or 'rate limit' in error_msg.lower():
-                return jsonify({'error': '📸 Instagram Rate Limit: Too many requests detected.\n\nSolutions:\n✓ Wait 5-10 minutes before trying again\n✓ Instagram blocks automated downloads temporarily\n✓ Try a different post in the meantime\n✓ Make sure the post is public'}), 400
-            elif 'login required' in error_msg.lower() or 'authentication' in error_msg.lower():
-                return jsonify({'error': '📸 Instagram Login Required: This content requires authentication.\n\nPossible reasons:\n• Post is from a private account\n• Content is age-restricted\n• Instagram is blocking automated access\n\nOnly public posts and reels can be downloaded.'}), 400
-            elif 'not available' in error_msg.lower() or 'content is not available' in error_msg.lower():
-                return jsonify({'error': '📸 Instagram Content Unavailable:\n• Post may be deleted or made private\n• Story/Highlight has expired\n• Account is private or blocked\n• Region restrictions apply\n\nTry a different public post or reel.'}), 400
-            elif 'private' in error_msg.lower():
-                return jsonify({'error': '📸 This Instagram account/post is private. Only public content can be downloaded.'}), 400
-            else:
-                return jsonify({'error': '📸 Instagram Error: Unable to fetch content. Instagram may be blocking requests.\n\nSolutions:\n✓ Wait 5-10 minutes and try again\n✓ Make sure the post/reel is public\n✓ Try copying the link directly from Instagram app\n✓ Use a different public post'}), 400
-
-        elif platform == 'youtube':
-            if 'private' in error_msg.lower() or 'unavailable' in error_msg.lower():
-                return jsonify({'error': '🎬 YouTube video is private, deleted, or unavailable in your region.'}), 400
-            elif 'age' in error_msg.lower() or 'restricted' in error_msg.lower():
-                return jsonify({'error': '🔞 This YouTube video is age-restricted and requires login to access.'}), 400
-            elif 'live' in error_msg.lower():
-                return jsonify({'error': '📡 Live streams cannot be downloaded. Wait until the stream ends and try again.'}), 400
-            else:
-                return jsonify({'error': '🎬 YouTube download failed. The video may be region-locked, removed, or have download restrictions.'}), 400
-
-        elif platform == 'facebook':
-            if 'login required' in error_msg.lower() or 'private' in error_msg.lower():
-                return jsonify({'error': '📘 Facebook content is private or requires login. Only public videos can be downloaded.'}), 400
-            else:
-                return jsonify({'error': '📘 Facebook download failed. Make sure the video is public and not from a private group or profile.'}), 400
+def postprocessor_hook(d, download_id, outputs, timer=None):
+    """Hook reporting postprocessing steps and recording the files they produce"""
+    if timer is not None:
+        timer.postprocess(d)
+
+    if d['status'] == 'started' and d['postprocessor'] != 'MoveFiles':
+        download_progress.update(download_id, status='processing', message='Processing file...')
+    elif d['status'] == 'finished' and d['postprocessor'] == 'MoveFiles':
+        outputs.append(d['info_dict'].get('filepath'))
+
+def downloaded_filepath(info, outputs):
+    """Final path of the first file yt-dlp produced, read from the processed info dict"""
+    for entry in [info] + list(info.get('entries') or []):
+        for requested in (entry or {}).get('requested_downloads') or []:
+            if requested.get('filepath'):
+                return requested['filepath']
+    # Fall back to what the postprocessor hook saw being moved into place
+    return next((path for path in outputs if path), None)
+
+def output_ext(info, plan):
+    """Extension the finished file will have once audio conversion is done"""
+    return plan['ext'] if plan else info.get('ext')
+
+def convert_audio(filepath, plan, download_id, timer):
+    """Remux or transcode a downloaded audio file as planned, returns the new path"""
+    if not plan or plan['action'] == 'keep':
+        return filepath
+    download_progress.update(download_id, status='processing',
+                             message='Converting audio...' if plan['action'] == 'transcode' else 'Processing file...')
+    with timer.span('transcode' if plan['action'] == 'transcode' else 'remux'):
+        return audio_converter.convert(filepath, plan)
+
+def save_job(download_id, url, format_id, download_type, audio_format='mp3', result_ttl=RESULT_PROGRESS_TTL):
+    """Persist what another worker needs to resume the job, returns the job record"""
+    job = {
+        'url': url,
+        'format_id': format_id,
+        'type': download_type,
+        'audio_format': audio_format,
+        'result_ttl': result_ttl,
+        'state': 'queued',
+        'owner': os.getpid(),
+        'attempts': 0
+    }
+    os.makedirs(job_folder(download_id), exist_ok=True)
+    download_progress.set(job_key(download_id), job, ttl=JOB_RESUME_TTL)
+    return job
+
+def discard_job(download_id):
+    download_progress.delete(download_id)
+    download_progress.delete(job_key(download_id))
+    shutil.rmtree(job_folder(download_id), ignore_errors=True)
+
+def queue_job(download_id, job, on_done=None):
+    """Put a saved job on this worker's download queue, raises QueueFull (or StorageFull)
+
+    on_done runs once this attempt has finished, whatever its outcome.
+    """
+    storage.check_room()
+    run = run_download
+    if on_done is not None:
+        def run(*args):
+            try:
+                run_download(*args)
+            finally:
+                on_done()
+    download_queue.submit(download_id, detect_platform(job['url']), run,
+                          download_id, job['url'], job['format_id'], job['type'], job.get('audio_format', 'mp3'),
+                          job['result_ttl'])
+
+def resume_job(download_id):
+    """Queue a saved job again, failing it if the queue is full"""
+    job = download_progress.get(job_key(download_id))
+    if job is None:
+        return
+    try:
+        queue_job(download_id, job)
+    except QueueFull:
+        fail_job(download_id, job['result_ttl'], 'busy',
+                 '⏳ The server is busy right now. Please try again in a moment.')
+
+def schedule_retry(download_id, attempt):
+    """Retry a job after a growing backoff, continuing from its partial files"""
+    delay = JOB_RETRY_DELAY * attempt
+    requeue_job(download_id, delay, f'Connection lost, resuming in {delay}s...')
+
+def defer_job(download_id, attempt, delay):
+    """Run a throttled job again once its platform accepts calls, without spending one of its attempts"""
+    requeue_job(download_id, delay, f'The platform is busy, starting in {delay}s...', attempts=attempt - 1)
+
+def requeue_job(download_id, delay, message, **fields):
+    """Queue a job again after delay seconds"""
+    download_progress.update(job_key(download_id), ttl=JOB_RESUME_TTL, state='queued', **fields)
+    download_progress.update(download_id, status='queued', message=message)
+    retry = threading.Timer(delay, resume_job, args=(download_id,))
+    retry.daemon = True
+    retry.start()
+
+def fail_job(download_id, result_ttl, reason, message):
+    """Report a job as failed; its partial files stay for JOB_RESUME_TTL so /retry_download can resume"""
+    download_progress.set(download_id, {
+        'status': 'error',
+        'percentage': 0,
+        'reason': reason,
+        'message': message,
+        'resumable': True
+    }, ttl=result_ttl)
+    download_progress.update(job_key(download_id), ttl=JOB_RESUME_TTL, state='failed')
+
+def run_download(download_id, url, format_id, download_type, audio_format='mp3', result_ttl=RESULT_PROGRESS_TTL):
+    """Download job executed on the download queue, reports through download_progress"""
+    platform = detect_platform(url)
+    timer = JobTimer(platform)
+    queued_at = (download_progress.get(download_id) or {}).get('queued_at')
+    if queued_at:
+        timer.add('queue_wait', time.time() - queued_at)
+
+    attempt = (download_progress.get(job_key(download_id)) or {}).get('attempts', 0) + 1
+    download_progress.update(job_key(download_id), ttl=JOB_RESUME_TTL,
+                             state='running', owner=os.getpid(), attempts=attempt)
+    stored = 0
 
-        elif platform == 'twitter':
-            if 'no video' in error_msg.lower() or 'no media' in error_msg.lower():
-                return jsonify({'error': '😕 This tweet doesn\'t contain a video. We can only download tweets with video content.'}), 400
-            elif 'private' in error_msg.lower() or 'protected' in error_msg.lower():
-                return jsonify({'error': '🔒 This Twitter/X account is private. Only public tweets can be downloaded.'}), 400
-            else:
-                return jsonify({'error': '❌ Twitter/X download failed. Make sure the tweet is public and contains video content.'}), 400
+    try:
+        # Update progress status
+        download_progress.update(download_id, status='downloading', message='Starting download...')
 
-        elif platform == 'spotify':
-            return jsonify({'error': '🎧 Spotify Error: Spotify uses DRM protection and requires premium subscription.\n\nThis content cannot be downloaded directly. Spotify restricts downloading to prevent piracy.'}), 400
+        outputs = []
+        progress = JobProgress(download_progress, download_id)
+        ydl_opts = download_options(download_type, format_id, audio_format)
 
-        elif platform == 'audiomack':
-            return jsonify({'error': '🎵 Audiomack download failed.\n\nPossible reasons:\n• Track is premium-only\n• Content is region-locked\n• Link is invalid\n\nSolutions:\n✓ Make sure the track is publicly available\n✓ Copy the link directly from Audiomack\n✓ Try a different free track'}), 400
+        with ydl_pool.acquire('audio' if download_type == 'audio' else 'video',
+                              format=ydl_opts['format'],
+                              outtmpl=os.path.join(job_folder(download_id), '%(id)s.%(ext)s'),
+                              progress_hooks=[lambda d: progress_hook(d, progress, timer)],
+                              postprocessor_hooks=[lambda d: postprocessor_hook(d, download_id, outputs, timer)]) as ydl:
+            with timer.span('extract'), platform_call(platform):
+                info = ydl.extract_info(url, download=False)
 
-        elif platform == 'soundcloud':
-            if 'private' in error_msg.lower():
-                return jsonify({'error': '🎶 This SoundCloud track is private. Only public tracks can be downloaded.'}), 400
-            else:
-                return jsonify({'error': '🎶 SoundCloud download failed. Make sure the track is public and not premium-only.'}), 400
+            plan = None
+            if info is not None and download_type == 'audio':
+                # Planned from the selected format, for playlists from the first entry
+                plan = plan_audio(next(iter(info.get('entries') or []), None) or info, audio_format)
 
-        elif platform == 'vimeo':
-            if 'password' in error_msg.lower() or 'private' in error_msg.lower():
-                return jsonify({'error': '🎥 This Vimeo video is password-protected or private. Only public videos can be downloaded.'}), 400
+            if info is None:
+                download_path = None
+            elif info.get('_type', 'video') != 'video':
+                # Playlists and multi-part media are not cached and are served from the job folder
+                reserve_storage(download_id, info, timer)
+                with download_connections(ydl):
+                    info = ydl.process_ie_result(info, download=True)
+                filepath = downloaded_filepath(info, outputs)
+                if filepath:
+                    filepath = convert_audio(filepath, plan, download_id, timer)
+                download_path = os.path.relpath(filepath, DOWNLOAD_FOLDER) if filepath else None
             else:
-                return jsonify({'error': '🎥 Vimeo download failed. The video may have download restrictions or be private.'}), 400
-
-        elif platform == 'netflix':
-            return jsonify({'error': '🎬 Netflix content is DRM-protected and cannot be downloaded. This is a copyright restriction enforced by Netflix.'}), 400
-
-        # Generic error handling for other platforms
-        if 'DRM' in error_msg or 'protected' in error_msg.lower():
-            return jsonify({'error': '🔒 This content is DRM-protected and cannot be downloaded due to copyright restrictions.'}), 400
-        elif '429' in error_msg or 'Too Many Requests' in error_msg or 'rate limit' in error_msg.lower():
-            return jsonify({'error': '⏰ Rate Limit Reached: Too many requests.\n\nPlease wait 5-10 minutes and try again. The platform is temporarily blocking automated downloads.'}), 400
-        elif 'geo' in error_msg.lower() or 'region' in error_msg.lower():
-            return jsonify({'error': '🌍 This content is region-locked and not available in your location.'}), 400
-        elif 'private' in error_msg.lower():
-            return jsonify({'error': '🔒 This content is private. Only public content can be downloaded.'}), 400
-        elif 'login' in error_msg.lower() or 'sign in' in error_msg.lower() or 'authentication' in error_msg.lower():
-            return jsonify({'error': '🔐 Login required. Only public content can be downloaded without authentication.'}), 400
-        elif 'no video' in error_msg.lower() or 'no media' in error_msg.lower():
-            return jsonify({'error': '📭 No video found. This post may contain only images or text.'}), 400
+                # Everything besides the format that changes the output file
+                output_options = {
+                    'type': download_type,
+                    'audio': plan,
+                    'merge_output_format': ydl_opts.get('merge_output_format'),
+                }
+                key = cache_key(info, output_options)
+                download_path = download_cached(ydl, info, key, output_ext(info, plan), download_id, outputs,
+                                                timer, plan)
+
+        if not download_path:
+            fail_job(download_id, result_ttl, 'no_file',
+                     '⚠️ Download failed: no file was created. Please try a different format.')
+            timer.finish(metrics, download_id, 'error', 'NoFile')
+            return
+
+        if not timer.cache_hit:
+            stored = os.path.getsize(os.path.join(DOWNLOAD_FOLDER, download_path))
+        # Keep the result around long enough for the client to collect it
+        storage.pin(download_path, STORAGE_COLLECT_TTL)
+        download_progress.set(f'file:{download_id}', {
+            'file': download_path,
+            'title': info.get('title')
+        }, ttl=max(result_ttl, FILE_LINK_TTL))
+        download_progress.set(download_id, {
+            'status': 'complete',
+            'percentage': 100,
+            'message': 'Download complete!',
+            'download_url': f'/file/{download_id}',
+            'file': download_path,
+            'title': info.get('title')
+        }, ttl=result_ttl)
+        download_progress.update(job_key(download_id), ttl=JOB_RESUME_TTL, state='done')
+        timer.finish(metrics, download_id, 'complete')
+
+    except Throttled as e:
+        if e.retry_after <= THROTTLE_MAX_WAIT:
+            defer_job(download_id, attempt, e.retry_after)
+            timer.finish(metrics, download_id, 'retry', 'Throttled')
+            return
+        minutes = max(1, round(e.retry_after / 60))
+        fail_job(download_id, result_ttl, 'rate_limited',
+                 f'⏰ This platform is limiting our requests right now. Please try again in about {minutes} minute(s).')
+        timer.finish(metrics, download_id, 'error', 'Throttled')
+
+    except StorageFull as e:
+        if e.needed > storage.max_bytes:
+            fail_job(download_id, result_ttl, 'too_large',
+                     '💾 This file is too large for our server. Please choose a lower quality.')
         else:
-            return jsonify({'error': f'⚠️ Download Error: Unable to access this content.\n\nPossible reasons:\n• Content is unavailable or deleted\n• Platform is blocking automated access\n• Link is invalid\n\nPlease try:\n✓ Checking if the content is public\n✓ Waiting a few minutes and trying again\n✓ Using a different link'}), 400
+            fail_job(download_id, result_ttl, 'storage_full',
+                     '💾 The server is short on disk space right now. Please try again in a few minutes.')
+        timer.finish(metrics, download_id, 'error', 'StorageFull')
 
     except Exception as e:
-        error_message = str(e)
-        print(f"ERROR: {error_message}")
-
-        # Detect platform from URL
-        platform = 'unknown'
-        if url:
-            url_lower = url.lower()
-            if 'instagram.com' in url_lower:
-                platform = 'instagram'
-            elif 'tiktok.com' in url_lower:
-                platform = 'tiktok'
-            elif 'youtube.com' in url_lower or 'youtu.be' in url_lower:
-                platform = 'youtube'
-            elif 'facebook.com' in url_lower or 'fb.watch' in url_lower:
-                platform = 'facebook'
-            elif 'twitter.com' in url_lower or 'x.com' in url_lower:
-                platform = 'twitter'
-            elif 'spotify.com' in url_lower:
-                platform = 'spotify'
-            elif 'audiomack.com' in url_lower:
-                platform = 'audiomack'
-            elif 'netflix.com' in url_lower:
-                platform = 'netflix'
-
-        # Provide more helpful, user-friendly error messages based on detected platform
-        if platform == 'twitter':
-            if 'no video' in error_message.lower():
-                error_message = "😕 This tweet doesn't have a video. We can only download tweets that contain videos."
-            else:
-                error_message = "❌ Couldn't access this Twitter/X content. Make sure the tweet is public and contains media."
-        elif platform == 'instagram':
-            error_message = "📸 Instagram temporarily blocked this request. Please wait 2-3 minutes and try again. Make sure you're using a public post or reel link."
-        elif platform == 'tiktok':
-            error_message = "📱 TikTok download failed. Make sure the video is public and the link is correct. If it's a private account, we can't access it."
-        elif platform == 'audiomack':
-            error_message = "🎵 Couldn't download from Audiomack. Please check the link and make sure the song is publicly available. Try copying the link directly from your browser."
-        elif 'spotify' in error_message.lower() or (url and 'spotify.com' in url.lower()):
-            error_message = "🎧 Spotify content couldn't be accessed. Make sure the track/playlist is public and the link is correct."
-        elif 'netflix' in error_message.lower() or (url and 'netflix.com' in url.lower()):
-            error_message = "🎬 Netflix content is DRM-protected and cannot be downloaded. This is due to copyright restrictions."
-        elif 'tiktok' in error_message.lower() or (url and 'tiktok.com' in url.lower()):
-            error_message = "📱 TikTok download failed. Make sure the video is public and the link is correct."
-        elif 'facebook' in error_message.lower() or (url and 'facebook.com' in url.lower()):
-            error_message = "📘 Facebook content couldn't be accessed. Only public videos can be downloaded. Private or friends-only posts won't work."
-        elif 'youtube' in error_message.lower() or (url and ('youtube.com' in url.lower() or 'youtu.be' in url.lower())):
-            if 'private' in error_message.lower():
-                error_message = "🔒 This YouTube video is private or unavailable."
-            elif 'age' in error_message.lower():
-                error_message = "🔞 Age-restricted YouTube content cannot be downloaded without login."
-            else:
-                error_message = "🎬 YouTube download failed. The video might be region-locked, removed, or live-streamed."
-        elif 'soundcloud' in error_message.lower() or (url and 'soundcloud.com' in url.lower()):
-            error_message = "🎶 SoundCloud download failed. Make sure the track is public and not premium-only."
-        elif 'vimeo' in error_message.lower() or (url and 'vimeo.com' in url.lower()):
-            error_message = "🎥 Vimeo content couldn't be accessed. Only public videos without download restrictions can be downloaded."
-        elif 'unsupported' in error_message.lower():
-            error_message = "❓ This website is not supported yet. We support YouTube, Spotify, Audiomack, Netflix, Instagram, TikTok, Facebook, and 1000+ other platforms."
-        elif 'url' in error_message.lower() or 'invalid' in error_message.lower():
-            error_message = "🔗 Invalid link format. Please copy and paste the full URL from your browser."
-        else:
-            error_message = f"⚠️ Something went wrong: {error_message}. Please try again or use a different link."
-
-        return jsonify({'error': error_message}), 400
-
+        print(f"Download Error: {e}")
+        if attempt < JOB_MAX_ATTEMPTS and is_retryable(e):
+            schedule_retry(download_id, attempt)
+            timer.finish(metrics, download_id, 'retry', error_class(e))
+            return
+        reason, message = classify_error(platform, e, unexpected=not is_download_error(e))
+        fail_job(download_id, result_ttl, reason, message)
+        timer.finish(metrics, download_id, 'error', error_class(e))
+
+    finally:
+        storage.release(download_id, stored)
+
+def reserve_storage(download_id, info, timer):
+    """Reserve disk for the projected download size, waiting up to STORAGE_WAIT seconds for room
+
+    Raises StorageFull if the download does not fit in time, or can never
+    fit in the budget.
+    """
+    size = projected_size(info)
+    if storage.reserve(download_id, size):
+        return
+    deadline = time.time() + STORAGE_WAIT
+    with timer.span('storage_wait'):
+        while size <= storage.max_bytes and time.time() < deadline:
+            download_progress.update(download_id, status='queued', message='Waiting for disk space...')
+            time.sleep(5)
+            if storage.reserve(download_id, size):
+                return
+    raise StorageFull(STORAGE_WAIT, size)
+
+@contextlib.contextmanager
+def download_connections(ydl):
+    """Let ydl's next download use up to DOWNLOAD_CONNECTIONS connections, as many as the budget grants"""
+    with connection_budget.lease(DOWNLOAD_CONNECTIONS) as connections:
+        # Read by yt-dlp's HLS/DASH downloaders and by RangedHttpFD
+        ydl.params['concurrent_fragment_downloads'] = connections
+        try:
+            yield connections
+        finally:
+            ydl.params['concurrent_fragment_downloads'] = 1
 
-def progress_hook(d, download_id):
-    """Hook function to track download progress"""
-    if d['status'] == 'downloading':
-        # Calculate progress percentage
-        if 'total_bytes' in d or 'total_bytes_estimate' in d:
-            total = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
-            downloaded = d.get('downloaded_bytes', 0)
+def download_cached(ydl, info, key, ext, download_id, outputs, timer, plan=None):
+    """Serve key from the download cache, downloading it (once per key) on a miss"""
+    while True:
+        filename = download_cache.lookup(key, ext)
+        if filename:
+            download_cache.record_hit()
+            timer.cache_hit = True
+            return filename
 
-            if total > 0:
-                percentage = int((downloaded / total) * 100)
-            else:
-                percentage = 0
-
-            # Calculate speed and ETA
-            speed = d.get('speed', 0)
-            eta = d.get('eta', 0)
-
-            download_progress[download_id] = {
-                'status': 'downloading',
-                'percentage': percentage,
-                'downloaded': downloaded,
-                'total': total,
-                'speed': speed if speed else 0,
-                'eta': eta if eta else 0
-            }
-        else:
-            download_progress[download_id] = {
-                'status': 'downloading',
-                'percentage': 0,
-                'message': 'Starting download...'
-            }
-    elif d['status'] == 'finished':
-        download_progress[download_id] = {
-            'status': 'processing',
-            'percentage': 100,
-            'message': 'Processing file...'
-        }
+        if download_cache.claim(key):
+            break
 
-@app.route('/progress/<download_id>')
-def get_progress(download_id):
-    """Endpoint to check download progress"""
-    progress = download_progress.get(download_id, {'status': 'not_found', 'percentage': 0})
-    return jsonify(progress)
+        # A job in this or another worker is producing the same file, wait for it instead of downloading again
+        download_progress.update(download_id, message='Waiting for an identical download...')
+        with timer.span('coalesced_wait'):
+            download_cache.wait(key, ext)
 
-@app.route('/start_download', methods=['POST'])
-def start_download():
-    """Initialize download and return download_id for progress tracking"""
+    try:
+        reserve_storage(download_id, info, timer)
+        with download_connections(ydl):
+            info = ydl.process_ie_result(info, download=True)
+        filepath = downloaded_filepath(info, outputs)
+        if not filepath:
+            return None
+        filepath = convert_audio(filepath, plan, download_id, timer)
+        filename = download_cache.store(key, filepath)
+        shutil.rmtree(job_folder(download_id), ignore_errors=True)
+        return filename
+    finally:
+        download_cache.release(key)
+
+@app.route('/start_stream', methods=['POST'])
+def start_stream():
+    """Resolve a format and return a /stream link if it can be relayed without touching disk"""
     try:
         data = request.get_json()
         url = data.get('url')
         format_id = data.get('format_id')
         download_type = data.get('type', 'video')
+        audio_format = data.get('audio_format', 'mp3')
 
         if not url:
             return jsonify({'error': 'URL is required'}), 400
 
-        # Generate unique download ID
-        download_id = str(uuid.uuid4())
-        timestamp = int(time.time())
+        ydl_opts = download_options(download_type, format_id, audio_format)
+        with ydl_pool.acquire('audio' if download_type == 'audio' else 'video', format=ydl_opts['format']) as ydl:
+            with platform_call(detect_platform(url)):
+                info = ydl.extract_info(url, download=False)
+            record, reason = plan_stream(info, download_type, audio_format)
+            if record is not None:
+                cookie = ydl.cookiejar.get_cookie_header(record['media_url'])
+                if cookie:
+                    record['http_headers']['Cookie'] = cookie
 
-        # Initialize progress
-        download_progress[download_id] = {
-            'status': 'starting',
-            'percentage': 0,
-            'message': 'Initializing download...',
-            'timestamp': timestamp,
-            'type': download_type
-        }
+        if record is None:
+            # Merged, transcoded or fragmented formats go through /start_download
+            return jsonify({'success': False, 'fallback': 'file', 'reason': reason})
+
+        stream_id = str(uuid.uuid4())
+        download_progress.set(f'stream:{stream_id}', record, ttl=STREAM_TTL)
 
-        # Return download_id immediately so client can start polling
         return jsonify({
             'success': True,
-            'download_id': download_id
+            'stream_url': f'/stream/{stream_id}',
+            'filename': record['filename']
         })
 
+    except Throttled:
+        # The file path defers or refuses the job with a proper message
+        return jsonify({'success': False, 'fallback': 'file', 'reason': 'throttled'})
+
     except Exception as e:
-        return jsonify({'error': f'Failed to start download: {str(e)}'}), 500
+        print(f"Stream Error: {e}")
+        return jsonify({'success': False, 'fallback': 'file', 'reason': 'error'})
+
+@app.route('/stream/<stream_id>')
+def stream(stream_id):
+    """Relay media bytes to the client as they arrive from the platform"""
+    record = download_progress.get(f'stream:{stream_id}')
+    if record is None:
+        return jsonify({'error': 'Stream link expired. Please start the download again.'}), 404
 
-@app.route('/download', methods=['POST'])
-def download():
-    download_id = None
+    try:
+        upstream = open_upstream(record, request.headers.get('Range'))
+    except Exception as e:
+        print(f"Stream Error: {e}")
+        return jsonify({'error': 'Could not reach the media server. Please try again.'}), 502
+
+    response = Response(stream_with_context(relay(upstream)), status=upstream.status_code,
+                        mimetype=upstream.headers.get('Content-Type', 'application/octet-stream'),
+                        direct_passthrough=True)
+    for header in RELAYED_HEADERS:
+        if header in upstream.headers:
+            response.headers[header] = upstream.headers[header]
+    response.headers['Content-Disposition'] = content_disposition(record['filename'])
+    return response
+
+def expand_batch_urls(url):
+    """Flat-extract url and return (url, title) for each playlist entry, or the url itself"""
+    with ydl_pool.acquire('flat') as ydl, platform_call(detect_platform(url)):
+        info = ydl.extract_info(url, download=False)
+
+    if info is None:
+        return []
+    if info.get('_type') not in ('playlist', 'multi_video'):
+        return [(url, info.get('title'))]
+    items = []
+    for entry in info.get('entries') or []:
+        entry_url = entry and (entry.get('url') or entry.get('webpage_url'))
+        if entry_url:
+            items.append((entry_url, entry.get('title')))
+    return items
+
+def run_batch(items):
+    """Feed saved batch jobs into the download queue, at most BATCH_PARALLEL at a time
+
+    Waits out a full queue or storage budget instead of failing the rest of
+    the batch; an item that cannot be queued at all is failed on its own.
+    """
+    window = threading.BoundedSemaphore(BATCH_PARALLEL)
+
+    for item in items:
+        window.acquire()
+        while True:
+            try:
+                job = download_progress.get(job_key(item['download_id']))
+                if job is None:
+                    window.release()
+                    break
+                queue_job(item['download_id'], job, on_done=window.release)
+                break
+            except QueueFull as e:
+                time.sleep(e.retry_after)
+            except Exception as e:
+                print(f"Batch Error: {e}")
+                fail_job(item['download_id'], BATCH_TTL, 'error', 'Download failed: could not be queued')
+                window.release()
+                break
+
+@app.route('/batch_download', methods=['POST'])
+def batch_download():
+    """Queue several URLs, or every entry of a playlist URL, as one batch"""
     try:
         data = request.get_json()
+        urls = data.get('urls')
         url = data.get('url')
         format_id = data.get('format_id')
         download_type = data.get('type', 'video')
-        download_id = data.get('download_id')
-
-        if not url:
+        audio_format = data.get('audio_format', 'mp3')
+
+        if audio_format not in AUDIO_FORMATS:
+            return jsonify({'error': f"audio_format must be one of: {', '.join(AUDIO_FORMATS)}"}), 400
+        if urls:
+            if not isinstance(urls, list) or not all(isinstance(u, str) for u in urls):
+                return jsonify({'error': 'urls must be a list of strings'}), 400
+            entries = [(u.strip(), None) for u in urls if u.strip()]
+        elif url:
+            if not isinstance(url, str):
+                return jsonify({'error': 'url must be a string'}), 400
+            entries = expand_batch_urls(url)
+        else:
             return jsonify({'error': 'URL is required'}), 400
 
-        if not download_id:
-            return jsonify({'error': 'Download ID is required'}), 400
+        if not entries:
+            return jsonify({'error': 'No downloadable items were found'}), 400
+        entries = entries[:BATCH_MAX_ITEMS]
 
-        timestamp = int(time.time())
+        batch_id = str(uuid.uuid4())
+        items = []
+        for entry_url, title in entries:
+            download_id = str(uuid.uuid4())
+            download_progress.set(download_id, {
+                'status': 'queued',
+                'percentage': 0,
+                'message': 'Waiting in queue...',
+                'queued_at': time.time(),
+                'type': download_type
+            }, ttl=BATCH_TTL)
+            save_job(download_id, entry_url, format_id, download_type, audio_format, result_ttl=BATCH_TTL)
+            items.append({'download_id': download_id, 'url': entry_url, 'title': title})
 
-        # Update progress status
-        if download_id in download_progress:
-            download_progress[download_id]['status'] = 'downloading'
-            download_progress[download_id]['message'] = 'Starting download...'
-
-        if download_type == 'audio':
-            output_template = os.path.join(DOWNLOAD_FOLDER, f'audio_{timestamp}.%(ext)s')
-            audio_format = format_id if format_id else 'bestaudio/best'
-            ydl_opts = {
-                'format': audio_format,
-                'outtmpl': output_template,
-                'quiet': True,
-                'no_warnings': True,
-                'progress_hooks': [lambda d: progress_hook(d, download_id)],
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '320',
-                }],
-                'socket_timeout': 30,
-                'retries': 5,
-                'geo_bypass': True,
-                'nocheckcertificate': True,
-                'source_address': '0.0.0.0',
-                'force_ipv4': True,
-                'http_headers': {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36',
-                    'Accept': '*/*',
-                    'Accept-Language': 'en-US,en;q=0.9',
-                },
-                'extractor_args': {
-                    'youtube': {
-                        'player_client': ['android', 'web'],
-                        'skip': ['hls', 'dash'],
-                    },
-                },
-            }
-        else:
-            output_template = os.path.join(DOWNLOAD_FOLDER, f'video_{timestamp}.%(ext)s')
-            video_format = format_id if format_id else 'bestvideo+bestaudio/best'
-            ydl_opts = {
-                'format': video_format,
-                'outtmpl': output_template,
-                'quiet': True,
-                'no_warnings': True,
-                'merge_output_format': 'mp4',
-                'progress_hooks': [lambda d: progress_hook(d, download_id)],
-                'socket_timeout': 30,
-                'retries': 5,
-                'geo_bypass': True,
-                'nocheckcertificate': True,
-                'source_address': '0.0.0.0',
-                'force_ipv4': True,
-                'http_headers': {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36',
-                    'Accept': '*/*',
-                    'Accept-Language': 'en-US,en;q=0.9',
-                },
-                'extractor_args': {
-                    'youtube': {
-                        'player_client': ['android', 'web'],
-                        'skip': ['hls', 'dash'],
-                    },
-                },
-            }
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
-
-        downloaded_files = [f for f in os.listdir(DOWNLOAD_FOLDER) if f.startswith(f'{download_type}_{timestamp}')]
-
-        if not downloaded_files:
-            if download_id in download_progress:
-                download_progress[download_id] = {'status': 'error', 'percentage': 0, 'message': 'No file was created'}
-                # Schedule cleanup for this error case too
-                def cleanup_no_file():
-                    time.sleep(10)
-                    download_progress.pop(download_id, None)
-                Thread(target=cleanup_no_file, daemon=True).start()
-            return jsonify({'error': 'Download failed - no file was created'}), 500
-
-        download_filename = downloaded_files[0]
-        download_url = f'/static/downloads/{download_filename}'
-
-        # Mark as complete and schedule cleanup
-        if download_id in download_progress:
-            download_progress[download_id] = {
-                'status': 'complete',
-                'percentage': 100,
-                'message': 'Download complete!'
-            }
-
-        # Schedule cleanup after 10 seconds
-        def cleanup():
-            time.sleep(10)
-            download_progress.pop(download_id, None)
-        Thread(target=cleanup, daemon=True).start()
+        download_progress.set(f'batch:{batch_id}', {'items': items, 'type': download_type}, ttl=BATCH_TTL)
+        Thread(target=run_batch, args=(items,), daemon=True).start()
 
         return jsonify({
             'success': True,
-            'download_url': download_url
+            'batch_id': batch_id,
+            'items': items,
+            'status_url': f'/batch/{batch_id}',
+            'zip_url': f'/batch/{batch_id}/zip'
         })
 
+    except Throttled as e:
+        return throttled_response(e)
+
     except Exception as e:
-        if download_id and download_id in download_progress:
-            download_progress[download_id] = {'status': 'error', 'percentage': 0, 'message': str(e)}
-            # Schedule cleanup for errored downloads too
-            def cleanup_error():
-                time.sleep(10)
-                download_progress.pop(download_id, None)
-            Thread(target=cleanup_error, daemon=True).start()
-        return jsonify({'error': f'Download failed: {str(e)}'}), 500
+        print(f"Batch Error: {e}")
+        return jsonify({'error': f'Failed to start batch: {str(e)}'}), 500
+
+@app.route('/batch/<batch_id>')
+def batch_status(batch_id):
+    """Per-item progress for a batch"""
+    batch = download_progress.get(f'batch:{batch_id}')
+    if batch is None:
+        return jsonify({'error': 'Batch not found or expired'}), 404
+
+    items = []
+    counts = {'complete': 0, 'error': 0}
+    for item in batch['items']:
+        progress = download_progress.get(item['download_id'], {'status': 'not_found', 'percentage': 0})
+        counts[progress['status']] = counts.get(progress['status'], 0) + 1
+        items.append(dict(item, progress=progress))
+
+    return jsonify({
+        'batch_id': batch_id,
+        'total': len(items),
+        'complete': counts['complete'],
+        'failed': counts['error'],
+        'finished': counts['complete'] + counts['error'] + counts.get('not_found', 0) == len(items),
+        'items': items
+    })
+
+def batch_finished(batch):
+    """Whether every item of a batch has completed, failed or expired"""
+    for item in batch['items']:
+        progress = download_progress.get(item['download_id'])
+        if progress is not None and progress['status'] not in ('complete', 'error'):
+            return False
+    return True
+
+@app.route('/batch/<batch_id>/zip')
+def batch_zip(batch_id):
+    """Stream one zip of the batch results
+
+    In async mode items are added as they finish, and the archive is closed
+    with whatever is ready after PROGRESS_STREAM_TIMEOUT seconds. Sync
+    workers cannot afford to wait, so there the zip is refused with 409
+    until /batch/<id> reports the batch finished.
+    """
+    batch = download_progress.get(f'batch:{batch_id}')
+    if batch is None:
+        return jsonify({'error': 'Batch not found or expired'}), 404
+    if not app.config['PROGRESS_STREAMING'] and not batch_finished(batch):
+        response = jsonify({'error': 'Batch is still downloading', 'retry_after': BATCH_ZIP_RETRY_AFTER})
+        response.headers['Retry-After'] = str(BATCH_ZIP_RETRY_AFTER)
+        return response, 409
+
+    # Files being added are pinned like /file downloads so the storage leader cannot evict them mid-stream
+    tokens = []
+
+    def unpin_all():
+        while tokens:
+            storage.unpin(tokens.pop())
+
+    def finished_files():
+        deadline = time.time() + PROGRESS_STREAM_TIMEOUT
+        pending = list(enumerate(batch['items'], 1))
+        while pending:
+            waiting = []
+            for index, item in pending:
+                progress = download_progress.get(item['download_id'])
+                if progress is None or progress['status'] == 'error':
+                    continue
+                if progress['status'] != 'complete':
+                    waiting.append((index, item))
+                    continue
+                name = progress.get('title') or item.get('title') or f'item {index}'
+                name = ''.join(c for c in name if c not in '\\/:*?"<>|').strip()[:100]
+                path = os.path.join(DOWNLOAD_FOLDER, progress['file'])
+                tokens.append(storage.pin(progress['file'], STORAGE_PIN_TTL))
+                # The file may have been evicted since the item finished
+                if os.path.exists(path):
+                    yield f'{index:02d} - {name}{os.path.splitext(path)[1]}', path
+                # stream_zip asks for the next file once this one is written
+                unpin_all()
+            pending = waiting
+            if pending:
+                if time.time() >= deadline:
+                    print(f"Batch {batch_id} zip closed with {len(pending)} unfinished item(s)")
+                    return
+                time.sleep(1)
+
+    response = Response(stream_with_context(stream_zip(finished_files())), mimetype='application/zip')
+    response.headers['Content-Disposition'] = content_disposition(f'batch-{batch_id[:8]}.zip')
+    on_response_close(response, unpin_all)
+    return response
+
+@app.route('/download', methods=['POST'])
+def download():
+    """Look up the state of a queued download, returns the file URL once complete"""
+    data = request.get_json()
+    download_id = data.get('download_id')
+
+    if not download_id:
+        return jsonify({'error': 'Download ID is required'}), 400
+
+    progress = public_progress(download_id)
+
+    if progress is None:
+        return jsonify({'error': 'Download not found or expired. Please start the download again.'}), 404
+
+    if progress['status'] == 'complete':
+        return jsonify({
+            'success': True,
+            'download_url': progress['download_url']
+        })
+
+    if progress['status'] == 'error':
+        # The job runner already turned the failure into a user-facing message
+        return jsonify({'error': progress.get('message', 'Download failed: Unknown error'),
+                        'reason': progress.get('reason')}), 500
+
+    # Still queued or running
+    return jsonify({
+        'success': False,
+        'status': progress['status'],
+        'percentage': progress.get('percentage', 0),
+        'queue_position': download_queue.position(download_id)
+    }), 202
+
+_background_lock = threading.Lock()
+_background_pid = None
+
+def start_background_tasks():
+    """Start the progress sweeper and compete for the storage leader role, once per process
+
+    Never done at import: a gunicorn master that preloads the app would
+    otherwise fork workers without the threads but still holding the
+    leader lock. gunicorn.conf.py calls this as each worker starts, the
+    ASGI lifespan as the loop starts, and the first request of any other
+    server.
+    """
+    global _background_pid
+    if _background_pid == os.getpid():
+        return
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        download_progress.start_sweeper()
+        storage.start_leader(storage_sweep, STORAGE_SWEEP_INTERVAL)
+        _background_pid = os.getpid()
+
+@app.before_request
+def ensure_background_tasks():
+    start_background_tasks()
 
 if __name__ == '__main__':
     # For local development
+    start_background_tasks()
     app.run(host='0.0.0.0', port=5000, debug=False)
 
 # For production WSGI server (required by shared hosting)
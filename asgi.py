@@ -0,0 +1,268 @@
+"""ASGI entry point: serves the Flask app from an event loop instead of one worker per request
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+    gunicorn -k uvicorn.workers.UvicornWorker --workers 2 asgi:app
+
+The routes are the Flask ones. Handlers run on a bounded thread pool,
+since nearly all of them block on a platform, yt-dlp, SQLite or a page
+render; only a few tiny static files are served on the loop itself. Response bodies are always sent from the loop, so a client
+reading a file slowly, or waiting on /progress_stream, holds no thread.
+"""
+import asyncio
+import contextvars
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from werkzeug.exceptions import HTTPException
+from werkzeug.wsgi import FileWrapper, _RangeWrapper
+
+from app import (PROGRESS_STREAM_HEADERS, PROGRESS_STREAM_RATE, app as flask_app, metrics, progress_events,
+                 start_background_tasks)
+
+# Threads running blocking handlers; requests beyond this wait on the loop
+BLOCKING_THREADS = int(os.environ.get('ASGI_BLOCKING_THREADS', 32))
+
+# Bytes read from disk per chunk of a file response
+FILE_CHUNK_SIZE = 256 * 1024
+
+# Endpoints that only send a small file from the app folder, cheap enough to
+# call on the loop without a thread hop. Pages (template render and brotli
+# compression) and anything reading SQLite stay on the thread pool, where a
+# slow call or a locked database cannot stall every open connection
+LOOP_ENDPOINTS = {'service_worker', 'robots', 'ads_txt', 'favicon'}
+
+
+def wsgi_environ(scope, body):
+    """PEP 3333 environ for an ASGI http scope and its complete request body"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': FileWrapper,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+            continue
+        key = f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def file_body(body):
+    """(file, offset, length or None) when body is a file from send_file, else None"""
+    if isinstance(body, _RangeWrapper) and isinstance(body.iterable, FileWrapper):
+        return body.iterable.file, body.start_byte, body.byte_range
+    if isinstance(body, FileWrapper):
+        return body.file, body.file.tell(), None
+    return None
+
+
+class ASGIBridge:
+    """ASGI application running a WSGI app with blocking handlers on a bounded thread pool"""
+
+    def __init__(self, wsgi_app, threads=BLOCKING_THREADS):
+        self.wsgi_app = wsgi_app
+        self.urls = wsgi_app.url_map.bind('localhost')
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='asgi')
+        self.threads = threads
+        self.connections = 0
+        self.blocking = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            self.connections += 1
+            try:
+                await self.http(scope, receive, send)
+            finally:
+                self.connections -= 1
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                start_background_tasks()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def endpoint(self, scope):
+        """(endpoint, view args) the request routes to, (None, {}) for anything Flask answers with an error"""
+        try:
+            return self.urls.match(scope['path'], method=scope['method'])
+        except HTTPException:
+            return None, {}
+
+    async def http(self, scope, receive, send):
+        body = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+
+        endpoint, args = self.endpoint(scope)
+        disconnected = asyncio.Event()
+        watcher = asyncio.ensure_future(self.watch_disconnect(receive, disconnected))
+        try:
+            if endpoint == 'progress_stream':
+                await self.progress_stream(send, args['download_id'], disconnected)
+                return
+            environ = wsgi_environ(scope, b''.join(body))
+            if endpoint in LOOP_ENDPOINTS:
+                context = None
+                status, headers, iterable = self.call_wsgi(environ)
+            else:
+                # Every blocking step of one request runs in the same context: a
+                # stream_with_context body pops the request context pushed by an
+                # earlier step, possibly from another pool thread
+                context = contextvars.copy_context()
+                status, headers, iterable = await self.run_blocking(context.run, self.call_wsgi, environ)
+            await self.send_response(send, status, headers, iterable, context, disconnected)
+        finally:
+            watcher.cancel()
+
+    async def watch_disconnect(self, receive, disconnected):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    async def run_blocking(self, fn, *args):
+        self.blocking += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.blocking -= 1
+
+    def call_wsgi(self, environ):
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+            return lambda data: None
+
+        iterable = self.wsgi_app(environ, start_response)
+        # Flask and Werkzeug call start_response before returning the body
+        status, headers = started
+        return int(status.split(' ', 1)[0]), headers, iterable
+
+    async def send_response(self, send, status, headers, iterable, context, disconnected):
+        """Send the WSGI response; context is None for handlers run on the loop"""
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        try:
+            source = file_body(iterable)
+            if source is not None:
+                await self.send_file(send, *source, disconnected)
+            else:
+                await self.send_chunks(send, iterable, context, disconnected)
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                # Runs the close callbacks (unpinning, request teardown)
+                if context is None:
+                    close()
+                else:
+                    await self.run_blocking(context.run, close)
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    async def send_chunks(self, send, iterable, context, disconnected):
+        chunks = iter(iterable)
+        while not disconnected.is_set():
+            # Generators (relays, zips) may block between chunks
+            if context is None:
+                chunk = next(chunks, None)
+            else:
+                chunk = await self.run_blocking(context.run, next, chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+    async def send_file(self, send, file, offset, length, disconnected):
+        """Send length bytes of file from offset (to the end if None), reading chunks off the loop"""
+        loop = asyncio.get_running_loop()
+        fd = file.fileno()
+        remaining = length
+        while remaining != 0 and not disconnected.is_set():
+            size = FILE_CHUNK_SIZE if remaining is None else min(FILE_CHUNK_SIZE, remaining)
+            chunk = await loop.run_in_executor(None, os.pread, fd, size, offset)
+            if not chunk:
+                break
+            offset += len(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+    async def progress_stream(self, send, download_id, disconnected):
+        """/progress_stream with the waits between polls on the loop and the store reads on the pool"""
+        headers = dict(PROGRESS_STREAM_HEADERS, **{'Content-Type': 'text/event-stream; charset=utf-8'})
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()],
+        })
+        events = progress_events(download_id)
+        end = object()
+        while not disconnected.is_set():
+            # Each step reads SQLite, which may wait on a locked database
+            chunk = await self.run_blocking(next, events, end)
+            if chunk is end:
+                break
+            if chunk is None:
+                await asyncio.sleep(1.0 / PROGRESS_STREAM_RATE)
+            else:
+                await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    def stats(self):
+        return {'connections': self.connections, 'blocking': self.blocking, 'threads': self.threads}
+
+
+def create_asgi_app(wsgi_app):
+    """Wrap wsgi_app with ASGI_BLOCKING_THREADS threads for blocking handlers"""
+    # Idle progress streams cost nothing here, so clients are told to use them
+    flask_app.config['PROGRESS_STREAMING'] = True
+    return ASGIBridge(wsgi_app)
+
+
+app = create_asgi_app(flask_app)
+
+
+def asgi_metrics():
+    stats = app.stats()
+    return [
+        ('achek_asgi_connections', {}, stats['connections']),
+        ('achek_asgi_blocking_calls', {}, stats['blocking']),
+    ]
+
+
+metrics.add_collector(asgi_metrics)
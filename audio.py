@@ -0,0 +1,204 @@
+import contextlib
+import fcntl
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from shared_db import default_db_path
+
+# Formats a client may ask for; 'best' keeps whatever the platform serves
+AUDIO_FORMATS = ('best', 'mp3', 'm4a', 'opus', 'ogg')
+
+# Source codecs each target container takes without re-encoding
+COMPATIBLE_CODECS = {
+    'mp3': ('mp3',),
+    'm4a': ('mp4a', 'aac'),
+    'opus': ('opus',),
+    'ogg': ('vorbis', 'opus'),
+}
+
+# Container for a native stream when the client accepts anything
+NATIVE_TARGETS = {
+    'mp3': 'mp3',
+    'mp4a': 'm4a',
+    'aac': 'm4a',
+    'opus': 'opus',
+    'vorbis': 'ogg',
+}
+
+# Encoder and highest bitrate (kbps) used when a target has to be transcoded
+ENCODERS = {
+    'mp3': ('libmp3lame', 320),
+    'm4a': ('aac', 256),
+    'opus': ('libopus', 160),
+    'ogg': ('libvorbis', 192),
+}
+
+# Bitrates the LAME encoder supports in constant bitrate mode
+MP3_BITRATES = (64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+
+FFMPEG = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+
+# Seconds between attempts to take a host-wide converter slot
+SLOT_POLL_INTERVAL = 0.1
+
+
+def audio_selector(audio_format):
+    """yt-dlp format string preferring a stream the target can take without transcoding"""
+    codecs = COMPATIBLE_CODECS.get(audio_format)
+    if not codecs:
+        return 'bestaudio/best'
+    preferred = '/'.join(f'bestaudio[acodec^={codec}]' for codec in codecs)
+    return f'{preferred}/bestaudio/best'
+
+
+def source_codec(info):
+    """Base audio codec of the selected format, e.g. 'mp4a' for 'mp4a.40.2'"""
+    return (info.get('acodec') or '').split('.')[0].lower()
+
+
+def target_bitrate(target, source_abr):
+    """Encoder bitrate for target, never above what the source carries"""
+    ceiling = ENCODERS[target][1]
+    if not source_abr:
+        return ceiling
+    bitrate = max(64, min(ceiling, int(source_abr)))
+    if target == 'mp3':
+        bitrate = max(rate for rate in MP3_BITRATES if rate <= bitrate)
+    return bitrate
+
+
+def plan_audio(info, audio_format='mp3'):
+    """Decide how the selected format of a processed info dict becomes the requested audio file
+
+    Returns a dict with the target 'ext' and an 'action': 'keep' when the
+    downloaded file already is the target, 'copy' to remux the stream into
+    the target container, or 'transcode' with an encoder 'bitrate' capped
+    at the source bitrate.
+    """
+    codec = source_codec(info)
+    source_ext = info.get('ext')
+    if audio_format in COMPATIBLE_CODECS:
+        target = audio_format
+    elif codec in NATIVE_TARGETS:
+        target = NATIVE_TARGETS[codec]
+    elif source_ext:
+        # 'best' and a codec we cannot place: the platform's file is what was asked for
+        return {'ext': source_ext, 'action': 'keep', 'codec': codec, 'bitrate': None}
+    else:
+        target = 'mp3'
+
+    # Extractors often omit acodec, the extension still tells an mp3 from a webm
+    if source_ext == target:
+        return {'ext': target, 'action': 'keep', 'codec': codec, 'bitrate': None}
+    if codec in COMPATIBLE_CODECS[target]:
+        return {'ext': target, 'action': 'copy', 'codec': codec, 'bitrate': None}
+    return {'ext': target, 'action': 'transcode', 'codec': codec,
+            'bitrate': target_bitrate(target, info.get('abr'))}
+
+
+def ffmpeg_command(source, destination, plan):
+    """Audio-only ffmpeg invocation for a 'copy' or 'transcode' plan"""
+    command = [FFMPEG, '-y', '-nostdin', '-loglevel', 'error', '-i', source, '-vn', '-map_metadata', '0']
+    if plan['action'] == 'copy':
+        command += ['-c:a', 'copy']
+    else:
+        encoder = ENCODERS[plan['ext']][0]
+        # One thread per encode, the pool size is what bounds CPU use
+        command += ['-c:a', encoder, '-b:a', f"{plan['bitrate']}k", '-threads', '1']
+    if plan['ext'] == 'm4a':
+        command += ['-movflags', '+faststart']
+    # The .part suffix hides the real extension, so name the muxer explicitly
+    return command + ['-f', {'m4a': 'ipod', 'opus': 'opus', 'ogg': 'ogg', 'mp3': 'mp3'}[plan['ext']], destination]
+
+
+class AudioConverter:
+    """Runs remuxes and transcodes on a fixed number of threads, one ffmpeg process each
+
+    Downloads are network-bound and run on the download queue; encoding
+    is CPU-bound, so it is funnelled through this separate pool sized to
+    the core count instead of competing with every download thread. The
+    bound holds for the whole host: each conversion also takes one of
+    workers flock slots next to lock_path, so gunicorn workers together
+    never run more ffmpeg processes than there are cores.
+    """
+
+    def __init__(self, workers=None, lock_path=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.lock_path = lock_path or default_db_path()
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='audio')
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.running = 0
+        self.completed = {'copy': 0, 'transcode': 0}
+
+    def convert(self, source, plan):
+        """Produce the planned file next to source and return its path, blocking until done"""
+        if plan['action'] == 'keep':
+            return source
+        with self._lock:
+            self.waiting += 1
+        return self._executor.submit(self._run, source, plan).result()
+
+    @contextlib.contextmanager
+    def _slot(self):
+        """One of the host's converter slots, held until the block exits or the process dies"""
+        while True:
+            for index in range(self.workers):
+                handle = open(f'{self.lock_path}.audio-{index}.lock', 'a')
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    handle.close()
+                    continue
+                try:
+                    yield
+                finally:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+                    handle.close()
+                return
+            time.sleep(SLOT_POLL_INTERVAL)
+
+    def _run(self, source, plan):
+        with self._slot():
+            return self._convert(source, plan)
+
+    def _convert(self, source, plan):
+        with self._lock:
+            self.waiting -= 1
+            self.running += 1
+        try:
+            destination = f'{os.path.splitext(source)[0]}.{plan["ext"]}'
+            if destination == source:
+                destination = f'{os.path.splitext(source)[0]}.converted.{plan["ext"]}'
+            partial = destination + '.part'
+            result = subprocess.run(ffmpeg_command(source, partial, plan), capture_output=True, text=True)
+            if result.returncode != 0:
+                if os.path.exists(partial):
+                    os.remove(partial)
+                raise RuntimeError(f"ffmpeg {plan['action']} failed: {result.stderr.strip()[-300:]}")
+            os.replace(partial, destination)
+            os.remove(source)
+            with self._lock:
+                self.completed[plan['action']] += 1
+            return destination
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'waiting': self.waiting,
+                'running': self.running,
+                'completed': dict(self.completed),
+            }
+
+
+def create_audio_converter():
+    """Build the converter with AUDIO_WORKERS slots shared by all workers (default: one per CPU core)"""
+    workers = int(os.environ.get('AUDIO_WORKERS', 0)) or None
+    return AudioConverter(workers)
@@ -0,0 +1,198 @@
+"""URL classification and error mapping: the old /fetch_info if/elif chains vs classifier.py
+
+Runs both over a corpus of error strings as yt-dlp reports them, paired
+with URLs of every supported platform, and lists where the two disagree.
+Run from the repository root:
+
+    python benchmarks/bench_classifier.py [iterations]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from classifier import classify_error, detect_platform
+
+URLS = [
+    'https://www.tiktok.com/@someone/video/7301234567890123456',
+    'https://vm.tiktok.com/ZMabc123/',
+    'https://www.instagram.com/reel/C1a2b3c4d5e/',
+    'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+    'https://youtu.be/dQw4w9WgXcQ',
+    'https://m.youtube.com/shorts/abcdEFGhijk',
+    'https://twitter.com/someone/status/1712345678901234567',
+    'https://x.com/someone/status/1712345678901234567',
+    'https://www.facebook.com/watch/?v=1234567890',
+    'https://fb.watch/abcDEF123/',
+    'https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC',
+    'https://audiomack.com/artist/song/track-name',
+    'https://soundcloud.com/artist/track-name',
+    'https://vimeo.com/123456789',
+    'https://www.netflix.com/watch/80100172',
+    'https://www.dailymotion.com/video/x8abcd1',
+    'www.instagram.com/p/C1a2b3c4d5e/',
+]
+
+ERRORS = [
+    'ERROR: [TikTok] 7301234567890123456: Unable to extract webpage video data; please report this issue on  https://github.com/yt-dlp/yt-dlp/issues?q= , filling out the appropriate issue template. Confirm you are on the latest version using  yt-dlp -U',
+    'ERROR: [TikTok] 7301234567890123456: Your IP address is blocked from accessing this post',
+    'ERROR: [Instagram] C1a2b3c4d5e: Requested content is not available, rate-limit reached or login required. Use --cookies, --cookies-from-browser, --username and --password, --netrc-cmd, or --netrc (instagram) to provide account credentials',
+    'ERROR: [Instagram] C1a2b3c4d5e: Main webpage is locked behind the login page. Please use --cookies-from-browser or --cookies for the authentication.',
+    'ERROR: [youtube] dQw4w9WgXcQ: Private video. Sign in if you\'ve been granted access to this video',
+    'ERROR: [youtube] dQw4w9WgXcQ: Video unavailable. This video is no longer available because the YouTube account associated with this video has been terminated.',
+    'ERROR: [youtube] dQw4w9WgXcQ: Sign in to confirm your age. This video may be inappropriate for some users. Use --cookies-from-browser or --cookies for the authentication.',
+    'ERROR: [youtube] dQw4w9WgXcQ: Sign in to confirm you\'re not a bot. Use --cookies-from-browser or --cookies for the authentication.',
+    'ERROR: [youtube] abcdEFGhijk: This live event will begin in 3 hours.',
+    'ERROR: [youtube] dQw4w9WgXcQ: Unable to download webpage: HTTP Error 429: Too Many Requests (caused by <HTTPError 429: Too Many Requests>)',
+    'ERROR: [twitter] 1712345678901234567: No video could be found in this tweet',
+    'ERROR: [twitter] 1712345678901234567: NSFW tweet requires authentication. Use --cookies, --cookies-from-browser, --username and --password, --netrc-cmd, or --netrc (twitter) to provide account credentials',
+    'ERROR: [facebook] 1234567890: Cannot parse data; please report this issue on  https://github.com/yt-dlp/yt-dlp/issues?q= , filling out the appropriate issue template.',
+    'ERROR: [facebook] 1234567890: This video is only available for registered users. Use --cookies, --cookies-from-browser, --username and --password, --netrc-cmd, or --netrc (facebook) to provide account credentials',
+    'ERROR: [soundcloud] track-name: Unable to download JSON metadata: HTTP Error 404: Not Found (caused by <HTTPError 404: Not Found>)',
+    'ERROR: [vimeo] 123456789: This video is protected by a password, use the --video-password option',
+    'ERROR: [generic] Unsupported URL: https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC',
+    'ERROR: [Netflix] This video is DRM protected',
+    'ERROR: [DailymotionIE] x8abcd1: The uploader has not made this video available in your country. This video is available in Germany. You might want to use a VPN or a proxy server (with --proxy) to workaround.',
+    'ERROR: [generic] Unable to download webpage: <urlopen error [Errno -2] Name or service not known> (caused by TransportError(\'<urlopen error [Errno -2] Name or service not known>\'))',
+    'ERROR: unable to download video data: HTTP Error 403: Forbidden',
+    'ERROR: Postprocessing: ffprobe and ffmpeg not found. Please install or provide the path using --ffmpeg-location',
+]
+
+
+def legacy_platform(url):
+    url_lower = url.lower()
+    if 'tiktok.com' in url_lower or 'vm.tiktok.com' in url_lower:
+        return 'tiktok'
+    elif 'instagram.com' in url_lower:
+        return 'instagram'
+    elif 'youtube.com' in url_lower or 'youtu.be' in url_lower:
+        return 'youtube'
+    elif 'twitter.com' in url_lower or 'x.com' in url_lower:
+        return 'twitter'
+    elif 'facebook.com' in url_lower or 'fb.watch' in url_lower or 'fb.me' in url_lower:
+        return 'facebook'
+    elif 'spotify.com' in url_lower:
+        return 'spotify'
+    elif 'audiomack.com' in url_lower:
+        return 'audiomack'
+    elif 'soundcloud.com' in url_lower:
+        return 'soundcloud'
+    elif 'vimeo.com' in url_lower:
+        return 'vimeo'
+    elif 'netflix.com' in url_lower:
+        return 'netflix'
+    return 'unknown'
+
+
+def legacy_reason(url, error_msg):
+    """The DownloadError branch of the old /fetch_info, returning the rule hit instead of the message"""
+    platform = legacy_platform(url)
+    if platform == 'tiktok':
+        if 'Unable to extract' in error_msg or 'webpage video data' in error_msg or 'video data' in error_msg.lower():
+            return 'unavailable'
+        elif 'Login required' in error_msg or 'sign in' in error_msg.lower():
+            return 'login_required'
+        return 'failed'
+    elif platform == 'instagram':
+        if 'rate-limit' in error_msg.lower() or 'rate limit' in error_msg.lower():
+            return 'rate_limited'
+        elif 'login required' in error_msg.lower() or 'authentication' in error_msg.lower():
+            return 'login_required'
+        elif 'not available' in error_msg.lower() or 'content is not available' in error_msg.lower():
+            return 'unavailable'
+        elif 'private' in error_msg.lower():
+            return 'private'
+        return 'failed'
+    elif platform == 'youtube':
+        if 'private' in error_msg.lower() or 'unavailable' in error_msg.lower():
+            return 'unavailable'
+        elif 'age' in error_msg.lower() or 'restricted' in error_msg.lower():
+            return 'age_restricted'
+        elif 'live' in error_msg.lower():
+            return 'live'
+        return 'failed'
+    elif platform == 'facebook':
+        if 'login required' in error_msg.lower() or 'private' in error_msg.lower():
+            return 'private'
+        return 'failed'
+    elif platform == 'twitter':
+        if 'no video' in error_msg.lower() or 'no media' in error_msg.lower():
+            return 'no_media'
+        elif 'private' in error_msg.lower() or 'protected' in error_msg.lower():
+            return 'private'
+        return 'failed'
+    elif platform in ('spotify', 'audiomack', 'netflix'):
+        return 'failed'
+    elif platform == 'soundcloud':
+        return 'private' if 'private' in error_msg.lower() else 'failed'
+    elif platform == 'vimeo':
+        if 'password' in error_msg.lower() or 'private' in error_msg.lower():
+            return 'private'
+        return 'failed'
+
+    if 'DRM' in error_msg or 'protected' in error_msg.lower():
+        return 'drm'
+    elif '429' in error_msg or 'Too Many Requests' in error_msg or 'rate limit' in error_msg.lower():
+        return 'rate_limited'
+    elif 'geo' in error_msg.lower() or 'region' in error_msg.lower():
+        return 'geo_restricted'
+    elif 'private' in error_msg.lower():
+        return 'private'
+    elif 'login' in error_msg.lower() or 'sign in' in error_msg.lower() or 'authentication' in error_msg.lower():
+        return 'login_required'
+    elif 'no video' in error_msg.lower() or 'no media' in error_msg.lower():
+        return 'no_media'
+    return 'failed'
+
+
+def current_reason(url, error_msg):
+    # Uncached so both sides classify the URL from scratch
+    return classify_error(detect_platform.__wrapped__(url), error_msg)[0]
+
+
+def memoised_reason(url, error_msg):
+    return classify_error(detect_platform(url), error_msg)[0]
+
+
+def timed(fn, corpus, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        for url, error in corpus:
+            fn(url, error)
+        samples.append((time.perf_counter() - started) * 1e6 / len(corpus))
+    return samples
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    print(f'{name:<24} mean {statistics.mean(samples):7.2f} us   p50 {samples[len(samples) // 2]:7.2f} us   '
+          f'p95 {samples[int(len(samples) * 0.95)]:7.2f} us   per classification')
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    corpus = [(url, error) for url in URLS for error in ERRORS]
+
+    print(f'{len(corpus)} (url, error) pairs x {iterations} iterations\n')
+    report('platform, legacy', timed(lambda url, _: legacy_platform(url), corpus, iterations))
+    report('platform, classifier', timed(lambda url, _: detect_platform.__wrapped__(url), corpus, iterations))
+    report('platform, memoised', timed(lambda url, _: detect_platform(url), corpus, iterations))
+    report('errors, legacy', timed(legacy_reason, corpus, iterations))
+    report('errors, classifier', timed(current_reason, corpus, iterations))
+    report('errors, memoised', timed(memoised_reason, corpus, iterations))
+
+    print('\nURLs classified differently:')
+    for url in URLS:
+        if legacy_platform(url) != detect_platform(url):
+            print(f'  {url}: {legacy_platform(url)} -> {detect_platform(url)}')
+    changed = [(url, error) for url, error in corpus if legacy_reason(url, error) != current_reason(url, error)]
+    print(f'\nErrors mapped differently: {len(changed)} of {len(corpus)}')
+    for url, error in changed[:15]:
+        print(f'  {detect_platform(url):<10} {legacy_reason(url, error):>15} -> {current_reason(url, error):<15} {error[:70]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Idle connection benchmark: how many open /progress_stream clients the server holds while staying responsive
+
+Starts the app like load_test.py, begins one slow download, opens N
+Server-Sent Events connections watching it and keeps them open, then
+times plain page requests while they are held.
+
+    python benchmarks/bench_connections.py --server uvicorn --connections 2000
+    python benchmarks/bench_connections.py --server gunicorn --connections 50
+
+With sync gunicorn workers every stream occupies a whole worker, so the
+page requests queue behind them; in ASGI mode the streams wait on the
+event loop and the pages are answered at once.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import DOWNLOAD_FOLDER, cleanup_downloads, percentile, start_server, tree_rss  # noqa: E402
+from stub import MediaServer  # noqa: E402
+
+
+async def open_stream(host, port, path, timeout):
+    """Open an SSE connection and read its first event, returns the stream or None"""
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n'.encode())
+        await writer.drain()
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+        if b' 200 ' not in head.split(b'\r\n', 1)[0]:
+            writer.close()
+            return None
+        await asyncio.wait_for(reader.readuntil(b'\n\n'), timeout)
+        return reader, writer
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+        return None
+
+
+async def timed_get(host, port, path, timeout):
+    started = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+        await asyncio.wait_for(reader.read(), timeout)
+        writer.close()
+        return time.perf_counter() - started
+    except (OSError, asyncio.TimeoutError):
+        return None
+
+
+async def run(args, base, download_id, server_pid):
+    parts = urlsplit(base)
+    path = f'/progress_stream/{download_id}'
+    started = time.perf_counter()
+    streams = []
+    # Open in waves so the listen backlog is not the thing being measured
+    for offset in range(0, args.connections, 100):
+        wave = [open_stream(parts.hostname, parts.port, path, args.timeout)
+                for _ in range(min(100, args.connections - offset))]
+        streams += await asyncio.gather(*wave)
+    opened = [stream for stream in streams if stream is not None]
+    open_seconds = time.perf_counter() - started
+
+    samples = []
+    failures = 0
+    for _ in range(args.requests):
+        seconds = await timed_get(parts.hostname, parts.port, '/robots.txt', args.timeout)
+        if seconds is None:
+            failures += 1
+        else:
+            samples.append(seconds * 1000)
+    rss = tree_rss(server_pid)
+
+    for _, writer in opened:
+        writer.close()
+    return {
+        'streams_requested': args.connections,
+        'streams_open': len(opened),
+        'open_seconds': round(open_seconds, 2),
+        'page_requests': args.requests,
+        'page_failures': failures,
+        'page_p50_ms': round(percentile(samples, 50), 1) if samples else None,
+        'page_p95_ms': round(percentile(samples, 95), 1) if samples else None,
+        'server_rss_mb': round(rss / 1024 ** 2, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, default=1000, help='SSE connections held open')
+    parser.add_argument('--requests', type=int, default=20, help='page requests timed while they are held')
+    parser.add_argument('--timeout', type=float, default=10, help='seconds before a connection or request fails')
+    parser.add_argument('--server', choices=('gunicorn', 'uvicorn', 'werkzeug'), default='uvicorn')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--verbose', action='store_true', help='show app server logs')
+    args = parser.parse_args()
+    # Settings start_server reads from load_test's arguments
+    args.size = 64 * 1024
+
+    # A slow media server keeps the watched download running for the whole run
+    media = MediaServer(bandwidth=64 * 1024).start()
+    state_dir = tempfile.mkdtemp(prefix='achek-bench-')
+    os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
+    before = set(os.listdir(DOWNLOAD_FOLDER))
+    process, base = start_server(args, media.url, state_dir)
+    try:
+        response = requests.post(f'{base}/start_download', timeout=30, json={
+            'url': 'https://stub.local/video/idle', 'format_id': 'best', 'type': 'video'})
+        download_id = response.json()['download_id']
+        result = asyncio.run(run(args, base, download_id, process.pid))
+        print(f'{args.server}: {result["streams_open"]}/{result["streams_requested"]} streams open '
+              f'in {result["open_seconds"]}s, pages p50 {result["page_p50_ms"]} ms '
+              f'p95 {result["page_p95_ms"]} ms, {result["page_failures"]} failed, '
+              f'server RSS {result["server_rss_mb"]} MB')
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        media.stop()
+        cleanup_downloads(before)
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
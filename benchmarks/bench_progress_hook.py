@@ -0,0 +1,127 @@
+"""progress_hook cost per call: a store write on every block vs the throttled JobProgress record
+
+Feeds both hooks the stream of updates yt-dlp's HTTP downloader produces
+for one file (a fresh dict per received block), against the memory and
+the SQLite progress stores, with several jobs at once on threads as in a
+worker. Run from the repository root:
+
+    python benchmarks/bench_progress_hook.py [blocks per job] [parallel jobs]
+"""
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import JobTimer
+from progress_store import JobProgress, create_progress_store
+
+BLOCK_SIZE = 64 * 1024
+
+
+def legacy_hook(d, store, download_id, timer):
+    """The hook before JobProgress: a new record written to the store for every block"""
+    timer.progress(d)
+    if d['status'] == 'downloading':
+        if 'total_bytes' in d or 'total_bytes_estimate' in d:
+            total = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
+            downloaded = d.get('downloaded_bytes', 0)
+            percentage = int((downloaded / total) * 100) if total > 0 else 0
+            speed = d.get('speed', 0)
+            eta = d.get('eta', 0)
+            store.set(download_id, {
+                'status': 'downloading',
+                'percentage': percentage,
+                'downloaded': downloaded,
+                'total': total,
+                'speed': speed if speed else 0,
+                'eta': eta if eta else 0
+            })
+    elif d['status'] == 'finished':
+        store.set(download_id, {'status': 'processing', 'percentage': 100, 'message': 'Processing file...'})
+
+
+def throttled_hook(d, progress, timer):
+    """The hook in app.py"""
+    timer.progress(d)
+    if d['status'] == 'downloading':
+        progress.update(d.get('downloaded_bytes') or 0, d.get('total_bytes') or d.get('total_bytes_estimate') or 0)
+    elif d['status'] == 'finished':
+        progress.finish()
+
+
+def block_stream(blocks):
+    """The updates HttpFD reports for a file of `blocks` blocks"""
+    total = blocks * BLOCK_SIZE
+    started = time.time()
+    for n in range(1, blocks + 1):
+        elapsed = time.time() - started
+        yield {
+            'status': 'downloading',
+            'downloaded_bytes': n * BLOCK_SIZE,
+            'total_bytes': total,
+            'tmpfilename': 'clip.mp4.part',
+            'filename': 'clip.mp4',
+            'eta': 1,
+            'speed': n * BLOCK_SIZE / elapsed if elapsed else None,
+            'elapsed': elapsed,
+            'ctx_id': None,
+        }
+    yield {'status': 'finished', 'downloaded_bytes': total, 'total_bytes': total, 'filename': 'clip.mp4'}
+
+
+def run(store, variant, blocks, jobs):
+    """Seconds per hook call over `jobs` downloads fed in parallel, and store writes per job"""
+    writes = [0] * jobs
+    store_set = store.set
+
+    def counting_set(download_id, record, ttl=3600):
+        writes[int(download_id)] += 1
+        store_set(download_id, record, ttl)
+
+    store.set = counting_set
+
+    def job(index):
+        download_id = str(index)
+        timer = JobTimer('bench')
+        if variant == 'legacy':
+            for d in block_stream(blocks):
+                legacy_hook(d, store, download_id, timer)
+        else:
+            progress = JobProgress(store, download_id)
+            for d in block_stream(blocks):
+                throttled_hook(d, progress, timer)
+
+    threads = [threading.Thread(target=job, args=(index,)) for index in range(jobs)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+    store.set = store_set
+    return seconds / (jobs * (blocks + 1)), statistics.mean(writes)
+
+
+def main():
+    blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    jobs = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    print(f'{jobs} parallel jobs of {blocks} blocks ({blocks * BLOCK_SIZE / 1024 ** 2:.0f} MiB) each')
+    folder = tempfile.mkdtemp()
+    try:
+        for backend in ('memory', 'sqlite'):
+            store = create_progress_store(backend, os.path.join(folder, f'{backend}.db'))
+            results = {variant: run(store, variant, blocks, jobs) for variant in ('legacy', 'throttled')}
+            for variant, (per_call, writes) in results.items():
+                print(f'{backend:>6} {variant:>9}: {per_call * 1e6:8.2f} us per call, {writes:8.0f} store writes per job')
+            print(f'{backend:>6}   speedup: {results["legacy"][0] / results["throttled"][0]:.1f}x')
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
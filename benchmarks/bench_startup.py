@@ -0,0 +1,157 @@
+"""Startup benchmark: import cost of the app and yt-dlp, and how soon gunicorn workers answer
+
+Measures, in fresh interpreters, how long `import app` and `import yt_dlp`
+take and whether importing the app pulls in yt-dlp, then the cost of the
+first YoutubeDL. It then boots gunicorn with gunicorn.conf.py, with and
+without preload_app, and reports the time from launch to the first
+answered request, when each worker finished starting, and how long a
+killed worker takes to be replaced.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --workers 8 --runs 5
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import ROOT, free_port  # noqa: E402
+
+IMPORT_PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - started
+print(json.dumps({{'seconds': seconds, 'yt_dlp': 'yt_dlp' in sys.modules}}))
+'''
+
+ENGINE_PROBE = '''
+import json, time
+import app
+started = time.perf_counter()
+app.ydl_pool.load_engine()
+loaded = time.perf_counter() - started
+app.ydl_pool.warm('info')
+print(json.dumps({'load': loaded, 'first_instance': time.perf_counter() - started}))
+'''
+
+# Wraps the real settings to log when each worker is ready to serve
+CONFIG = '''
+import os, time
+exec(open({config!r}).read())
+preload_app = {preload!r}
+_post_worker_init = post_worker_init
+
+def post_worker_init(worker):
+    _post_worker_init(worker)
+    with open({log!r}, 'a') as log:
+        log.write(f'{{os.getpid()}} {{time.time()}}\\n')
+'''
+
+
+def probe(code, env):
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def ready_workers(log):
+    try:
+        with open(log) as f:
+            return [(int(pid), float(at)) for pid, at in (line.split() for line in f if line.strip())]
+    except OSError:
+        return []
+
+
+def wait_until(condition, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.01)
+    raise RuntimeError(f'Timed out after {timeout}s')
+
+
+def boot(args, env, state_dir, preload):
+    log = os.path.join(state_dir, f'ready-{preload}.log')
+    config = os.path.join(state_dir, f'gunicorn-{preload}.conf.py')
+    with open(config, 'w') as f:
+        f.write(CONFIG.format(config=os.path.join(ROOT, 'gunicorn.conf.py'), preload=preload, log=log))
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+
+    def answered(path):
+        try:
+            return requests.get(f'{base}{path}', timeout=1).status_code == 200
+        except requests.RequestException:
+            return False
+
+    launched = time.time()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', config, '--bind', f'127.0.0.1:{port}',
+         '--workers', str(args.workers), '--log-level', 'warning', 'app:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+    try:
+        wait_until(lambda: answered('/robots.txt'), 60)
+        first_response = time.time() - launched
+        wait_until(lambda: answered('/'), 60)
+        first_page = time.time() - launched
+        workers = wait_until(lambda: len(ready_workers(log)) >= args.workers and ready_workers(log), 60)
+        ready = sorted(at - launched for _, at in workers)
+
+        # A crashed or recycled worker: how long until its replacement serves
+        killed = time.time()
+        os.kill(workers[0][0], signal.SIGKILL)
+        replaced = wait_until(lambda: [at for _, at in ready_workers(log)[args.workers:]], 60)
+        return {
+            'preload': preload,
+            'first_response_s': round(first_response, 3),
+            'first_page_s': round(first_page, 3),
+            'workers_ready_s': [round(seconds, 3) for seconds in ready],
+            'respawn_s': round(replaced[0] - killed, 3),
+        }
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per import measurement')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--verbose', action='store_true', help='show app server logs')
+    args = parser.parse_args()
+
+    state_dir = tempfile.mkdtemp(prefix='achek-bench-')
+    env = dict(os.environ, PROGRESS_DB=os.path.join(state_dir, 'progress.db'))
+    try:
+        for module in ('yt_dlp', 'app'):
+            samples = [probe(IMPORT_PROBE.format(module=module), env) for _ in range(args.runs)]
+            print(f'import {module}: median {statistics.median(s["seconds"] for s in samples) * 1000:.0f} ms'
+                  + (f', loads yt_dlp: {samples[0]["yt_dlp"]}' if module == 'app' else ''))
+        engine = probe(ENGINE_PROBE, env)
+        print(f'first extraction after import app: yt-dlp load {engine["load"] * 1000:.0f} ms, '
+              f'first YoutubeDL ready after {engine["first_instance"] * 1000:.0f} ms')
+
+        for preload in (False, True):
+            result = boot(args, env, state_dir, preload)
+            print(f'gunicorn preload={preload}: first response {result["first_response_s"]}s, '
+                  f'first page {result["first_page_s"]}s, workers ready {result["workers_ready_s"]}, '
+                  f'killed worker replaced in {result["respawn_s"]}s')
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Per-call YoutubeDL setup cost: fresh instance per request vs the YoutubeDL pool
+
+Extracts a synthetic media file from a local HTTP server so no platform is
+contacted. Run from the repository root:
+
+    python benchmarks/bench_ydl_pool.py [iterations]
+"""
+import http.server
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yt_dlp
+
+from ydl_pool import YoutubeDLPool
+
+OPTIONS = {
+    'quiet': True,
+    'no_warnings': True,
+    'format': 'best',
+    'socket_timeout': 30,
+    'retries': 5,
+    'http_headers': {'User-Agent': 'Mozilla/5.0 (bench)'},
+}
+
+
+def serve_media(size=256 * 1024):
+    """Serve one synthetic mp4 from a temporary directory, returns its URL"""
+    folder = tempfile.mkdtemp()
+    with open(os.path.join(folder, 'clip.mp4'), 'wb') as f:
+        f.write(os.urandom(size))
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=folder, **kwargs)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    # yt-dlp's generic extractor hangs up after sniffing the headers
+    server.handle_error = lambda *args: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}/clip.mp4'
+
+
+def timed(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    print(f'{name:<28} mean {statistics.mean(samples):8.2f} ms   '
+          f'p50 {samples[len(samples) // 2]:8.2f} ms   p95 {samples[int(len(samples) * 0.95)]:8.2f} ms')
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    url = serve_media()
+    pool = YoutubeDLPool(lambda profile: OPTIONS)
+    pool.warm('video')
+
+    def construct_fresh():
+        with yt_dlp.YoutubeDL(OPTIONS):
+            pass
+
+    def construct_pooled():
+        with pool.acquire('video'):
+            pass
+
+    def extract_fresh():
+        with yt_dlp.YoutubeDL(OPTIONS) as ydl:
+            ydl.extract_info(url, download=False)
+
+    def extract_pooled():
+        with pool.acquire('video') as ydl:
+            ydl.extract_info(url, download=False)
+
+    # First extraction pays one-off imports for both variants
+    extract_fresh()
+
+    print(f'{iterations} iterations against {url}\n')
+    report('setup, fresh instance', timed(construct_fresh, iterations))
+    report('setup, pooled instance', timed(construct_pooled, iterations))
+    report('extract, fresh instance', timed(extract_fresh, iterations))
+    report('extract, pooled instance', timed(extract_pooled, iterations))
+    print(f'\npool: {pool.stats()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+"""Load test for the Flask endpoints against a stub extractor and a local media server
+
+Starts a throttled media server, runs the app in a separate process (gunicorn
+with sync workers like production, uvicorn serving asgi.py, or the threaded
+development server) with
+yt-dlp routed to benchmarks/stub.py, then drives each scenario with N
+concurrent clients. Nothing leaves the machine.
+
+    python benchmarks/load_test.py --clients 20 --requests 25 --bandwidth 2048 --latency 50
+
+Reports p50/p95/p99 latency per endpoint, requests/sec, peak RSS of the
+server process tree and peak disk usage of the download folder.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub import MediaServer  # noqa: E402
+
+DOWNLOAD_FOLDER = os.path.join(ROOT, 'static', 'downloads')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1)]
+
+
+class Recorder:
+    """Thread-safe latency samples grouped by endpoint"""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, ok=True):
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds * 1000)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def timed(self, name, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = fn(*args, **kwargs)
+        except requests.RequestException:
+            self.record(name, time.perf_counter() - started, ok=False)
+            raise
+        self.record(name, time.perf_counter() - started, ok=response.status_code < 400)
+        return response
+
+
+class ResourceMonitor:
+    """Samples RSS of a process tree and the size of the download folder"""
+
+    def __init__(self, pid, folder, interval=0.2):
+        self.pid = pid
+        self.folder = folder
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, tree_rss(self.pid))
+            self.peak_disk = max(self.peak_disk, folder_size(self.folder))
+            self._stop.wait(self.interval)
+
+
+def tree_rss(pid):
+    """Resident bytes of pid and all its descendants, read from /proc"""
+    parents = {}
+    rss = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                parents[int(entry)] = int(f.read().rsplit(')', 1)[1].split()[1])
+            with open(f'/proc/{entry}/statm') as f:
+                rss[int(entry)] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, IndexError, ValueError):
+            continue
+
+    total = 0
+    family = {pid}
+    changed = True
+    while changed:
+        changed = False
+        for child, parent in parents.items():
+            if parent in family and child not in family:
+                family.add(child)
+                changed = True
+    for member in family:
+        total += rss.get(member, 0)
+    return total
+
+
+def folder_size(folder):
+    total = 0
+    for dirpath, _, filenames in os.walk(folder):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def start_server(args, media_url, state_dir):
+    port = free_port()
+    env = dict(os.environ,
+               STUB_MEDIA_URL=media_url,
+               STUB_MEDIA_SIZE=str(args.size * 1024),
+               PROGRESS_DB=os.path.join(state_dir, 'progress.db'),
+               PORT=str(port))
+    if args.server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+                   '--workers', str(args.workers), '--worker-class', 'sync', '--timeout', '180',
+                   '--pythonpath', 'benchmarks', '--log-level', 'warning', 'stub_app:app']
+    elif args.server == 'uvicorn':
+        command = [sys.executable, '-m', 'uvicorn', '--host', '127.0.0.1', '--port', str(port),
+                   '--app-dir', 'benchmarks', '--log-level', 'warning', 'stub_app:asgi_app']
+    else:
+        command = [sys.executable, os.path.join('benchmarks', 'stub_app.py')]
+
+    process = subprocess.Popen(command, cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            requests.get(f'{base}/robots.txt', timeout=1)
+            return process, base
+        except requests.RequestException:
+            if process.poll() is not None:
+                raise RuntimeError('App server exited during startup, rerun with --verbose')
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('App server did not start within 60s')
+
+
+def media_url(args):
+    return f'https://stub.local/video/v{random.randrange(args.unique)}'
+
+
+def scenario_pages(session, base, recorder, args):
+    recorder.timed('GET /', session.get, f'{base}/')
+    recorder.timed('GET /youtube-downloader', session.get, f'{base}/youtube-downloader')
+
+
+def scenario_fetch_info(session, base, recorder, args):
+    recorder.timed('POST /fetch_info', session.post, f'{base}/fetch_info', json={'url': media_url(args)})
+
+
+def scenario_progress(session, base, recorder, args):
+    recorder.timed('GET /progress', session.get, f'{base}/progress/{uuid.uuid4()}')
+
+
+def scenario_download(session, base, recorder, args):
+    started = time.perf_counter()
+    payload = {'url': media_url(args), 'format_id': 'best', 'type': 'video'}
+    while True:
+        response = recorder.timed('POST /start_download', session.post, f'{base}/start_download', json=payload)
+        if response.status_code != 429:
+            break
+        time.sleep(float(response.headers.get('Retry-After', 1)))
+    if response.status_code != 200:
+        recorder.record('job end-to-end', time.perf_counter() - started, ok=False)
+        return
+
+    download_id = response.json()['download_id']
+    status = 'queued'
+    while status not in ('complete', 'error', 'not_found'):
+        time.sleep(args.poll_interval)
+        status = recorder.timed('GET /progress', session.get, f'{base}/progress/{download_id}').json()['status']
+
+    response = recorder.timed('POST /download', session.post, f'{base}/download', json={'download_id': download_id})
+    recorder.record('job end-to-end', time.perf_counter() - started, ok=response.status_code == 200)
+
+
+SCENARIOS = {
+    'pages': scenario_pages,
+    'fetch_info': scenario_fetch_info,
+    'progress': scenario_progress,
+    'download': scenario_download,
+}
+
+
+def run_scenario(name, args, base, server_pid):
+    recorder = Recorder()
+    monitor = ResourceMonitor(server_pid, DOWNLOAD_FOLDER).start()
+
+    def client():
+        with requests.Session() as session:
+            for _ in range(args.requests):
+                try:
+                    SCENARIOS[name](session, base, recorder, args)
+                except requests.RequestException:
+                    pass
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.clients) as pool:
+        for future in [pool.submit(client) for _ in range(args.clients)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+    monitor.stop()
+
+    total_requests = sum(len(v) for k, v in recorder.samples.items() if k.startswith(('GET', 'POST')))
+    return {
+        'scenario': name,
+        'seconds': round(elapsed, 2),
+        'requests': total_requests,
+        'requests_per_sec': round(total_requests / elapsed, 1) if elapsed else 0,
+        'peak_rss_mb': round(monitor.peak_rss / 1024 ** 2, 1),
+        'peak_disk_mb': round(monitor.peak_disk / 1024 ** 2, 1),
+        'endpoints': {
+            endpoint: {
+                'count': len(samples),
+                'errors': recorder.errors.get(endpoint, 0),
+                'p50_ms': round(percentile(samples, 50), 1),
+                'p95_ms': round(percentile(samples, 95), 1),
+                'p99_ms': round(percentile(samples, 99), 1),
+            }
+            for endpoint, samples in sorted(recorder.samples.items())
+        },
+    }
+
+
+def print_result(result):
+    print(f"\n== {result['scenario']}: {result['requests']} requests in {result['seconds']}s "
+          f"({result['requests_per_sec']} req/s), peak RSS {result['peak_rss_mb']} MB, "
+          f"peak disk {result['peak_disk_mb']} MB")
+    print(f"   {'endpoint':<24}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, row in result['endpoints'].items():
+        print(f"   {endpoint:<24}{row['count']:>7}{row['errors']:>8}"
+              f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+
+
+def cleanup_downloads(before):
+    """Remove only what the load test added to the download folder"""
+    for name in set(os.listdir(DOWNLOAD_FOLDER)) - before:
+        path = os.path.join(DOWNLOAD_FOLDER, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated, default: all')
+    parser.add_argument('--clients', type=int, default=10, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=20, help='iterations per client')
+    parser.add_argument('--unique', type=int, default=20, help='distinct stub media ids')
+    parser.add_argument('--size', type=int, default=1024, help='media size in KiB')
+    parser.add_argument('--bandwidth', type=int, default=0, help='KiB/s per media connection, 0 = unthrottled')
+    parser.add_argument('--latency', type=float, default=0, help='media server latency in ms')
+    parser.add_argument('--poll-interval', type=float, default=0.25, help='seconds between /progress polls')
+    parser.add_argument('--server', choices=('gunicorn', 'uvicorn', 'werkzeug'), default='gunicorn')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--json', help='also write results to this file')
+    parser.add_argument('--verbose', action='store_true', help='show app server logs')
+    args = parser.parse_args()
+
+    media = MediaServer(bandwidth=args.bandwidth * 1024, latency=args.latency / 1000).start()
+    state_dir = tempfile.mkdtemp(prefix='achek-bench-')
+    os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
+    before = set(os.listdir(DOWNLOAD_FOLDER))
+    process, base = start_server(args, media.url, state_dir)
+
+    results = []
+    try:
+        print(f'{args.server} at {base}, media at {media.url} '
+              f'({args.size} KiB, {args.bandwidth or "unlimited"} KiB/s, {args.latency} ms)')
+        for name in args.scenarios.split(','):
+            result = run_scenario(name.strip(), args, base, process.pid)
+            result['media_bytes_served'] = media.bytes_sent
+            results.append(result)
+            print_result(result)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        media.stop()
+        cleanup_downloads(before)
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
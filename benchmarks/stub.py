@@ -0,0 +1,179 @@
+"""Offline stand-ins for the platforms: a throttled media server and a yt-dlp stub extractor
+
+The stub extractor answers URLs of the form https://stub.local/video/<id>
+with a progressive mp4 and an audio-only m4a format, both served by
+MediaServer. Configuration is read from the environment so the app can run
+in a separate server process:
+
+    STUB_MEDIA_URL   base URL of the media server
+    STUB_MEDIA_SIZE  bytes per media file
+"""
+import http.server
+import os
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import yt_dlp
+from yt_dlp.extractor.common import InfoExtractor
+
+CONTENT_TYPES = {'.mp4': 'video/mp4', '.m4a': 'audio/mp4', '.jpg': 'image/jpeg'}
+
+
+class MediaServer:
+    """Serves synthetic media at /media/<name>?size=N with fixed latency and per-connection bandwidth
+
+    Single byte ranges are honoured so resumed and ranged downloads can be
+    exercised. drop_after cuts every response after that many body bytes,
+    simulating a connection lost mid-transfer.
+    """
+
+    def __init__(self, bandwidth=0, latency=0.0, host='127.0.0.1', port=0, drop_after=None):
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.drop_after = drop_after
+        self.bytes_sent = 0
+        self.range_requests = 0
+        self._lock = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        # yt-dlp's generic probing and cancelled clients hang up early
+        self._server.handle_error = lambda *args: None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+    def _count(self, size):
+        with self._lock:
+            self.bytes_sent += size
+
+    def _count_range(self):
+        with self._lock:
+            self.range_requests += 1
+
+    def _handler(self):
+        media = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self._respond(send_body=False)
+
+            def do_GET(self):
+                self._respond(send_body=True)
+
+            def _respond(self, send_body):
+                parts = urlsplit(self.path)
+                size = int(parse_qs(parts.query).get('size', [1024 * 1024])[0])
+                content_type = CONTENT_TYPES.get(os.path.splitext(parts.path)[1], 'application/octet-stream')
+                start, end = self._range(size)
+                if media.latency:
+                    time.sleep(media.latency)
+                if start or end < size - 1:
+                    media._count_range()
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(end - start + 1))
+                self.send_header('Accept-Ranges', 'bytes')
+                self.end_headers()
+                if not send_body:
+                    return
+
+                length = end - start + 1
+                if media.drop_after is not None:
+                    length = min(length, media.drop_after)
+                block = b'\0' * 64 * 1024
+                sent = 0
+                started = time.monotonic()
+                while sent < length:
+                    chunk = block[:min(len(block), length - sent)]
+                    self.wfile.write(chunk)
+                    sent += len(chunk)
+                    media._count(len(chunk))
+                    if media.bandwidth:
+                        # Sleep until the transfer is back on the configured rate
+                        ahead = sent / media.bandwidth - (time.monotonic() - started)
+                        if ahead > 0:
+                            time.sleep(ahead)
+                if sent < end - start + 1:
+                    self.close_connection = True
+
+            def _range(self, size):
+                """(first, last) byte of a 'bytes=a-b' request, the whole file otherwise"""
+                header = self.headers.get('Range', '')
+                if not header.startswith('bytes=') or ',' in header:
+                    return 0, size - 1
+                first, _, last = header[len('bytes='):].partition('-')
+                if not first:
+                    return max(0, size - int(last)), size - 1
+                return int(first), min(size - 1, int(last)) if last else size - 1
+
+        return Handler
+
+
+class StubIE(InfoExtractor):
+    IE_NAME = 'stub'
+    _VALID_URL = r'https?://stub\.local/video/(?P<id>[\w-]+)'
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        base = os.environ['STUB_MEDIA_URL']
+        size = int(os.environ.get('STUB_MEDIA_SIZE', 1024 * 1024))
+        return {
+            'id': video_id,
+            'title': f'Stub video {video_id}',
+            'uploader': 'stub',
+            'duration': 60,
+            'thumbnail': f'{base}/media/{video_id}.jpg?size=2048',
+            'formats': [{
+                'format_id': '360p',
+                'url': f'{base}/media/{video_id}.mp4?size={size}',
+                'ext': 'mp4',
+                'height': 360,
+                'width': 640,
+                'vcodec': 'avc1.42001E',
+                'acodec': 'mp4a.40.2',
+                'filesize': size,
+                'tbr': size * 8 / 60 / 1000,
+            }, {
+                'format_id': 'audio',
+                'url': f'{base}/media/{video_id}.m4a?size={size // 8}',
+                'ext': 'm4a',
+                'vcodec': 'none',
+                'acodec': 'mp4a.40.2',
+                'abr': 128,
+                'filesize': size // 8,
+            }],
+        }
+
+
+class StubYoutubeDL(yt_dlp.YoutubeDL):
+    """YoutubeDL that tries StubIE before any real extractor"""
+
+    def __init__(self, params=None, auto_init=True):
+        super().__init__(params, auto_init)
+        stub = StubIE()
+        self._ies = {stub.ie_key(): stub, **self._ies}
+        self._ies_instances[stub.ie_key()] = stub
+        stub.set_downloader(self)
+
+
+def install():
+    """Route every YoutubeDL the app creates through StubYoutubeDL"""
+    yt_dlp.YoutubeDL = StubYoutubeDL
@@ -0,0 +1,20 @@
+"""WSGI and ASGI entry points serving the app with yt-dlp routed to the stub extractor
+
+    STUB_MEDIA_URL=http://127.0.0.1:8000 gunicorn --pythonpath benchmarks stub_app:app
+    STUB_MEDIA_URL=http://127.0.0.1:8000 uvicorn --app-dir benchmarks stub_app:asgi_app
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stub
+
+stub.install()
+
+from app import app  # noqa: E402
+from asgi import app as asgi_app  # noqa: E402,F401
+
+if __name__ == '__main__':
+    # Threaded development server, for comparing against gunicorn
+    app.run(host='127.0.0.1', port=int(os.environ.get('PORT', 5000)), threaded=True)
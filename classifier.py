@@ -0,0 +1,207 @@
+import functools
+
+# Registrable hostnames of the platforms we have dedicated handling for;
+# subdomains (www., m., vm., music. ...) resolve through their parent domain
+PLATFORM_DOMAINS = {
+    'tiktok.com': 'tiktok',
+    'instagram.com': 'instagram',
+    'youtube.com': 'youtube',
+    'youtu.be': 'youtube',
+    'twitter.com': 'twitter',
+    'x.com': 'twitter',
+    'facebook.com': 'facebook',
+    'fb.watch': 'facebook',
+    'fb.me': 'facebook',
+    'spotify.com': 'spotify',
+    'audiomack.com': 'audiomack',
+    'soundcloud.com': 'soundcloud',
+    'vimeo.com': 'vimeo',
+    'netflix.com': 'netflix',
+}
+
+# Per-platform rules as ('keyword|keyword', reason, message), tried in
+# order; the platform's fallback applies when none match. Keywords are
+# matched against the lowercased yt-dlp error text.
+PLATFORM_ERRORS = {
+    'tiktok': ([
+        ('unable to extract|video data', 'unavailable',
+         '📱 TikTok Error: Unable to access this video. Possible reasons:\n• Video is private or deleted\n• Account is private\n• Video is region-locked\n• TikTok is blocking automated access\n\nSolutions:\n✓ Make sure the video is public\n✓ Try a different TikTok video\n✓ Wait 2-3 minutes and try again\n✓ Copy the link directly from TikTok app/website'),
+        ('login required|sign in', 'login_required',
+         '📱 TikTok requires login to access this content. Only public videos from public accounts can be downloaded without authentication.'),
+    ], '📱 TikTok download failed. The video may be unavailable or TikTok is blocking requests. Wait 2-3 minutes and try again with a different video.'),
+    'instagram': ([
+        ('rate-limit|rate limit|ratelimit', 'rate_limited',
+         '📸 Instagram Rate Limit: Too many requests detected.\n\nSolutions:\n✓ Wait 5-10 minutes before trying again\n✓ Instagram blocks automated downloads temporarily\n✓ Try a different post in the meantime\n✓ Make sure the post is public'),
+        ('login required|authentication', 'login_required',
+         '📸 Instagram Login Required: This content requires authentication.\n\nPossible reasons:\n• Post is from a private account\n• Content is age-restricted\n• Instagram is blocking automated access\n\nOnly public posts and reels can be downloaded.'),
+        ('not available', 'unavailable',
+         '📸 Instagram Content Unavailable:\n• Post may be deleted or made private\n• Story/Highlight has expired\n• Account is private or blocked\n• Region restrictions apply\n\nTry a different public post or reel.'),
+        ('private', 'private',
+         '📸 This Instagram account/post is private. Only public content can be downloaded.'),
+    ], '📸 Instagram Error: Unable to fetch content. Instagram may be blocking requests.\n\nSolutions:\n✓ Wait 5-10 minutes and try again\n✓ Make sure the post/reel is public\n✓ Try copying the link directly from Instagram app\n✓ Use a different public post'),
+    'youtube': ([
+        ('private|unavailable', 'unavailable',
+         '🎬 YouTube video is private, deleted, or unavailable in your region.'),
+        ('your age|age-restrict|age restrict|restricted', 'age_restricted',
+         '🔞 This YouTube video is age-restricted and requires login to access.'),
+        ('live event|live stream|livestream|is live|live broadcast', 'live',
+         '📡 Live streams cannot be downloaded. Wait until the stream ends and try again.'),
+    ], '🎬 YouTube download failed. The video may be region-locked, removed, or have download restrictions.'),
+    'facebook': ([
+        ('login required|private', 'private',
+         '📘 Facebook content is private or requires login. Only public videos can be downloaded.'),
+    ], '📘 Facebook download failed. Make sure the video is public and not from a private group or profile.'),
+    'twitter': ([
+        ('no video|no media', 'no_media',
+         '😕 This tweet doesn\'t contain a video. We can only download tweets with video content.'),
+        ('private|protected', 'private',
+         '🔒 This Twitter/X account is private. Only public tweets can be downloaded.'),
+    ], '❌ Twitter/X download failed. Make sure the tweet is public and contains video content.'),
+    'spotify': ([], '🎧 Spotify Error: Spotify uses DRM protection and requires premium subscription.\n\nThis content cannot be downloaded directly. Spotify restricts downloading to prevent piracy.'),
+    'audiomack': ([], '🎵 Audiomack download failed.\n\nPossible reasons:\n• Track is premium-only\n• Content is region-locked\n• Link is invalid\n\nSolutions:\n✓ Make sure the track is publicly available\n✓ Copy the link directly from Audiomack\n✓ Try a different free track'),
+    'soundcloud': ([
+        ('private', 'private',
+         '🎶 This SoundCloud track is private. Only public tracks can be downloaded.'),
+    ], '🎶 SoundCloud download failed. Make sure the track is public and not premium-only.'),
+    'vimeo': ([
+        ('password|private', 'private',
+         '🎥 This Vimeo video is password-protected or private. Only public videos can be downloaded.'),
+    ], '🎥 Vimeo download failed. The video may have download restrictions or be private.'),
+    'netflix': ([], '🎬 Netflix content is DRM-protected and cannot be downloaded. This is a copyright restriction enforced by Netflix.'),
+}
+
+# Rules for every other site, in the same form
+GENERIC_ERRORS = [
+    ('drm|protected', 'drm',
+     '🔒 This content is DRM-protected and cannot be downloaded due to copyright restrictions.'),
+    ('429|too many requests|rate-limit|rate limit|ratelimit', 'rate_limited',
+     '⏰ Rate Limit Reached: Too many requests.\n\nPlease wait 5-10 minutes and try again. The platform is temporarily blocking automated downloads.'),
+    ('geo|region', 'geo_restricted',
+     '🌍 This content is region-locked and not available in your location.'),
+    ('private', 'private',
+     '🔒 This content is private. Only public content can be downloaded.'),
+    ('login|sign in|authentication', 'login_required',
+     '🔐 Login required. Only public content can be downloaded without authentication.'),
+    ('no video|no media', 'no_media',
+     '📭 No video found. This post may contain only images or text.'),
+    ('unsupported url', 'unsupported',
+     '❓ This website is not supported yet. We support YouTube, Spotify, Audiomack, Netflix, Instagram, TikTok, Facebook, and 1000+ other platforms.'),
+    ('invalid', 'invalid_url',
+     '🔗 Invalid link format. Please copy and paste the full URL from your browser.'),
+]
+
+# Failures worth retrying from the partial file: dropped or stalled
+# connections and overloaded servers, never missing or forbidden media
+RETRYABLE_ERRORS = {
+    'TransportError', 'IncompleteRead', 'ContentTooShortError', 'ConnectionError', 'ConnectionResetError',
+    'TimeoutError', 'ReadTimeoutError', 'SSLError', 'ProxyError', 'RemoteDisconnected',
+}
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+RETRYABLE_TEXT = ('timed out', 'connection reset', 'connection aborted', 'incomplete read', 'more expected',
+                  'giving up after')
+
+# Failure reasons that say the platform is refusing us rather than this
+# one piece of media; consecutive ones trip the platform's circuit breaker
+BREAKER_REASONS = ('rate_limited', 'login_required')
+
+GENERIC_FALLBACK = '⚠️ Download Error: Unable to access this content.\n\nPossible reasons:\n• Content is unavailable or deleted\n• Platform is blocking automated access\n• Link is invalid\n\nPlease try:\n✓ Checking if the content is public\n✓ Waiting a few minutes and trying again\n✓ Using a different link'
+
+
+class ErrorTable:
+    """Ordered ('keyword|keyword', reason, message) rules, compiled once at import
+
+    The error text is lowercased a single time and each rule is a tuple of
+    substring tests, replacing the repeated .lower() calls of the old
+    if/elif chains. The first matching rule wins, as it did there.
+    """
+
+    def __init__(self, rules):
+        self.rules = [(tuple(keywords.split('|')), reason, message) for keywords, reason, message in rules]
+
+    def match(self, text):
+        """(reason, message) of the first matching rule, None if nothing matches"""
+        text = text.lower()
+        for keywords, reason, message in self.rules:
+            for keyword in keywords:
+                if keyword in text:
+                    return reason, message
+        return None
+
+
+PLATFORM_TABLES = {platform: (ErrorTable(rules), fallback) for platform, (rules, fallback) in PLATFORM_ERRORS.items()}
+GENERIC_TABLE = ErrorTable(GENERIC_ERRORS)
+
+
+def url_hostname(url):
+    """Lowercase hostname of url, also for links pasted without a scheme"""
+    rest = url.strip().lower()
+    scheme, separator, after = rest.partition('://')
+    if separator and not any(char in scheme for char in '/?#'):
+        rest = after
+    host = rest.partition('/')[0].partition('?')[0].partition('#')[0]
+    # Drop credentials and port
+    return host.rpartition('@')[2].partition(':')[0].rstrip('.')
+
+
+@functools.lru_cache(maxsize=4096)
+def detect_platform(url):
+    """Classify a URL by platform name, 'unknown' if not recognised
+
+    A job classifies its URL several times (queue, metrics, error
+    messages), so results are memoised.
+    """
+    host = url_hostname(url or '')
+    # Try the full hostname, then drop one leading label at a time
+    while host:
+        platform = PLATFORM_DOMAINS.get(host)
+        if platform:
+            return platform
+        host = host.partition('.')[2]
+    return 'unknown'
+
+
+def classify_error(platform, error, unexpected=False):
+    """Map a yt-dlp error to (reason, user message) for the given platform
+
+    unexpected marks errors that did not come from yt-dlp; if no rule
+    matches they are reported with their own text instead of the generic
+    access message.
+    """
+    text = str(error)
+    table, fallback = PLATFORM_TABLES.get(platform, (None, None))
+    if table is not None:
+        return table.match(text) or ('failed', fallback)
+
+    matched = GENERIC_TABLE.match(text)
+    if matched:
+        return matched
+    if unexpected:
+        return 'unexpected', f'⚠️ Something went wrong: {text}. Please try again or use a different link.'
+    return 'failed', GENERIC_FALLBACK
+
+
+def is_retryable(error):
+    """Whether a failed download may succeed when retried, unwrapping yt-dlp's DownloadError"""
+    cause = getattr(error, 'exc_info', None)
+    cause = cause[1] if cause and cause[1] is not None else error
+    status = getattr(cause, 'status', None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS
+    if type(cause).__name__ in RETRYABLE_ERRORS:
+        return True
+    text = str(error).lower()
+    return any(fragment in text for fragment in RETRYABLE_TEXT)
+
+
+def breaker_reason(platform, error):
+    """The BREAKER_REASONS entry error counts as, None if it says nothing about the platform blocking us
+
+    The platform's own rules decide first, so e.g. an age-restricted
+    YouTube video does not count as a login wall; only when they fall
+    through to the fallback are the generic rules (429, sign in, ...)
+    consulted.
+    """
+    reason, _ = classify_error(platform, error)
+    if reason == 'failed':
+        reason = (GENERIC_TABLE.match(str(error)) or (None, None))[0]
+    return reason if reason in BREAKER_REASONS else None
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from jobs import process_alive
+from shared_db import SharedDB
+
+# Suffixes yt-dlp uses for files that are still being written
+PARTIAL_SUFFIXES = ('.part', '.ytdl', '.temp')
+
+# Seconds between checks while another job produces the same file
+CLAIM_POLL_INTERVAL = 0.5
+
+
+def cache_key(info, options):
+    """Content address for a processed info dict and the options that shape the output file
+
+    Combines the extractor, media id and the format yt-dlp actually
+    selected with any postprocessing settings, so the same media in the
+    same format and container always maps to the same file.
+    """
+    material = json.dumps([
+        info.get('extractor_key') or info.get('extractor'),
+        info.get('id'),
+        info.get('format_id'),
+        options,
+    ], sort_keys=True)
+    return hashlib.sha1(material.encode('utf-8')).hexdigest()
+
+
+def is_cached_file(name):
+    """Whether a filename in the cache folder is a finished file stored under its cache key"""
+    key = name.partition('.')[0]
+    return len(key) == 40 and all(c in '0123456789abcdef' for c in key) and not name.endswith(PARTIAL_SUFFIXES)
+
+
+class DownloadCache:
+    """Finished downloads stored under their cache key
+
+    Files are evicted by the storage manager; lookup() refreshes the mtime
+    it uses for LRU ordering. The job producing a key holds a claim row in
+    the shared SQLite database, so identical jobs in any worker wait for
+    its file instead of downloading it again; a claim whose worker died is
+    taken over by the next job that asks.
+    """
+
+    def __init__(self, folder, path=None):
+        self.folder = folder
+        self.db = SharedDB(path)
+        self._claimed = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.db.connect().execute(
+            'CREATE TABLE IF NOT EXISTS download_claims ('
+            'key TEXT PRIMARY KEY, '
+            'pid INTEGER NOT NULL, '
+            'claimed_at REAL NOT NULL)'
+        )
+
+    def lookup(self, key, ext):
+        """Filename of the finished download for key, or None"""
+        filename = f'{key}.{ext}'
+        try:
+            # Mark as recently used for LRU eviction
+            os.utime(os.path.join(self.folder, filename))
+        except OSError:
+            return None
+        return filename
+
+    def store(self, key, path):
+        """Move a finished file into the cache and return its cached filename"""
+        filename = key + os.path.splitext(path)[1]
+        os.replace(path, os.path.join(self.folder, filename))
+        return filename
+
+    def _holder(self, conn, key):
+        row = conn.execute('SELECT pid FROM download_claims WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None and process_alive(row[0]) else None
+
+    def claim(self, key):
+        """Register interest in producing key
+
+        Returns True for the caller that must download the file and then
+        call release(key); other callers get False and should wait(key,
+        ext) before looking the key up again.
+        """
+        conn = self.db.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            leader = self._holder(conn, key) is None
+            if leader:
+                conn.execute('INSERT OR REPLACE INTO download_claims (key, pid, claimed_at) VALUES (?, ?, ?)',
+                             (key, os.getpid(), time.time()))
+        finally:
+            conn.execute('COMMIT')
+        with self._lock:
+            if leader:
+                self.misses += 1
+                self._claimed.add(key)
+            else:
+                self.coalesced += 1
+        return leader
+
+    def wait(self, key, ext):
+        """Poll until key's file is stored or no live job produces it any more"""
+        while self.lookup(key, ext) is None and self._holder(self.db.connect(), key) is not None:
+            time.sleep(CLAIM_POLL_INTERVAL)
+
+    def release(self, key):
+        with self._lock:
+            self._claimed.discard(key)
+        self.db.connect().execute('DELETE FROM download_claims WHERE key = ? AND pid = ?', (key, os.getpid()))
+
+    def record_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def in_flight(self):
+        """Keys a live job in any worker is still producing, never evicted"""
+        rows = self.db.connect().execute('SELECT key, pid FROM download_claims').fetchall()
+        return [key for key, pid in rows if process_alive(pid)]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._claimed),
+                'hit_rate': round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+            }
+
+
+def create_download_cache(folder):
+    """Build the cache of finished downloads kept in folder"""
+    return DownloadCache(folder)
@@ -0,0 +1,197 @@
+import collections
+import os
+
+# Size limits (MB) offered as "best under X MB" presets
+SIZE_PRESETS_MB = tuple(int(mb) for mb in os.environ.get('FORMAT_SIZE_PRESETS_MB', '25,50,100').split(',') if mb.strip())
+
+# Protocols served as one plain HTTP file, everything else arrives in fragments
+DIRECT_PROTOCOLS = ('http', 'https')
+
+# Audio container that muxes into mp4 without re-encoding, per video container
+AUDIO_FOR_VIDEO_EXT = {'mp4': 'm4a', 'webm': 'webm'}
+
+MediaFormat = collections.namedtuple('MediaFormat', [
+    'format_id', 'ext', 'protocol', 'height', 'width', 'fps', 'vcodec', 'acodec', 'tbr', 'abr',
+    'filesize', 'size_estimated', 'has_video', 'has_audio',
+])
+
+
+def estimate_size(f, duration):
+    """(bytes, estimated) from the reported size, else from bitrate x duration"""
+    size = f.get('filesize')
+    if size:
+        return int(size), False
+    if f.get('filesize_approx'):
+        return int(f['filesize_approx']), True
+    bitrate = f.get('tbr') or f.get('abr') or f.get('vbr')
+    if bitrate and duration:
+        # tbr is in kbit/s
+        return int(bitrate * 1000 / 8 * duration), True
+    return None, True
+
+
+def projected_size(info):
+    """Predicted bytes a processed info dict will download, 0 if nothing is known
+
+    Sums the merged streams of the selected format and every entry of a
+    playlist.
+    """
+    if info is None:
+        return 0
+    if info.get('entries') is not None:
+        return sum(projected_size(entry) for entry in info['entries'] if entry)
+    duration = info.get('duration')
+    streams = info.get('requested_formats') or [info]
+    return sum(estimate_size(f, duration)[0] or 0 for f in streams)
+
+
+def media_format(f, duration):
+    """MediaFormat for one entry of info['formats']"""
+    filesize, estimated = estimate_size(f, duration)
+    return MediaFormat(
+        format_id=f.get('format_id'),
+        ext=f.get('ext'),
+        protocol=f.get('protocol'),
+        height=f.get('height') or 0,
+        width=f.get('width') or 0,
+        fps=f.get('fps') or 0,
+        vcodec=f.get('vcodec'),
+        acodec=f.get('acodec'),
+        tbr=f.get('tbr') or 0,
+        abr=f.get('abr') or 0,
+        filesize=filesize,
+        size_estimated=estimated,
+        # An unknown codec (None) counts as present, as in yt-dlp's own selectors
+        has_video=f.get('vcodec') != 'none',
+        has_audio=f.get('acodec') != 'none',
+    )
+
+
+def build_formats(info):
+    """(video, audio) MediaFormat lists of a processed info dict, best first
+
+    Video formats are sorted by height, fps and bitrate, audio-only
+    formats by bitrate. Formats with neither stream (storyboards) are
+    dropped.
+    """
+    duration = info.get('duration')
+    video = {}
+    audio = {}
+    for f in info.get('formats') or []:
+        fmt = media_format(f, duration)
+        if fmt.has_video:
+            video[fmt.format_id] = fmt
+        elif fmt.has_audio:
+            audio[fmt.format_id] = fmt
+    video = sorted(video.values(), key=lambda f: (f.height, f.fps, f.has_audio, f.tbr), reverse=True)
+    audio = sorted(audio.values(), key=lambda f: (f.abr or f.tbr, f.filesize or 0), reverse=True)
+    return video, audio
+
+
+def size_mb(size):
+    return round(size / (1024 * 1024), 2) if size else 'Unknown'
+
+
+def format_entry(f):
+    """JSON entry for the format lists of /fetch_info"""
+    if f.has_video:
+        quality = f'{f.height}p' if f.height else 'Unknown'
+    else:
+        quality = f'{int(f.abr)}kbps' if f.abr else 'Audio'
+    entry = f._asdict()
+    entry.update({
+        'quality': quality,
+        'filesize': size_mb(f.filesize),
+        'filesize_bytes': f.filesize,
+        'needs_merge': f.has_video and not f.has_audio,
+    })
+    return entry
+
+
+def companion_audio(video_format, audio):
+    """Best audio-only format to merge with video_format, preferring one that remuxes cleanly"""
+    wanted = AUDIO_FOR_VIDEO_EXT.get(video_format.ext)
+    for f in audio:
+        if f.ext == wanted:
+            return f
+    return audio[0] if audio else None
+
+
+def delivery_options(video, audio):
+    """Every way to deliver a complete video: progressive formats alone, video-only ones merged
+
+    Yields (selector, video format, audio format or None, predicted bytes)
+    in the order of the video list.
+    """
+    for f in video:
+        if f.has_audio:
+            yield f.format_id, f, None, f.filesize
+            continue
+        companion = companion_audio(f, audio)
+        if companion is None:
+            continue
+        size = f.filesize + companion.filesize if f.filesize and companion.filesize else None
+        yield f'{f.format_id}+{companion.format_id}', f, companion, size
+
+
+def preset(key, label, option, fallback='best'):
+    selector, video_format, audio_format, size = option
+    return {
+        'key': key,
+        'label': label,
+        # Fall back to yt-dlp's choice if the format ids changed since extraction
+        'format_id': f'{selector}/{fallback}',
+        'height': video_format.height,
+        'ext': video_format.ext,
+        'filesize': size_mb(size),
+        'filesize_bytes': size,
+        'size_estimated': video_format.size_estimated or bool(audio_format and audio_format.size_estimated),
+        'needs_merge': audio_format is not None,
+        'direct': video_format.protocol in DIRECT_PROTOCOLS and (
+            audio_format is None or audio_format.protocol in DIRECT_PROTOCOLS),
+    }
+
+
+def recommend_presets(video, audio, size_limits=SIZE_PRESETS_MB):
+    """Presets for /fetch_info: best, fastest to deliver, best under each size limit and best audio
+
+    'fastest' is the best single progressive file over plain HTTP, which
+    needs no ffmpeg merge and can be streamed straight to the client.
+    """
+    options = list(delivery_options(video, audio))
+    presets = []
+    if options:
+        presets.append(preset('best', 'Best quality', options[0]))
+
+        progressive = [option for option in options if option[2] is None]
+        direct = [option for option in progressive if option[1].protocol in DIRECT_PROTOCOLS]
+        if direct or progressive:
+            presets.append(preset('fastest', 'Fastest (no merge needed)', (direct or progressive)[0]))
+
+        offered = set()
+        for limit in sorted(size_limits):
+            fitting = next((option for option in options
+                            if option[3] and option[3] <= limit * 1024 * 1024), None)
+            # A larger limit picking the same format adds nothing
+            if fitting is None or fitting[0] in offered:
+                continue
+            offered.add(fitting[0])
+            # Never fall back to plain 'best', which ignores the limit the preset promises
+            presets.append(preset(f'under_{limit}mb', f'Best under {limit} MB', fitting,
+                                  fallback=f'best[filesize<={limit}MiB]/best[filesize_approx<={limit}MiB]/worst'))
+
+    if audio:
+        best_audio = audio[0]
+        presets.append({
+            'key': 'audio',
+            'label': 'Best audio',
+            'format_id': f'{best_audio.format_id}/bestaudio/best',
+            'height': 0,
+            'ext': best_audio.ext,
+            'filesize': size_mb(best_audio.filesize),
+            'filesize_bytes': best_audio.filesize,
+            'size_estimated': best_audio.size_estimated,
+            'needs_merge': False,
+            'direct': best_audio.protocol in DIRECT_PROTOCOLS,
+        })
+    return presets
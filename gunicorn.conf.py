@@ -0,0 +1,30 @@
+"""gunicorn settings, read from the working directory: gunicorn app:app
+
+Command-line flags still override anything set here.
+"""
+import os
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+worker_class = 'sync'
+timeout = 180
+
+# Import the app once in the master and fork workers from it, so a new or
+# restarted worker answers / and health checks without importing anything
+# (GUNICORN_PRELOAD=0 to import in every worker, e.g. for --reload)
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+
+def when_ready(server):
+    # Also load yt-dlp before forking; workers then share its modules copy-on-write
+    app = sys.modules.get('app')
+    if preload_app and app is not None:
+        app.ydl_pool.load_engine()
+        server.log.info('Preloaded yt-dlp in %.2fs', app.ydl_pool.load_seconds)
+
+
+def post_worker_init(worker):
+    # Background threads are per process and never inherited from the master
+    from app import start_background_tasks
+    start_background_tasks()
@@ -0,0 +1,262 @@
+import collections
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from jobs import process_alive
+from shared_db import SharedDB
+
+# Query parameters that only track the share and never change the media
+TRACKING_PARAMS = {
+    'si', 'feature', 'igshid', 'igsh', 'fbclid', 'gclid', 'ref', 'ref_src', '_r', '_t',
+    'is_from_webapp', 'sender_device', 'share_app_id', 'mibextid', 'rdid', 'pp',
+}
+
+# Seconds an extraction may hold its claim before other workers take it over
+CLAIM_TIMEOUT = 90
+
+# Seconds between checks while another worker extracts the same media
+CLAIM_POLL_INTERVAL = 0.1
+
+
+def canonical_url(url):
+    """Normalise a media URL so different share links of the same media map to one key"""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or '').lower()
+    for prefix in ('www.', 'm.', 'mobile.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+
+    path = parts.path.rstrip('/') or '/'
+    query = [
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in TRACKING_PARAMS and not key.startswith('utm_')
+    ]
+
+    # youtu.be/<id> and /shorts/<id> are the same video as /watch?v=<id>
+    if host == 'youtu.be' and path != '/':
+        query.append(('v', path.lstrip('/')))
+        host, path = 'youtube.com', '/watch'
+    elif host == 'youtube.com' and path.startswith('/shorts/'):
+        query.append(('v', path[len('/shorts/'):]))
+        path = '/watch'
+
+    return urlunsplit(('https', host, path, urlencode(sorted(query)), ''))
+
+
+class _Flight:
+    """An in-progress computation other callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class InfoCache:
+    """TTL + LRU cache with single-flight coalescing of concurrent misses, shared by all workers
+
+    Results live in the shared SQLite database, trimmed to max_entries by
+    last use, with a small in-process copy in front of it. Only non-None
+    results are cached. When several callers miss on the same key at once,
+    in this worker or any other, one of them takes the key's claim row and
+    computes the value while the rest wait for it to be stored. Threads of
+    one worker waiting on the same computation receive its exception if it
+    fails; other workers find the claim gone and try the key themselves.
+    """
+
+    def __init__(self, ttl=600, max_entries=512, local_entries=64, path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.local_entries = local_entries
+        self.db = SharedDB(path)
+        self._entries = collections.OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        conn = self.db.connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS info_cache ('
+            'key TEXT PRIMARY KEY, '
+            'value TEXT NOT NULL, '
+            'expires_at REAL NOT NULL, '
+            'used_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS info_cache_used ON info_cache (used_at)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS info_claims ('
+            'key TEXT PRIMARY KEY, '
+            'pid INTEGER NOT NULL, '
+            'expires_at REAL NOT NULL)'
+        )
+
+    def get(self, key):
+        with self._lock:
+            value = self._get_locked(key)
+        if value is None:
+            value = self._get_shared(key)
+        return value
+
+    def _get_locked(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put_local(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.local_entries:
+                self._entries.popitem(last=False)
+
+    def _get_shared(self, key):
+        now = time.time()
+        conn = self.db.connect()
+        row = conn.execute('SELECT value, expires_at FROM info_cache WHERE key = ? AND expires_at > ?',
+                           (key, now)).fetchone()
+        if row is None:
+            return None
+        conn.execute('UPDATE info_cache SET used_at = ? WHERE key = ?', (now, key))
+        value = json.loads(row[0])
+        self._put_local(key, value, row[1])
+        return value
+
+    def put(self, key, value):
+        now = time.time()
+        expires_at = now + self.ttl
+        self._put_local(key, value, expires_at)
+        conn = self.db.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('INSERT OR REPLACE INTO info_cache (key, value, expires_at, used_at) VALUES (?, ?, ?, ?)',
+                         (key, json.dumps(value), expires_at, now))
+            conn.execute('DELETE FROM info_cache WHERE expires_at <= ?', (now,))
+            evicted = conn.execute(
+                'DELETE FROM info_cache WHERE key IN ('
+                'SELECT key FROM info_cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,),
+            ).rowcount
+        finally:
+            conn.execute('COMMIT')
+        if evicted > 0:
+            with self._lock:
+                self.evictions += evicted
+
+    def _claim(self, key):
+        """Take the key's claim row unless a live worker holds an unexpired one"""
+        now = time.time()
+        conn = self.db.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT pid, expires_at FROM info_claims WHERE key = ?', (key,)).fetchone()
+            if row is not None and row[1] > now and process_alive(row[0]):
+                return False
+            conn.execute('INSERT OR REPLACE INTO info_claims (key, pid, expires_at) VALUES (?, ?, ?)',
+                         (key, os.getpid(), now + CLAIM_TIMEOUT))
+            return True
+        finally:
+            conn.execute('COMMIT')
+
+    def _release(self, key):
+        self.db.connect().execute('DELETE FROM info_claims WHERE key = ? AND pid = ?', (key, os.getpid()))
+
+    def _compute_shared(self, key, compute):
+        """(value, outcome) once this worker or another has produced it
+
+        outcome is 'hit' when the shared table already had the value,
+        'coalesced' when another worker computed it and 'miss' when it
+        was computed here.
+        """
+        waited = False
+        while True:
+            value = self._get_shared(key)
+            if value is not None:
+                return value, 'coalesced' if waited else 'hit'
+            if self._claim(key):
+                break
+            waited = True
+            time.sleep(CLAIM_POLL_INTERVAL)
+        try:
+            # Stored between the lookup and the claim by a worker that just finished
+            value = self._get_shared(key)
+            if value is not None:
+                return value, 'coalesced'
+            value = compute()
+            if value is not None:
+                self.put(key, value)
+            return value, 'miss'
+        finally:
+            self._release(key)
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            value = self._get_locked(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result, outcome = self._compute_shared(key, compute)
+            with self._lock:
+                if outcome == 'hit':
+                    self.hits += 1
+                elif outcome == 'coalesced':
+                    self.coalesced += 1
+                else:
+                    self.misses += 1
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self.misses += 1
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self):
+        shared = self.db.connect().execute('SELECT COUNT(*) FROM info_cache').fetchone()[0]
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'entries': len(self._entries),
+                'shared_entries': shared,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'hit_rate': round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+            }
+
+
+def create_info_cache():
+    """Build the cache from INFO_CACHE_TTL and INFO_CACHE_SIZE (entries shared by all workers)"""
+    return InfoCache(
+        ttl=int(os.environ.get('INFO_CACHE_TTL', 600)),
+        max_entries=int(os.environ.get('INFO_CACHE_SIZE', 512)),
+    )
@@ -0,0 +1,211 @@
+import collections
+import contextlib
+import os
+import threading
+import time
+import uuid
+
+from shared_db import SharedDB
+
+
+class QueueFull(Exception):
+    """Raised when the download queue cannot accept more jobs"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Download queue is full, retry in {retry_after}s')
+        self.retry_after = retry_after
+
+
+def parse_platform_limits(value):
+    """Parse 'instagram=1,tiktok=2' into {'instagram': 1, 'tiktok': 2}"""
+    limits = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        platform, limit = item.split('=', 1)
+        limits[platform.strip()] = max(1, int(limit))
+    return limits
+
+
+def process_alive(pid):
+    """Whether a process with this pid still runs on this host"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ConnectionBudget:
+    """Caps the extra connections all downloads on the host hold at once
+
+    Every job always has its own connection; lease() lends it up to
+    wanted - 1 more for the length of the download, fewer when other jobs
+    hold them, so a burst of jobs shares the budget instead of opening
+    jobs x connections sockets to the same CDN. Leases are rows in the
+    shared SQLite database, so the budget holds across gunicorn workers;
+    rows left by a worker that died are dropped by the next lease.
+    """
+
+    def __init__(self, total, path=None):
+        self.total = total
+        self.in_use = 0
+        self.db = SharedDB(path)
+        self._lock = threading.Lock()
+        self.db.connect().execute(
+            'CREATE TABLE IF NOT EXISTS connection_leases ('
+            'token TEXT PRIMARY KEY, '
+            'pid INTEGER NOT NULL, '
+            'connections INTEGER NOT NULL)'
+        )
+
+    def _held(self, conn):
+        held = 0
+        for pid, connections in conn.execute(
+                'SELECT pid, SUM(connections) FROM connection_leases GROUP BY pid').fetchall():
+            if process_alive(pid):
+                held += connections
+            else:
+                conn.execute('DELETE FROM connection_leases WHERE pid = ?', (pid,))
+        return held
+
+    @contextlib.contextmanager
+    def lease(self, wanted):
+        """Yield the number of connections granted, between 1 and wanted"""
+        token = uuid.uuid4().hex
+        extra = 0
+        if wanted > 1:
+            conn = self.db.connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                extra = max(0, min(wanted - 1, self.total - self._held(conn)))
+                if extra:
+                    conn.execute('INSERT INTO connection_leases (token, pid, connections) VALUES (?, ?, ?)',
+                                 (token, os.getpid(), extra))
+            finally:
+                conn.execute('COMMIT')
+        with self._lock:
+            self.in_use += extra
+        try:
+            yield 1 + extra
+        finally:
+            with self._lock:
+                self.in_use -= extra
+            if extra:
+                self.db.connect().execute('DELETE FROM connection_leases WHERE token = ?', (token,))
+
+    def stats(self):
+        """Budget for the host, extra connections held by this worker and by all of them"""
+        conn = self.db.connect()
+        host = conn.execute('SELECT COALESCE(SUM(connections), 0) FROM connection_leases').fetchone()[0]
+        with self._lock:
+            return {'total': self.total, 'in_use': self.in_use, 'host_in_use': host}
+
+
+class DownloadQueue:
+    """Bounded pool of download threads fed by a FIFO with per-platform limits
+
+    Jobs are picked in submission order, skipping any job whose platform is
+    already running at its limit so one throttled platform cannot starve the
+    others. submit() raises QueueFull once max_pending jobs are waiting.
+    """
+
+    def __init__(self, workers=2, max_pending=20, platform_limits=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.platform_limits = platform_limits or {}
+        self._pending = collections.deque()
+        self._running = collections.Counter()
+        self._cond = threading.Condition()
+        self._threads = []
+        # Smoothed job duration, used to estimate Retry-After
+        self._avg_duration = None
+
+    def _start(self):
+        # Threads are created lazily so importing the app stays side-effect free
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, job_id, platform, fn, *args):
+        with self._cond:
+            if len(self._pending) >= self.max_pending:
+                raise QueueFull(self.retry_after())
+            self._start()
+            self._pending.append((job_id, platform, fn, args))
+            self._cond.notify()
+
+    def retry_after(self):
+        """Rough seconds until a queue slot frees up"""
+        avg = self._avg_duration or 30
+        return max(1, int(avg * (len(self._pending) + 1) / self.workers))
+
+    def position(self, job_id):
+        """1-based queue position of a waiting job, 0 if it is not waiting"""
+        with self._cond:
+            for index, job in enumerate(self._pending):
+                if job[0] == job_id:
+                    return index + 1
+        return 0
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'pending': len(self._pending),
+                'running': sum(self._running.values()),
+                'running_by_platform': dict(self._running),
+            }
+
+    def _next_job(self):
+        for index, job in enumerate(self._pending):
+            platform = job[1]
+            if self._running[platform] < self.platform_limits.get(platform, self.workers):
+                del self._pending[index]
+                return job
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+                self._running[job[1]] += 1
+
+            job_id, platform, fn, args = job
+            started = time.time()
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Download job {job_id} crashed: {e}")
+            finally:
+                duration = time.time() - started
+                with self._cond:
+                    self._running[platform] -= 1
+                    if self._avg_duration is None:
+                        self._avg_duration = duration
+                    else:
+                        self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+                    # A platform slot freed up, waiting jobs may now be eligible
+                    self._cond.notify_all()
+
+
+def create_download_queue():
+    """Build the queue from DOWNLOAD_WORKERS, DOWNLOAD_QUEUE_SIZE and DOWNLOAD_PLATFORM_LIMITS"""
+    return DownloadQueue(
+        workers=int(os.environ.get('DOWNLOAD_WORKERS', 2)),
+        max_pending=int(os.environ.get('DOWNLOAD_QUEUE_SIZE', 20)),
+        platform_limits=parse_platform_limits(
+            os.environ.get('DOWNLOAD_PLATFORM_LIMITS', 'instagram=1,tiktok=2')
+        ),
+    )
+
+
+def create_connection_budget():
+    """Build the budget from DOWNLOAD_CONNECTIONS_TOTAL (default 16, shared by all workers on the host)"""
+    return ConnectionBudget(int(os.environ.get('DOWNLOAD_CONNECTIONS_TOTAL', 16)))
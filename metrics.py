@@ -0,0 +1,397 @@
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+
+from jobs import process_alive
+from shared_db import SharedDB
+
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+SPEED_BUCKETS = (64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2)
+SIZE_BUCKETS = (1024 ** 2, 10 * 1024 ** 2, 50 * 1024 ** 2, 100 * 1024 ** 2, 500 * 1024 ** 2, 1024 ** 3)
+
+
+def _label_key(labels):
+    return json.dumps(sorted((labels or {}).items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def error_class(e):
+    """Exception class name, unwrapping the cause carried by yt-dlp's DownloadError"""
+    cause = getattr(e, 'exc_info', None)
+    if cause and cause[1] is not None:
+        return type(cause[1]).__name__
+    return type(e).__name__
+
+
+def process_start(pid):
+    """Start time of a process in clock ticks since boot, None where /proc is unavailable"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+def worker_alive(worker, pid):
+    """Whether the process that wrote rows as worker still runs, telling reused pids apart by start time"""
+    if not process_alive(pid):
+        return False
+    start = process_start(pid)
+    return start is None or worker == f'{pid}-{start}'
+
+
+# Worker column of the row that keeps the counters of exited workers
+RETIRED = 'retired'
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metrics:
+    """Prometheus-style counters, gauges and histograms aggregated across gunicorn workers
+
+    Each worker accumulates values in memory and periodically writes its
+    cumulative totals to the shared SQLite database, one row per (worker,
+    series) where worker is the pid plus the process start time, so a
+    reused pid never overwrites an exited worker's totals. Once a worker
+    has exited, the next flush folds its counters and histograms into the
+    'retired' rows and deletes its own, keeping the table at one set of
+    rows per live worker. render() sums all rows, so counters keep
+    counting across worker restarts; gauges only include workers that
+    flushed recently.
+    """
+
+    def __init__(self, path=None, flush_interval=10):
+        self.db = SharedDB(path)
+        self.flush_interval = flush_interval
+        self._families = {}
+        self._values = {}
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._worker = (None, None)
+        self._create_table()
+
+    def _create_table(self):
+        conn = self.db.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(metrics)')]
+            if columns and 'worker' not in columns:
+                # Rows keyed by pid alone: keep them under a worker name no live
+                # process matches, so the next flush retires them
+                conn.execute('ALTER TABLE metrics RENAME TO metrics_by_pid')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS metrics ('
+                'worker TEXT NOT NULL, '
+                'pid INTEGER NOT NULL, '
+                'name TEXT NOT NULL, '
+                'labels TEXT NOT NULL, '
+                'kind TEXT NOT NULL, '
+                'value REAL NOT NULL, '
+                'updated_at REAL NOT NULL, '
+                'PRIMARY KEY (worker, name, labels))'
+            )
+            if columns and 'worker' not in columns:
+                conn.execute(
+                    "INSERT INTO metrics SELECT pid || '-legacy', pid, name, labels, kind, value, updated_at "
+                    'FROM metrics_by_pid'
+                )
+                conn.execute('DROP TABLE metrics_by_pid')
+        finally:
+            conn.execute('COMMIT')
+
+    def worker(self):
+        """Row key of this process, recomputed after a fork"""
+        pid = os.getpid()
+        if self._worker[0] != pid:
+            self._worker = (pid, f'{pid}-{process_start(pid) or int(time.time() * 1000)}')
+        return self._worker[1]
+
+    def counter(self, name, help_text):
+        self._families[name] = ('counter', help_text, None)
+
+    def gauge(self, name, help_text):
+        self._families[name] = ('gauge', help_text, None)
+
+    def histogram(self, name, help_text, buckets=DURATION_BUCKETS):
+        self._families[name] = ('histogram', help_text, tuple(buckets))
+
+    def add_collector(self, collect):
+        """Register a callable returning [(name, labels, value)] sampled at every flush"""
+        self._collectors.append(collect)
+
+    def inc(self, name, labels=None, value=1):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+        self._start_flusher()
+
+    def set(self, name, value, labels=None):
+        with self._lock:
+            self._values[(name, _label_key(labels))] = value
+        self._start_flusher()
+
+    def observe(self, name, value, labels=None):
+        buckets = self._families[name][2]
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+        self._start_flusher()
+
+    @contextlib.contextmanager
+    def time(self, name, labels=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, labels)
+
+    def _start_flusher(self):
+        # A worker forked from a master that already flushed inherits a dead thread
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Metrics flush error: {e}")
+
+    def _series(self):
+        """This worker's series as (name, labels_key, kind, value) rows"""
+        for collect in self._collectors:
+            for name, labels, value in collect():
+                self.set(name, value, labels)
+
+        rows = []
+        with self._lock:
+            for (name, labels), value in self._values.items():
+                rows.append((name, labels, self._families[name][0], value))
+            for (name, labels), (counts, total, count) in self._histograms.items():
+                buckets = self._families[name][2]
+                base = json.loads(labels)
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else _format_value(bound)
+                    rows.append((f'{name}_bucket', _label_key(dict(base, le=le)), 'histogram', cumulative))
+                rows.append((f'{name}_sum', labels, 'histogram', total))
+                rows.append((f'{name}_count', labels, 'histogram', count))
+        return rows
+
+    def flush(self):
+        pid = os.getpid()
+        worker = self.worker()
+        now = time.time()
+        rows = [(worker, pid, name, labels, kind, value, now) for name, labels, kind, value in self._series()]
+        conn = self.db.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT OR REPLACE INTO metrics (worker, pid, name, labels, kind, value, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                rows,
+            )
+            self._retire(conn, now)
+        finally:
+            conn.execute('COMMIT')
+
+    def _retire(self, conn, now):
+        """Fold the rows of exited workers into the retired totals, gauges are dropped"""
+        quiet = now - 3 * self.flush_interval
+        candidates = conn.execute(
+            'SELECT worker, pid FROM metrics WHERE worker != ? GROUP BY worker, pid HAVING MAX(updated_at) < ?',
+            (RETIRED, quiet),
+        ).fetchall()
+        for worker, pid in candidates:
+            if worker_alive(worker, pid):
+                continue
+            conn.execute(
+                'INSERT INTO metrics (worker, pid, name, labels, kind, value, updated_at) '
+                'SELECT ?, 0, name, labels, kind, value, ? FROM metrics '
+                "WHERE worker = ? AND kind != 'gauge' "
+                'ON CONFLICT (worker, name, labels) DO UPDATE SET value = value + excluded.value, '
+                'updated_at = excluded.updated_at',
+                (RETIRED, now, worker),
+            )
+            conn.execute('DELETE FROM metrics WHERE worker = ?', (worker,))
+
+    def render(self, extra=()):
+        """Prometheus text exposition of all workers, extra holds (name, labels, value) gauges sampled now"""
+        self.flush()
+        stale = time.time() - 3 * self.flush_interval
+        rows = self.db.connect().execute(
+            "SELECT name, labels, SUM(value) FROM metrics WHERE kind != 'gauge' OR updated_at > ? "
+            'GROUP BY name, labels ORDER BY name, labels',
+            (stale,),
+        ).fetchall()
+
+        samples = {}
+        for name, labels, value in rows:
+            family = name
+            for suffix in ('_bucket', '_sum', '_count'):
+                if name.endswith(suffix) and name[:-len(suffix)] in self._families:
+                    family = name[:-len(suffix)]
+            samples.setdefault(family, []).append((name, json.loads(labels), value))
+        for name, labels, value in extra:
+            samples.setdefault(name, []).append((name, sorted((labels or {}).items()), value))
+
+        lines = []
+        for family in sorted(samples):
+            kind, help_text, _ = self._families.get(family, ('gauge', '', None))
+            lines.append(f'# HELP {family} {help_text}')
+            lines.append(f'# TYPE {family} {kind}')
+            for name, labels, value in samples[family]:
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# Postprocessors worth their own span, everything else counts as 'postprocess'
+POSTPROCESS_STAGES = {
+    'Merger': 'merge',
+}
+
+
+class JobTimer:
+    """Per-job timing spans fed by the yt-dlp progress and postprocessor hooks"""
+
+    def __init__(self, platform):
+        self.platform = platform
+        self.started = time.time()
+        self.spans = {}
+        self._open = {}
+        self.bytes = 0
+        self.cache_hit = False
+        self._speed_total = 0.0
+        self._speed_samples = 0
+
+    def progress(self, d):
+        """Feed one progress_hook update; the download span covers every fragment and stream"""
+        if d['status'] == 'downloading':
+            self.start('download')
+            self.add_speed(d.get('speed'))
+        elif d['status'] == 'finished':
+            self.stop('download')
+            self.bytes += d.get('total_bytes') or d.get('downloaded_bytes') or 0
+
+    def postprocess(self, d):
+        """Feed one postprocessor_hook update"""
+        if d['postprocessor'] == 'MoveFiles':
+            return
+        stage = POSTPROCESS_STAGES.get(d['postprocessor'], 'postprocess')
+        if d['status'] == 'started':
+            self.start(stage)
+        elif d['status'] == 'finished':
+            self.stop(stage)
+
+    def start(self, stage):
+        # Called for every progress_hook update, so skip the clock read once open
+        if stage not in self._open:
+            self._open[stage] = time.perf_counter()
+
+    def stop(self, stage):
+        started = self._open.pop(stage, None)
+        if started is not None:
+            self.spans[stage] = self.spans.get(stage, 0.0) + time.perf_counter() - started
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        self.start(stage)
+        try:
+            yield
+        finally:
+            self.stop(stage)
+
+    def add(self, stage, seconds):
+        self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+
+    def add_speed(self, speed):
+        if speed:
+            self._speed_total += speed
+            self._speed_samples += 1
+
+    @property
+    def average_speed(self):
+        return self._speed_total / self._speed_samples if self._speed_samples else None
+
+    def finish(self, metrics, download_id, result, failure=None):
+        """Close open spans, record them as metrics and log one structured line"""
+        for stage in list(self._open):
+            self.stop(stage)
+        self.spans['total'] = time.time() - self.started
+
+        labels = {'platform': self.platform}
+        for stage, seconds in self.spans.items():
+            metrics.observe('achek_stage_duration_seconds', seconds, dict(labels, stage=stage))
+        metrics.inc('achek_jobs_total', dict(labels, result=result))
+        if self.bytes:
+            metrics.inc('achek_download_bytes_total', labels, self.bytes)
+            metrics.observe('achek_download_size_bytes', self.bytes, labels)
+        if self.average_speed:
+            metrics.observe('achek_download_speed_bytes_per_second', self.average_speed, labels)
+        if failure:
+            metrics.inc('achek_errors_total', dict(labels, stage='download', error_class=failure))
+
+        print(json.dumps({
+            'event': 'download_job',
+            'download_id': download_id,
+            'platform': self.platform,
+            'result': result,
+            'error_class': failure,
+            'cache_hit': self.cache_hit,
+            'bytes': self.bytes,
+            'avg_speed': round(self.average_speed) if self.average_speed else None,
+            'spans': {stage: round(seconds, 3) for stage, seconds in self.spans.items()},
+        }))
+
+
+def create_metrics():
+    """Build the registry with the app's metric families, flushing every METRICS_FLUSH_INTERVAL seconds"""
+    metrics = Metrics(flush_interval=int(os.environ.get('METRICS_FLUSH_INTERVAL', 10)))
+    metrics.histogram('achek_stage_duration_seconds',
+                      'Time spent per pipeline stage (queue_wait, extract, download, merge, remux, transcode, total, ...)')
+    metrics.counter('achek_jobs_total', 'Finished download jobs by result')
+    metrics.counter('achek_download_bytes_total', 'Bytes transferred from platforms')
+    metrics.histogram('achek_download_size_bytes', 'Bytes transferred per job', SIZE_BUCKETS)
+    metrics.histogram('achek_download_speed_bytes_per_second',
+                      'Average transfer speed per job from progress_hook samples', SPEED_BUCKETS)
+    metrics.counter('achek_errors_total', 'Failed extractions and downloads by error class')
+    metrics.counter('achek_fetch_info_total', '/fetch_info requests by result')
+    metrics.counter('achek_cache_requests_total', 'Cache lookups by cache and result')
+    metrics.gauge('achek_queue_jobs', 'Download jobs waiting or running')
+    metrics.gauge('achek_audio_jobs', 'Audio remuxes and transcodes waiting for or running on the converter pool')
+    metrics.counter('achek_audio_conversions_total', 'Finished audio conversions by action (copy or transcode)')
+    metrics.counter('achek_throttled_total', 'Extractions refused by the platform rate limiter or circuit breaker')
+    metrics.gauge('achek_breaker_state', 'Circuit breaker per platform: 0 closed, 1 half open, 2 open')
+    metrics.gauge('achek_rate_limit_tokens', 'Tokens left in the platform rate limit bucket')
+    metrics.gauge('achek_download_connections', 'Extra download connections in use and the budget shared by all workers')
+    metrics.gauge('achek_asgi_connections', 'Open HTTP requests in ASGI mode, including idle streams')
+    metrics.gauge('achek_asgi_blocking_calls', 'Handler calls running on or waiting for the ASGI blocking thread pool')
+    metrics.gauge('achek_download_folder_bytes', 'Bytes on disk in the download folder')
+    return metrics
@@ -0,0 +1,156 @@
+import gzip
+import hashlib
+import os
+import threading
+import time
+
+from flask import Response, current_app, render_template, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Precompressed variants kept per page, preferred in this order
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# Seconds between checks of a page's template file for changes
+TEMPLATE_CHECK_INTERVAL = 1.0
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=11)
+    # mtime=0 keeps the bytes, and so the ETag, identical across workers
+    return gzip.compress(body, 9, mtime=0)
+
+
+def accepted_encodings(header):
+    """Content codings an Accept-Encoding header allows, without the ones it gives q=0"""
+    accepted = set()
+    for item in (header or '').split(','):
+        coding, _, params = item.partition(';')
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+class RenderedPage:
+    """A rendered template with its compressed variants and one strong ETag per variant"""
+
+    def __init__(self, name, body, mtime):
+        self.name = name
+        self.mtime = mtime
+        self.checked = time.monotonic()
+        digest = hashlib.sha1(body).hexdigest()[:16]
+        self.variants = {'identity': (body, f'"{digest}"')}
+        for encoding in ENCODINGS:
+            compressed = compress(body, encoding)
+            if len(compressed) < len(body):
+                self.variants[encoding] = (compressed, f'"{digest}-{encoding}"')
+
+    def select(self, accept_encoding):
+        """(encoding, body, etag) of the first variant in ENCODINGS order the client accepts"""
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ENCODINGS:
+            if encoding in self.variants and encoding in accepted:
+                return (encoding,) + self.variants[encoding]
+        return ('identity',) + self.variants['identity']
+
+
+class PageCache:
+    """Landing pages rendered once per process and served from memory
+
+    The templates take no per-request context, so the rendered HTML only
+    changes with the template file, which is checked at most once per
+    TEMPLATE_CHECK_INTERVAL. Pages are keyed by script root as well, since
+    url_for() links depend on where the app is mounted.
+    """
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self._pages = {}
+        self._lock = threading.Lock()
+        self.renders = 0
+
+    def get(self, name):
+        key = (name, request.script_root)
+        page = self._pages.get(key)
+        if page is not None:
+            now = time.monotonic()
+            if now - page.checked < TEMPLATE_CHECK_INTERVAL:
+                return page
+            page.checked = now
+            if not self._changed(name, page):
+                return page
+        with self._lock:
+            page = RenderedPage(name, render_template(name).encode('utf-8'), self._mtime(name))
+            self._pages[key] = page
+            self.renders += 1
+        return page
+
+    def _mtime(self, name):
+        _, filename, _ = current_app.jinja_env.loader.get_source(current_app.jinja_env, name)
+        return os.path.getmtime(filename) if filename else None
+
+    def _changed(self, name, page):
+        try:
+            return self._mtime(name) != page.mtime
+        except OSError:
+            return False
+
+    def response(self, name):
+        """200 with the best precompressed variant, or 304 if the client's copy is current"""
+        page = self.get(name)
+        encoding, body, etag = page.select(request.headers.get('Accept-Encoding'))
+        if request.if_none_match.contains_weak(etag.strip('"')):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype='text/html')
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.headers['ETag'] = etag
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = f'public, max-age={self.max_age}'
+        return response
+
+    def stats(self):
+        return {'pages': len(self._pages), 'renders': self.renders}
+
+
+class AssetVersions:
+    """Short content hashes of static files for ?v= cache busting, recomputed when a file changes"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._versions = {}
+
+    def version(self, filename):
+        """Hash of the file's content, None if it does not exist"""
+        path = os.path.join(self.folder, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._versions.get(filename)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        version = digest.hexdigest()[:10]
+        self._versions[filename] = (signature, version)
+        return version
+
+
+def create_page_cache():
+    """Build the cache with PAGE_MAX_AGE seconds of browser and proxy caching (default 300)"""
+    return PageCache(int(os.environ.get('PAGE_MAX_AGE', 300)))
@@ -0,0 +1,295 @@
+import json
+import os
+import threading
+import time
+
+from shared_db import SharedDB
+
+# Seconds a record lives after its last write unless a shorter TTL is given
+DEFAULT_TTL = 3600
+
+# A running download's record is written at most this often (seconds), unless
+# its percentage moved by PROGRESS_PUBLISH_STEP points; clients poll every 0.5s
+PROGRESS_PUBLISH_INTERVAL = float(os.environ.get('PROGRESS_PUBLISH_INTERVAL', 0.5))
+PROGRESS_PUBLISH_STEP = int(os.environ.get('PROGRESS_PUBLISH_STEP', 5))
+
+# Seconds between speed samples, and the weight of the newest one in the moving average
+SPEED_SAMPLE_INTERVAL = 0.25
+SPEED_SMOOTHING = 0.3
+
+
+class ProgressStore:
+    """Base class for download progress backends
+
+    Records are plain JSON-serialisable dicts keyed by download_id. Every
+    write carries a TTL; expired records are invisible to readers and are
+    removed by a single sweeper thread per store instead of one sleeping
+    thread per job.
+    """
+
+    def __init__(self, sweep_interval=30):
+        self.sweep_interval = sweep_interval
+        self._sweeper = None
+        self._sweeper_lock = threading.Lock()
+
+    def get(self, download_id, default=None):
+        raise NotImplementedError
+
+    def set(self, download_id, record, ttl=DEFAULT_TTL):
+        raise NotImplementedError
+
+    def update(self, download_id, ttl=DEFAULT_TTL, **fields):
+        """Merge fields into an existing record, returns False if it is missing"""
+        raise NotImplementedError
+
+    def update_if(self, download_id, check, ttl=DEFAULT_TTL, **fields):
+        """Merge fields only if check(record) holds, atomically across workers"""
+        raise NotImplementedError
+
+    def expire(self, download_id, ttl):
+        """Shorten the lifetime of a record to ttl seconds from now"""
+        raise NotImplementedError
+
+    def delete(self, download_id):
+        raise NotImplementedError
+
+    def purge_expired(self):
+        """Drop expired records, returns the number removed"""
+        raise NotImplementedError
+
+    def __contains__(self, download_id):
+        return self.get(download_id) is not None
+
+    def start_sweeper(self):
+        """Start the expiry sweeper once per process"""
+        with self._sweeper_lock:
+            if self._sweeper is not None and self._sweeper.is_alive():
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                removed = self.purge_expired()
+                if removed:
+                    print(f"Expired {removed} progress record(s)")
+            except Exception as e:
+                print(f"Progress sweep error: {e}")
+
+
+class MemoryProgressStore(ProgressStore):
+    """Per-process store, only correct with a single worker"""
+
+    def __init__(self, sweep_interval=30):
+        super().__init__(sweep_interval)
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def get(self, download_id, default=None):
+        with self._lock:
+            entry = self._records.get(download_id)
+            if entry is None or entry[1] <= time.time():
+                return default
+            return dict(entry[0])
+
+    def set(self, download_id, record, ttl=DEFAULT_TTL):
+        with self._lock:
+            self._records[download_id] = (dict(record), time.time() + ttl)
+
+    def update(self, download_id, ttl=DEFAULT_TTL, **fields):
+        return self.update_if(download_id, lambda record: True, ttl, **fields)
+
+    def update_if(self, download_id, check, ttl=DEFAULT_TTL, **fields):
+        with self._lock:
+            entry = self._records.get(download_id)
+            if entry is None or entry[1] <= time.time() or not check(entry[0]):
+                return False
+            record = dict(entry[0])
+            record.update(fields)
+            self._records[download_id] = (record, time.time() + ttl)
+            return True
+
+    def expire(self, download_id, ttl):
+        with self._lock:
+            entry = self._records.get(download_id)
+            if entry is not None:
+                self._records[download_id] = (entry[0], min(entry[1], time.time() + ttl))
+
+    def delete(self, download_id):
+        with self._lock:
+            self._records.pop(download_id, None)
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (_, expires_at) in self._records.items() if expires_at <= now]
+            for key in expired:
+                del self._records[key]
+        return len(expired)
+
+
+class SQLiteProgressStore(ProgressStore):
+    """Store backed by a SQLite database in WAL mode, shared by all workers on the host"""
+
+    def __init__(self, path=None, sweep_interval=30):
+        super().__init__(sweep_interval)
+        self.db = SharedDB(path)
+        self._connect = self.db.connect
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS progress ('
+            'download_id TEXT PRIMARY KEY, '
+            'data TEXT NOT NULL, '
+            'expires_at REAL NOT NULL)'
+        )
+        self._connect().execute('CREATE INDEX IF NOT EXISTS progress_expires ON progress (expires_at)')
+
+    def get(self, download_id, default=None):
+        row = self._connect().execute(
+            'SELECT data FROM progress WHERE download_id = ? AND expires_at > ?',
+            (download_id, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, download_id, record, ttl=DEFAULT_TTL):
+        self._connect().execute(
+            'INSERT OR REPLACE INTO progress (download_id, data, expires_at) VALUES (?, ?, ?)',
+            (download_id, json.dumps(record), time.time() + ttl),
+        )
+
+    def update(self, download_id, ttl=DEFAULT_TTL, **fields):
+        return self.update_if(download_id, lambda record: True, ttl, **fields)
+
+    def update_if(self, download_id, check, ttl=DEFAULT_TTL, **fields):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = conn.execute(
+                'SELECT data FROM progress WHERE download_id = ? AND expires_at > ?',
+                (download_id, now),
+            ).fetchone()
+            if row is None:
+                return False
+            record = json.loads(row[0])
+            if not check(record):
+                return False
+            record.update(fields)
+            conn.execute(
+                'UPDATE progress SET data = ?, expires_at = ? WHERE download_id = ?',
+                (json.dumps(record), now + ttl, download_id),
+            )
+            return True
+        finally:
+            conn.execute('COMMIT')
+
+    def expire(self, download_id, ttl):
+        self._connect().execute(
+            'UPDATE progress SET expires_at = MIN(expires_at, ?) WHERE download_id = ?',
+            (time.time() + ttl, download_id),
+        )
+
+    def delete(self, download_id):
+        self._connect().execute('DELETE FROM progress WHERE download_id = ?', (download_id,))
+
+    def purge_expired(self):
+        cursor = self._connect().execute('DELETE FROM progress WHERE expires_at <= ?', (time.time(),))
+        return cursor.rowcount
+
+
+class JobProgress:
+    """Progress of one running download, updated in place by every progress_hook call
+
+    yt-dlp calls the hook for each block it receives, thousands of times
+    per file. The latest numbers are kept in slots and only written to the
+    store every PROGRESS_PUBLISH_INTERVAL or PROGRESS_PUBLISH_STEP points,
+    so a job costs the store a few writes per second however fast it
+    downloads. Speed is an exponential moving average of the byte rate
+    over SPEED_SAMPLE_INTERVAL windows, and the ETA follows from it.
+    """
+
+    __slots__ = ('store', 'download_id', 'interval', 'step', 'downloaded', 'total', 'percentage', 'speed',
+                 'publishes', '_sample_time', '_sample_bytes', '_published_at', '_published_percentage')
+
+    def __init__(self, store, download_id, interval=PROGRESS_PUBLISH_INTERVAL, step=PROGRESS_PUBLISH_STEP):
+        self.store = store
+        self.download_id = download_id
+        self.interval = interval
+        self.step = step
+        self.downloaded = 0
+        self.total = 0
+        self.percentage = 0
+        self.speed = None
+        self.publishes = 0
+        self._sample_time = time.monotonic()
+        self._sample_bytes = 0
+        self._published_at = float('-inf')
+        self._published_percentage = 0
+
+    @property
+    def eta(self):
+        if not self.speed or not self.total:
+            return 0
+        return max(self.total - self.downloaded, 0) / self.speed
+
+    def update(self, downloaded, total):
+        """Take one progress sample, returns True if it was published"""
+        now = time.monotonic()
+        if downloaded < self._sample_bytes:
+            # The next file of the job (e.g. the audio stream of a merge) starts from zero
+            self._sample_time = now
+            self._sample_bytes = downloaded
+        elif now - self._sample_time >= SPEED_SAMPLE_INTERVAL:
+            rate = (downloaded - self._sample_bytes) / (now - self._sample_time)
+            self.speed = rate if self.speed is None else self.speed + SPEED_SMOOTHING * (rate - self.speed)
+            self._sample_time = now
+            self._sample_bytes = downloaded
+        self.downloaded = downloaded
+        self.total = total
+        self.percentage = min(downloaded * 100 // total, 100) if total > 0 else 0
+        if (now - self._published_at < self.interval
+                and abs(self.percentage - self._published_percentage) < self.step):
+            return False
+        self._published_at = now
+        self._published_percentage = self.percentage
+        self.publish()
+        return True
+
+    def publish(self):
+        self.publishes += 1
+        if not self.total:
+            self.store.set(self.download_id, {
+                'status': 'downloading',
+                'percentage': 0,
+                'message': 'Starting download...'
+            })
+            return
+        self.store.set(self.download_id, {
+            'status': 'downloading',
+            'percentage': self.percentage,
+            'downloaded': self.downloaded,
+            'total': self.total,
+            'speed': round(self.speed) if self.speed else 0,
+            'eta': round(self.eta)
+        })
+
+    def finish(self):
+        """A file is complete and moves on to postprocessing, always published"""
+        self.publishes += 1
+        self._published_at = float('-inf')
+        self.store.set(self.download_id, {
+            'status': 'processing',
+            'percentage': 100,
+            'message': 'Processing file...'
+        })
+
+
+def create_progress_store(backend=None, path=None):
+    """Build the progress store selected by PROGRESS_BACKEND ('sqlite' or 'memory')"""
+    backend = backend or os.environ.get('PROGRESS_BACKEND', 'sqlite')
+    if backend == 'memory':
+        return MemoryProgressStore()
+    if backend == 'sqlite':
+        return SQLiteProgressStore(path)
+    raise ValueError(f'Unknown progress backend: {backend}')
@@ -0,0 +1,236 @@
+import concurrent.futures
+import json
+import os
+import threading
+import time
+
+from yt_dlp.downloader import PROTOCOL_MAP
+from yt_dlp.downloader.http import HttpFD
+from yt_dlp.networking import Request
+from yt_dlp.networking.exceptions import HTTPError
+from yt_dlp.utils.networking import HTTPHeaderDict
+
+# Bytes fetched per Range request; files at most this large use one connection
+CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_BYTES', 8 * 1024 * 1024))
+
+# Bytes read from a response before they are written out
+READ_SIZE = 64 * 1024
+
+# Seconds between aggregate progress reports
+REPORT_INTERVAL = 0.5
+
+
+class RangedHttpFD(HttpFD):
+    """HTTP downloader fetching byte ranges of one file over several connections
+
+    Takes the place of yt-dlp's HttpFD and uses as many connections as the
+    concurrent_fragment_downloads param allows, the same setting yt-dlp
+    applies to HLS and DASH fragments. Each chunk is written at its offset
+    of the .part file as it arrives, so nothing is buffered beyond one
+    read. Finished chunks are listed in a .ranges file next to it, which
+    lets a retried job skip them. Anything that cannot be fetched in
+    ranges (one connection, unknown or small size, no Range support,
+    stdout) goes through HttpFD unchanged.
+    """
+
+    FD_NAME = 'ranged'
+
+    def real_download(self, filename, info_dict):
+        connections = self.params.get('concurrent_fragment_downloads') or 1
+        tmpfilename = self.temp_name(filename)
+        if (connections < 2 or filename == '-' or self.params.get('test')
+                or info_dict.get('request_data') is not None):
+            return self._sequential(filename, info_dict, tmpfilename)
+
+        headers = HTTPHeaderDict({'Accept-Encoding': 'identity'}, info_dict.get('http_headers'))
+        if 'Range' in headers:
+            return self._sequential(filename, info_dict, tmpfilename)
+
+        # The first chunk doubles as the probe for the size and Range support
+        try:
+            first = self.ydl.urlopen(Request(info_dict['url'], None, {**headers, 'Range': f'bytes=0-{CHUNK_SIZE - 1}'}))
+        except HTTPError:
+            # HttpFD knows how to report or recover from the status
+            return self._sequential(filename, info_dict, tmpfilename)
+        total = self._total_size(first)
+        if total is None or total <= CHUNK_SIZE:
+            first.close()
+            return self._sequential(filename, info_dict, tmpfilename)
+
+        chunk_count = (total + CHUNK_SIZE - 1) // CHUNK_SIZE
+        done = self._resume_state(tmpfilename, total)
+        self.report_destination(filename)
+        with open(tmpfilename, 'r+b' if done else 'wb') as dest, open(self._ranges_name(tmpfilename), 'w') as ranges:
+            # The list is written before the .part grows to full size, so a
+            # preallocated file is never mistaken for a finished prefix
+            ranges.write(json.dumps({'total': total, 'chunk': CHUNK_SIZE}) + '\n')
+            ranges.writelines(f'{index}\n' for index in sorted(done))
+            ranges.flush()
+            dest.truncate(total)
+            pending = [index for index in range(chunk_count) if index not in done]
+            if 0 in done or not pending:
+                first.close()
+                first = None
+            # Nothing pending when the last attempt died between its final chunk and the rename
+            if pending:
+                self._fetch_chunks(info_dict, headers, dest.fileno(), ranges, total, pending, done,
+                                   first, min(connections, len(pending)), filename, tmpfilename)
+
+        os.remove(self._ranges_name(tmpfilename))
+        self.try_rename(tmpfilename, filename)
+        self._hook_progress({
+            'status': 'finished',
+            'downloaded_bytes': total,
+            'total_bytes': total,
+            'filename': filename,
+        }, info_dict)
+        return True
+
+    def _sequential(self, filename, info_dict, tmpfilename):
+        # A .part file with chunks at scattered offsets would look finished to HttpFD's resume
+        ranges = self._ranges_name(tmpfilename)
+        if os.path.exists(ranges):
+            os.remove(ranges)
+            if os.path.exists(tmpfilename):
+                os.remove(tmpfilename)
+        return super().real_download(filename, info_dict)
+
+    @staticmethod
+    def _ranges_name(tmpfilename):
+        return tmpfilename + '.ranges'
+
+    @staticmethod
+    def _total_size(response):
+        """Full size from a 206 response's Content-Range, None if the server ignored the Range"""
+        content_range = response.headers.get('Content-Range') or ''
+        if response.status != 206 or '/' not in content_range:
+            return None
+        total = content_range.rpartition('/')[2]
+        return int(total) if total.isdigit() else None
+
+    def _resume_state(self, tmpfilename, total):
+        """Indexes of the chunks a previous attempt finished, empty to start over"""
+        if not self.params.get('continuedl', True) or not os.path.isfile(tmpfilename):
+            return set()
+        try:
+            with open(self._ranges_name(tmpfilename)) as ranges:
+                lines = ranges.read().splitlines()
+        except FileNotFoundError:
+            lines = None
+        except OSError:
+            return set()
+        if lines is not None:
+            # An empty or unreadable list leaves chunks at unknown offsets
+            try:
+                header = json.loads(lines[0])
+            except (ValueError, IndexError):
+                return set()
+            if header != {'total': total, 'chunk': CHUNK_SIZE}:
+                return set()
+            return {int(line) for line in lines[1:] if line.isdigit()}
+
+        size = os.path.getsize(tmpfilename)
+        if size >= total:
+            # Preallocated by a ranged attempt whose list is gone, not a finished prefix
+            return set()
+        # A sequential attempt left a prefix of the file: keep its whole chunks
+        return set(range(size // CHUNK_SIZE))
+
+    def _fetch_chunks(self, info_dict, headers, fd, ranges, total, pending, done, first, workers,
+                      filename, tmpfilename):
+        workers = max(1, workers)
+        lock = threading.Lock()
+        queue = list(reversed(pending))
+        resumed = sum(min(total, (index + 1) * CHUNK_SIZE) - index * CHUNK_SIZE for index in done)
+        state = {'bytes': 0, 'failed': None}
+        started = time.time()
+
+        def count(size):
+            with lock:
+                state['bytes'] += size
+
+        def next_chunk():
+            with lock:
+                if state['failed'] is not None or not queue:
+                    return None
+                return queue.pop()
+
+        def fetch(index, response):
+            start = index * CHUNK_SIZE
+            end = min(total, start + CHUNK_SIZE)
+            position = start
+            retries = self.params.get('retries') or 0
+            attempt = 0
+            while position < end:
+                try:
+                    if response is None:
+                        response = self.ydl.urlopen(Request(
+                            info_dict['url'], None, {**headers, 'Range': f'bytes={position}-{end - 1}'}))
+                        if response.status != 206:
+                            raise OSError(f'Range request answered with HTTP {response.status}')
+                    while position < end:
+                        data = response.read(min(READ_SIZE, end - position))
+                        if not data:
+                            raise OSError(f'Connection closed at byte {position} of chunk {index}')
+                        os.pwrite(fd, data, position)
+                        position += len(data)
+                        count(len(data))
+                except Exception:
+                    attempt += 1
+                    if attempt > retries:
+                        raise
+                    self.to_screen(f'[{self.FD_NAME}] Chunk {index} failed, retrying ({attempt}/{retries})')
+                    time.sleep(min(attempt, 5))
+                finally:
+                    if response is not None:
+                        response.close()
+                        response = None
+            with lock:
+                done.add(index)
+                ranges.write(f'{index}\n')
+                ranges.flush()
+
+        def worker(response):
+            try:
+                index = 0 if response is not None else next_chunk()
+                while index is not None:
+                    fetch(index, response)
+                    response = None
+                    index = next_chunk()
+            except Exception as e:
+                with lock:
+                    state['failed'] = state['failed'] or e
+
+        if first is not None:
+            # Worker 0 continues the probe response as chunk 0
+            queue.remove(0)
+        with concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='ranged') as pool:
+            futures = [pool.submit(worker, first if n == 0 else None) for n in range(workers)]
+            while True:
+                self._report(info_dict, state['bytes'], resumed, total, started, workers, filename, tmpfilename)
+                if not concurrent.futures.wait(futures, REPORT_INTERVAL).not_done:
+                    break
+
+        if state['failed'] is not None:
+            raise state['failed']
+
+    def _report(self, info_dict, fetched, resumed, total, started, workers, filename, tmpfilename):
+        now = time.time()
+        self._hook_progress({
+            'status': 'downloading',
+            'downloaded_bytes': resumed + fetched,
+            'total_bytes': total,
+            'filename': filename,
+            'tmpfilename': tmpfilename,
+            'elapsed': now - started,
+            # Aggregate over every connection of the download
+            'speed': self.calc_speed(started, now, fetched),
+            'eta': self.calc_eta(started, now, total - resumed, fetched),
+            'connections': workers,
+        }, info_dict)
+
+
+def install_ranged_downloader():
+    """Send yt-dlp's plain HTTP downloads through RangedHttpFD"""
+    PROTOCOL_MAP['http'] = RangedHttpFD
+    PROTOCOL_MAP['https'] = RangedHttpFD
@@ -0,0 +1,29 @@
+import os
+import sqlite3
+import tempfile
+import threading
+
+
+def default_db_path():
+    """SQLite file shared by all workers on the host (STATE_DB, or PROGRESS_DB for older setups)"""
+    return (os.environ.get('STATE_DB') or os.environ.get('PROGRESS_DB')
+            or os.path.join(tempfile.gettempdir(), 'achek_state.db'))
+
+
+class SharedDB:
+    """Per-thread, fork-safe connections to one SQLite database in WAL mode"""
+
+    def __init__(self, path=None):
+        self.path = path or default_db_path()
+        self._local = threading.local()
+
+    def connect(self):
+        # sqlite3 connections must not cross threads or forked workers
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
@@ -150,6 +150,29 @@ function displayMediaInfo(info) {
         }
     });
     
+    // Server-recommended presets: no-merge delivery and size-capped picks
+    (info.presets || []).forEach(preset => {
+        if (preset.key !== 'fastest' && !preset.key.startsWith('under_')) {
+            return;
+        }
+        const btn = document.createElement('button');
+        btn.className = 'format-btn';
+        btn.type = 'button';
+        let label = preset.label;
+        if (preset.height) {
+            label += ` (${preset.height}P)`;
+        }
+        if (preset.filesize !== 'Unknown') {
+            label += ` - ${preset.size_estimated ? '~' : ''}${preset.filesize}MB`;
+        }
+        const icon = preset.key === 'fastest' ? 'bolt' : 'compress';
+        btn.innerHTML = `<i class="fas fa-${icon}"></i> ${label}`;
+        btn.dataset.formatId = preset.format_id;
+        btn.dataset.type = 'video';
+        btn.addEventListener('click', () => handleFormatDownload(btn, preset.format_id, 'video'));
+        videoFormats.appendChild(btn);
+    });
+    
     // Display audio formats - DYNAMIC
     const audioFormats = document.getElementById('audioFormats');
     audioFormats.innerHTML = '';
@@ -164,6 +187,16 @@ function displayMediaInfo(info) {
     bestAudioBtn.addEventListener('click', () => handleFormatDownload(bestAudioBtn, 'bestaudio', 'audio'));
     audioFormats.appendChild(bestAudioBtn);
     
+    // Original stream in its own container (m4a/opus/ogg), no re-encode
+    const originalAudioBtn = document.createElement('button');
+    originalAudioBtn.className = 'format-btn';
+    originalAudioBtn.type = 'button';
+    originalAudioBtn.innerHTML = '<i class="fas fa-bolt"></i> Original (no re-encode)';
+    originalAudioBtn.dataset.formatId = 'bestaudio';
+    originalAudioBtn.dataset.type = 'audio';
+    originalAudioBtn.addEventListener('click', () => handleFormatDownload(originalAudioBtn, 'bestaudio', 'audio', 'best'));
+    audioFormats.appendChild(originalAudioBtn);
+    
     // Essential audio quality options - only necessary ones
     const audioPresets = [
         { id: 'bestaudio[abr<=192]', label: 'High (192kbps)', icon: 'music' },
@@ -195,7 +228,7 @@ function createFormatButton(format, type) {
         displayText += ` (${format.ext})`;
     }
     if (format.filesize && format.filesize !== 'Unknown') {
-        displayText += ` - ${format.filesize}MB`;
+        displayText += ` - ${format.size_estimated ? '~' : ''}${format.filesize}MB`;
     }
     
     btn.textContent = displayText;
@@ -221,7 +254,7 @@ function createDefaultButton(type) {
 }
 
 // Handle format download with Monetag ad (recurring ad system)
-async function handleFormatDownload(button, formatId, type) {
+async function handleFormatDownload(button, formatId, type, audioFormat = 'mp3') {
     // Initialize click counter if not exists
     if (!button.dataset.clickCount) {
         button.dataset.clickCount = '0';
@@ -264,7 +297,7 @@ async function handleFormatDownload(button, formatId, type) {
     button.style.color = 'white';
     
     try {
-        await downloadWithFormat(formatId, type);
+        await downloadWithFormat(formatId, type, audioFormat);
         
         // Download successful - restore original state for next ad cycle
         button.innerHTML = button.dataset.originalText;
@@ -303,7 +336,7 @@ function resetButton(btn) {
                 displayText += ` (${format.ext})`;
             }
             if (format.filesize && format.filesize !== 'Unknown') {
-                displayText += ` - ${format.filesize}MB`;
+                displayText += ` - ${format.size_estimated ? '~' : ''}${format.filesize}MB`;
             }
             btn.textContent = displayText;
         }
@@ -318,86 +351,98 @@ function resetAllFormatButtons() {
     allButtons.forEach(btn => resetButton(btn));
 }
 
-// Download with specified format
-async function downloadWithFormat(formatId, type) {
-    showDownloadProgress();
-    hideError();
-    hideDownloadResult();
-    
-    let progressInterval = null;
-    let downloadId = null;
-    
+// Failed downloads by url, format, type and audio format; trying the same one again resumes it
+const failedDownloads = {};
+
+// Ask the server to resume a failed download, resolves with its response or null
+async function retryDownload(downloadId) {
     try {
-        // Step 1: Start the download and get the download_id
-        const startResponse = await fetch('/start_download', {
+        const response = await fetch('/retry_download', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
             body: JSON.stringify({
-                url: currentUrl,
-                format_id: formatId,
-                type: type
+                download_id: downloadId
             })
         });
+        const data = await response.json();
+        return response.ok && data.success ? data : null;
+    } catch (err) {
+        console.log('Retry:', err);
+        return null;
+    }
+}
+
+// Download with specified format
+async function downloadWithFormat(formatId, type, audioFormat = 'mp3') {
+    showDownloadProgress();
+    hideError();
+    hideDownloadResult();
+    
+    try {
+        // Single-file formats can be streamed straight to the browser, audio only when kept as served
+        if (canStream(formatId, type, audioFormat)) {
+            const streamUrl = await tryStream(formatId, type, audioFormat);
+            if (streamUrl) {
+                updateProgressDisplay(100, 'Ready!', 0, 0);
+                showDownloadResult(streamUrl);
+                hideDownloadProgress();
+                return;
+            }
+        }
         
-        const startData = await startResponse.json();
+        // Step 1: Resume an earlier failed attempt, or queue a new download
+        const failedKey = `${currentUrl}|${formatId}|${type}|${audioFormat}`;
+        let startData = failedDownloads[failedKey] ? await retryDownload(failedDownloads[failedKey]) : null;
         
-        if (!startResponse.ok || !startData.success) {
-            showError(startData.error || 'Failed to start download');
-            hideDownloadProgress();
-            return;
+        if (!startData) {
+            const startResponse = await fetch('/start_download', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    url: currentUrl,
+                    format_id: formatId,
+                    type: type,
+                    audio_format: audioFormat
+                })
+            });
+            
+            startData = await startResponse.json();
+            
+            if (!startResponse.ok || !startData.success) {
+                showError(startData.error || 'Failed to start download');
+                hideDownloadProgress();
+                return;
+            }
         }
         
-        downloadId = startData.download_id;
+        const downloadId = startData.download_id;
         
-        // Step 2: Start polling for progress updates with the real download_id
-        progressInterval = setInterval(async () => {
-            try {
-                const progressResponse = await fetch(`/progress/${downloadId}`);
-                const progressData = await progressResponse.json();
-                
-                if (progressData.status === 'downloading' || progressData.status === 'processing' || progressData.status === 'starting') {
-                    updateProgressDisplay(
-                        progressData.percentage || 0,
-                        progressData.message || 'Downloading...',
-                        progressData.speed || 0,
-                        progressData.eta || 0
-                    );
-                } else if (progressData.status === 'complete') {
-                    clearInterval(progressInterval);
-                    updateProgressDisplay(100, 'Download complete!', 0, 0);
-                } else if (progressData.status === 'error') {
-                    clearInterval(progressInterval);
-                    showError(progressData.message || 'Download failed');
-                    hideDownloadProgress();
-                }
-            } catch (err) {
-                console.log('Progress check:', err);
-            }
-        }, 500); // Poll every 500ms
+        // Step 2: Follow progress until the job finishes on the server
+        const finalStatus = await waitForDownload(downloadId, startData.progress_stream);
+        
+        if (finalStatus === 'error') {
+            failedDownloads[failedKey] = downloadId;
+            return;
+        }
+        delete failedDownloads[failedKey];
         
-        // Step 3: Actually perform the download
+        // Step 3: Collect the result
         const downloadResponse = await fetch('/download', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
             body: JSON.stringify({
-                url: currentUrl,
-                format_id: formatId,
-                type: type,
                 download_id: downloadId
             })
         });
         
         const downloadData = await downloadResponse.json();
         
-        // Clear the polling interval
-        if (progressInterval) {
-            clearInterval(progressInterval);
-        }
-        
         if (downloadResponse.ok && downloadData.success) {
             updateProgressDisplay(100, 'Download complete!', 0, 0);
             setTimeout(() => {
@@ -412,12 +457,122 @@ async function downloadWithFormat(formatId, type) {
         console.error('Download error:', error);
         showError('Download failed. Please check your connection and try again.');
         hideDownloadProgress();
-        if (progressInterval) {
-            clearInterval(progressInterval);
-        }
     }
 }
 
+// Whether a /start_stream attempt can succeed; a failed one costs a second extraction
+// and platform rate-limit token when /start_download runs after it
+function canStream(formatId, type, audioFormat) {
+    if (type === 'audio') {
+        return audioFormat === 'best';
+    }
+    // Merged video+audio selections always need the file path
+    if (formatId.includes('+')) {
+        return false;
+    }
+    const presets = (mediaInfo && mediaInfo.presets) || [];
+    const preset = presets.find(p => p.format_id === formatId);
+    if (preset) {
+        return preset.direct && !preset.needs_merge;
+    }
+    // yt-dlp's 'best' is the best progressive file, worth trying when one is served over plain HTTP
+    const fastest = presets.find(p => p.key === 'fastest');
+    return !!fastest && fastest.direct;
+}
+
+// Ask the server for a direct stream link, returns null when the file path is needed
+async function tryStream(formatId, type, audioFormat = 'mp3') {
+    try {
+        const response = await fetch('/start_stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                url: currentUrl,
+                format_id: formatId,
+                type: type,
+                audio_format: audioFormat
+            })
+        });
+        const data = await response.json();
+        return response.ok && data.success ? data.stream_url : null;
+    } catch (err) {
+        console.log('Stream check:', err);
+        return null;
+    }
+}
+
+// Follow progress until the download completes, resolves with 'complete' or 'error'.
+// The server only hands out a stream URL when it runs in async mode; with sync
+// workers every open stream would hold a worker, so polling is the default.
+function waitForDownload(downloadId, streamUrl) {
+    if (!streamUrl || !window.EventSource) {
+        return pollForDownload(downloadId);
+    }
+    
+    return new Promise((resolve) => {
+        let received = false;
+        const source = new EventSource(streamUrl);
+        
+        source.onmessage = (event) => {
+            received = true;
+            const outcome = handleProgress(JSON.parse(event.data));
+            if (outcome) {
+                source.close();
+                resolve(outcome);
+            }
+        };
+        
+        // The browser reconnects on its own once the stream has worked;
+        // if it never delivered anything, fall back to polling
+        source.onerror = () => {
+            if (!received) {
+                source.close();
+                pollForDownload(downloadId).then(resolve);
+            }
+        };
+    });
+}
+
+// Poll progress, the default unless the server offers a progress stream
+function pollForDownload(downloadId) {
+    return new Promise((resolve) => {
+        const progressInterval = setInterval(async () => {
+            try {
+                const progressResponse = await fetch(`/progress/${downloadId}`);
+                const outcome = handleProgress(await progressResponse.json());
+                if (outcome) {
+                    clearInterval(progressInterval);
+                    resolve(outcome);
+                }
+            } catch (err) {
+                console.log('Progress check:', err);
+            }
+        }, 500); // Poll every 500ms
+    });
+}
+
+// Apply a progress update to the UI, returns 'complete' or 'error' once the job is done
+function handleProgress(progressData) {
+    if (progressData.status === 'queued' || progressData.status === 'downloading' || progressData.status === 'processing' || progressData.status === 'starting') {
+        updateProgressDisplay(
+            progressData.percentage || 0,
+            progressData.message || 'Downloading...',
+            progressData.speed || 0,
+            progressData.eta || 0
+        );
+    } else if (progressData.status === 'complete') {
+        updateProgressDisplay(100, 'Download complete!', 0, 0);
+        return 'complete';
+    } else if (progressData.status === 'error' || progressData.status === 'not_found') {
+        showError(progressData.message || 'Download failed');
+        hideDownloadProgress();
+        return 'error';
+    }
+    return null;
+}
+
 // Helper function to format bytes
 function formatBytes(bytes) {
     if (bytes === 0) return '0 Bytes';
@@ -0,0 +1,262 @@
+import contextlib
+import fcntl
+import os
+import threading
+import time
+import uuid
+
+from download_cache import is_cached_file
+from jobs import QueueFull, process_alive
+from shared_db import SharedDB
+
+
+class StorageFull(QueueFull):
+    """Raised when new downloads would not fit in the storage budget
+
+    A QueueFull, so callers that answer a full queue with 429 and
+    Retry-After refuse the job the same way. needed is the projected
+    size of the download that did not fit, 0 if unknown.
+    """
+
+    def __init__(self, retry_after, needed=0):
+        super().__init__(retry_after)
+        self.args = (f'Download storage is full, retry in {retry_after}s',)
+        self.needed = needed
+
+
+class StorageManager:
+    """Byte budget for the download folder, shared by all workers on the host
+
+    Usage is the folder's size as of the last scan plus the projected size
+    of every download in progress (its reservation). Eviction of finished
+    files, least recently used first and anything idle for max_age, runs
+    under an exclusive file lock so workers never evict concurrently, and
+    only the worker holding the leader lock runs the periodic sweep.
+    Pinned files, e.g. ones a client is still fetching, are never evicted.
+    """
+
+    def __init__(self, folder, max_bytes, max_age, path=None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.db = SharedDB(path)
+        self.leader = False
+        # Returns cache keys this process is still producing
+        self.protected = lambda: ()
+        conn = self.db.connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS storage_reservations ('
+            'download_id TEXT PRIMARY KEY, '
+            'bytes INTEGER NOT NULL, '
+            'pid INTEGER NOT NULL, '
+            'created_at REAL NOT NULL)'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS storage_pins ('
+            'token TEXT PRIMARY KEY, '
+            'path TEXT NOT NULL, '
+            'expires_at REAL NOT NULL)'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS storage_usage ('
+            'id INTEGER PRIMARY KEY CHECK (id = 0), '
+            'bytes INTEGER NOT NULL, '
+            'scanned_at REAL NOT NULL)'
+        )
+
+    @contextlib.contextmanager
+    def _file_lock(self, name):
+        """Exclusive flock on a file next to the database, released by the kernel if the process dies"""
+        with open(f'{self.db.path}.{name}.lock', 'a') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _usage(self, conn, exclude=None):
+        row = conn.execute('SELECT bytes FROM storage_usage WHERE id = 0').fetchone()
+        disk = row[0] if row else 0
+        reserved = conn.execute(
+            'SELECT COALESCE(SUM(bytes), 0) FROM storage_reservations WHERE download_id != ?',
+            (exclude or '',),
+        ).fetchone()[0]
+        return disk, reserved
+
+    def usage(self):
+        """(bytes on disk as of the last scan, bytes reserved by running downloads)"""
+        return self._usage(self.db.connect())
+
+    def _try_reserve(self, download_id, size):
+        conn = self.db.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            disk, reserved = self._usage(conn, exclude=download_id)
+            if disk + reserved + size > self.max_bytes:
+                return False
+            conn.execute(
+                'INSERT OR REPLACE INTO storage_reservations (download_id, bytes, pid, created_at) '
+                'VALUES (?, ?, ?, ?)',
+                (download_id, size, os.getpid(), time.time()),
+            )
+            return True
+        finally:
+            conn.execute('COMMIT')
+
+    def reserve(self, download_id, size):
+        """Reserve size bytes for a download, evicting to make room; False if it does not fit"""
+        size = int(size or 0)
+        if size > self.max_bytes:
+            return False
+        if self._try_reserve(download_id, size):
+            return True
+        self.evict(size)
+        return self._try_reserve(download_id, size)
+
+    def release(self, download_id, stored_bytes=0):
+        """Drop a reservation, counting the bytes the download left on disk until the next scan"""
+        conn = self.db.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM storage_reservations WHERE download_id = ?', (download_id,))
+            if stored_bytes:
+                conn.execute('UPDATE storage_usage SET bytes = bytes + ? WHERE id = 0', (stored_bytes,))
+        finally:
+            conn.execute('COMMIT')
+
+    def check_room(self, retry_after=60):
+        """Raise StorageFull if not even eviction can free part of the budget for a new job"""
+        disk, reserved = self.usage()
+        if disk + reserved < self.max_bytes:
+            return
+        self.evict()
+        disk, reserved = self.usage()
+        if disk + reserved >= self.max_bytes:
+            raise StorageFull(retry_after)
+
+    def purge_reservations(self):
+        """Drop reservations held by workers that no longer exist"""
+        conn = self.db.connect()
+        rows = conn.execute('SELECT download_id, pid FROM storage_reservations').fetchall()
+        for download_id, pid in rows:
+            if not process_alive(pid):
+                conn.execute('DELETE FROM storage_reservations WHERE download_id = ? AND pid = ?', (download_id, pid))
+
+    def pin(self, path, ttl):
+        """Protect a file (path relative to the folder) from eviction for ttl seconds, returns a token for unpin()"""
+        token = uuid.uuid4().hex
+        self.db.connect().execute(
+            'INSERT INTO storage_pins (token, path, expires_at) VALUES (?, ?, ?)',
+            (token, path.replace(os.sep, '/'), time.time() + ttl),
+        )
+        return token
+
+    def unpin(self, token):
+        self.db.connect().execute('DELETE FROM storage_pins WHERE token = ?', (token,))
+
+    def pinned(self):
+        """Relative paths with a live pin"""
+        conn = self.db.connect()
+        now = time.time()
+        conn.execute('DELETE FROM storage_pins WHERE expires_at <= ?', (now,))
+        return {row[0] for row in conn.execute('SELECT path FROM storage_pins WHERE expires_at > ?', (now,))}
+
+    def scan(self):
+        """Record the folder's total size, returns (total, [(mtime, size, path, name)] of evictable files)
+
+        Only finished cache files at the top of the folder are evictable;
+        job folders count towards the total but are cleaned up with their
+        jobs. A folder named after a download that still holds a
+        reservation is already counted by it, so only what it holds beyond
+        the reserved bytes is added.
+        """
+        reservations = dict(self.db.connect().execute('SELECT download_id, bytes FROM storage_reservations'))
+        in_progress = {}
+        total = 0
+        files = []
+        for dirpath, _, filenames in os.walk(self.folder):
+            relative = os.path.relpath(dirpath, self.folder).split(os.sep)
+            owner = next((part for part in relative if part in reservations), None)
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if owner is not None:
+                    in_progress[owner] = in_progress.get(owner, 0) + stat.st_size
+                    continue
+                total += stat.st_size
+                if dirpath == self.folder and is_cached_file(name):
+                    files.append((stat.st_mtime, stat.st_size, path, name))
+        total += sum(max(0, size - reservations[download_id]) for download_id, size in in_progress.items())
+        self.db.connect().execute(
+            'INSERT OR REPLACE INTO storage_usage (id, bytes, scanned_at) VALUES (0, ?, ?)',
+            (total, time.time()),
+        )
+        return total, files
+
+    def evict(self, needed=0):
+        """Delete idle and least recently used files until needed more bytes fit, returns the number removed"""
+        with self._file_lock('evict'):
+            total, files = self.scan()
+            _, reserved = self.usage()
+            pinned = self.pinned()
+            protected = set(self.protected())
+            stale = time.time() - self.max_age
+
+            removed = 0
+            for mtime, size, path, name in sorted(files):
+                over_budget = total + reserved + needed > self.max_bytes
+                if not over_budget and mtime > stale:
+                    break
+                if name in pinned or name.split('.', 1)[0] in protected:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+                print(f"Evicted cached download: {name}")
+
+            if removed:
+                self.db.connect().execute('UPDATE storage_usage SET bytes = ? WHERE id = 0', (total,))
+            return removed
+
+    def start_leader(self, sweep, interval):
+        """Run sweep every interval seconds in whichever worker holds the leader lock
+
+        Every worker waits on the lock in a daemon thread; when the leader
+        exits the kernel releases its lock and the next worker takes over.
+        """
+        thread = threading.Thread(target=self._lead, args=(sweep, interval), daemon=True)
+        thread.start()
+        return thread
+
+    def _lead(self, sweep, interval):
+        with self._file_lock('leader'):
+            self.leader = True
+            print(f"Worker {os.getpid()} is now the storage leader")
+            while True:
+                try:
+                    sweep()
+                except Exception as e:
+                    print(f"Storage sweep error: {e}")
+                time.sleep(interval)
+
+    def stats(self):
+        disk, reserved = self.usage()
+        return {
+            'budget_bytes': self.max_bytes,
+            'disk_bytes': disk,
+            'reserved_bytes': reserved,
+            'free_bytes': max(0, self.max_bytes - disk - reserved),
+            'leader': self.leader,
+        }
+
+
+def create_storage_manager(folder):
+    """Build the manager from STORAGE_BUDGET_BYTES (or DOWNLOAD_CACHE_BYTES, default 2 GiB) and STORAGE_MAX_AGE"""
+    budget = os.environ.get('STORAGE_BUDGET_BYTES') or os.environ.get('DOWNLOAD_CACHE_BYTES') or 2 * 1024 ** 3
+    return StorageManager(folder, int(budget), int(os.environ.get('STORAGE_MAX_AGE', 24 * 3600)))
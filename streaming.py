@@ -0,0 +1,71 @@
+import re
+from urllib.parse import quote
+
+import requests
+
+from audio import plan_audio
+
+# Protocols whose bytes can be relayed as-is, fragmented ones need a muxer
+STREAMABLE_PROTOCOLS = ('http', 'https')
+
+CHUNK_SIZE = 64 * 1024
+
+# Upstream headers worth passing on to the client
+RELAYED_HEADERS = ('Content-Length', 'Content-Range', 'Content-Encoding', 'Accept-Ranges', 'Last-Modified')
+
+
+def plan_stream(info, download_type, audio_format='mp3'):
+    """Describe how to relay the selected format of a processed info dict
+
+    Returns (record, None) when the format is a single plain HTTP file that
+    needs no merge or transcode, otherwise (None, reason) and the caller
+    should fall back to the file download path.
+    """
+    if info is None or info.get('_type', 'video') != 'video':
+        return None, 'playlist'
+    if info.get('requested_formats'):
+        return None, 'needs_merge'
+    if download_type == 'audio' and plan_audio(info, audio_format)['action'] != 'keep':
+        # Remuxes and transcodes need ffmpeg, only a file kept as served is relayed
+        return None, 'needs_transcode'
+    if info.get('protocol') not in STREAMABLE_PROTOCOLS or not info.get('url'):
+        return None, 'fragmented'
+
+    return {
+        'media_url': info['url'],
+        'http_headers': dict(info.get('http_headers') or {}),
+        'filename': media_filename(info.get('title'), info.get('ext') or 'mp4'),
+        'filesize': info.get('filesize') or info.get('filesize_approx'),
+    }, None
+
+
+def open_upstream(record, range_header=None, timeout=30):
+    """Start the upstream transfer for a stream record"""
+    headers = dict(record['http_headers'])
+    if range_header:
+        headers['Range'] = range_header
+    response = requests.get(record['media_url'], headers=headers, stream=True, timeout=timeout)
+    response.raise_for_status()
+    return response
+
+
+def relay(response):
+    """Yield upstream chunks untouched as they arrive, always releasing the connection"""
+    try:
+        for chunk in response.raw.stream(CHUNK_SIZE, decode_content=False):
+            if chunk:
+                yield chunk
+    finally:
+        response.close()
+
+
+def media_filename(title, ext):
+    """Download filename from a media title, stripped of characters filesystems reject"""
+    title = re.sub(r'[\\/:*?"<>|\r\n]+', ' ', title or 'download').strip()[:120] or 'download'
+    return f'{title}.{ext}' if ext else title
+
+
+def content_disposition(filename):
+    """Attachment header that keeps non-ASCII titles intact for modern browsers"""
+    fallback = filename.encode('ascii', 'ignore').decode('ascii').replace('"', '') or 'download'
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
@@ -0,0 +1,174 @@
+import contextlib
+import os
+import time
+
+from shared_db import SharedDB
+
+BREAKER_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+class Throttled(Exception):
+    """Raised instead of calling a platform that is rate limited or whose breaker is open"""
+
+    def __init__(self, platform, reason, retry_after):
+        super().__init__(f'{platform} is throttled ({reason}), retry in {retry_after}s')
+        self.platform = platform
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def parse_rate_limits(value):
+    """Parse 'instagram=20/60,tiktok=30/60' into {'instagram': (20, 60.0), ...} (requests per seconds)"""
+    limits = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        platform, rate = item.split('=', 1)
+        count, _, seconds = rate.partition('/')
+        limits[platform.strip()] = (max(1, int(count)), float(seconds or 60))
+    return limits
+
+
+class PlatformGuard:
+    """Token bucket and circuit breaker per platform, shared by all workers on the host
+
+    Each platform with a configured rate gets a bucket of count tokens
+    refilled over seconds; a call without a token is refused. The breaker
+    counts consecutive rate-limit and login failures: after threshold of
+    them it opens and calls fail fast for cooldown seconds, then one probe
+    call is let through (half open) and its outcome closes or reopens it.
+    State lives in the shared SQLite database so every worker sees the
+    same buckets and breakers.
+    """
+
+    def __init__(self, limits, threshold=3, cooldown=300, path=None):
+        self.limits = limits
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.db = SharedDB(path)
+        conn = self.db.connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS rate_buckets ('
+            'platform TEXT PRIMARY KEY, '
+            'tokens REAL NOT NULL, '
+            'updated_at REAL NOT NULL)'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS breakers ('
+            'platform TEXT PRIMARY KEY, '
+            'state TEXT NOT NULL, '
+            'failures INTEGER NOT NULL, '
+            'open_until REAL NOT NULL, '
+            'trips INTEGER NOT NULL DEFAULT 0)'
+        )
+
+    def _breaker(self, conn, platform):
+        row = conn.execute(
+            'SELECT state, failures, open_until, trips FROM breakers WHERE platform = ?', (platform,)
+        ).fetchone()
+        return row or ('closed', 0, 0.0, 0)
+
+    def _save_breaker(self, conn, platform, state, failures, open_until, trips):
+        conn.execute(
+            'INSERT OR REPLACE INTO breakers (platform, state, failures, open_until, trips) VALUES (?, ?, ?, ?, ?)',
+            (platform, state, failures, open_until, trips),
+        )
+
+    def blocked(self, platform):
+        """Seconds until the platform's breaker lets calls through again, 0 if it is closed"""
+        state, _, open_until, _ = self._breaker(self.db.connect(), platform)
+        remaining = open_until - time.time()
+        if state == 'closed' or remaining <= 0:
+            # Past the cooldown the next call is let through as a probe
+            return 0
+        return max(1, int(remaining))
+
+    def admit(self, platform):
+        """Take a token and pass the breaker, raising Throttled if either refuses"""
+        if platform == 'unknown':
+            return
+        conn = self.db.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            state, failures, open_until, trips = self._breaker(conn, platform)
+            if state != 'closed':
+                if now < open_until:
+                    raise Throttled(platform, 'circuit_open', max(1, int(open_until - now)))
+                # Cooldown is over: let this call probe the platform, and keep
+                # everyone else out until it reports back or its probe window lapses
+                self._save_breaker(conn, platform, 'half_open', failures, now + self.cooldown / 10, trips)
+
+            if platform in self.limits:
+                count, seconds = self.limits[platform]
+                row = conn.execute('SELECT tokens, updated_at FROM rate_buckets WHERE platform = ?',
+                                   (platform,)).fetchone()
+                tokens = float(count) if row is None else min(count, row[0] + (now - row[1]) * count / seconds)
+                if tokens < 1:
+                    raise Throttled(platform, 'rate_limited', max(1, int((1 - tokens) * seconds / count + 0.999)))
+                conn.execute('INSERT OR REPLACE INTO rate_buckets (platform, tokens, updated_at) VALUES (?, ?, ?)',
+                             (platform, tokens - 1, now))
+        finally:
+            conn.execute('COMMIT')
+
+    def record(self, platform, trip_reason):
+        """Report a call's outcome: trip_reason is 'rate_limited'/'login_required' for failures that count, else None"""
+        if platform == 'unknown':
+            return
+        conn = self.db.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            state, failures, open_until, trips = self._breaker(conn, platform)
+            if trip_reason is None:
+                if state != 'closed' or failures:
+                    self._save_breaker(conn, platform, 'closed', 0, 0.0, trips)
+                return
+            failures += 1
+            if state == 'half_open' or failures >= self.threshold:
+                print(f"Circuit breaker for {platform} opened after {failures} {trip_reason} failure(s)")
+                self._save_breaker(conn, platform, 'open', failures, time.time() + self.cooldown, trips + 1)
+            else:
+                self._save_breaker(conn, platform, state, failures, open_until, trips)
+        finally:
+            conn.execute('COMMIT')
+
+    @contextlib.contextmanager
+    def guard(self, platform, trip_reason):
+        """Run a platform call under admit()/record(); trip_reason(error) picks the failures that count"""
+        self.admit(platform)
+        try:
+            yield
+        except Exception as e:
+            self.record(platform, trip_reason(e))
+            raise
+        self.record(platform, None)
+
+    def snapshot(self):
+        """{platform: {'state', 'failures', 'retry_after', 'trips', 'tokens'}} for monitoring"""
+        conn = self.db.connect()
+        now = time.time()
+        platforms = {}
+        for platform, state, failures, open_until, trips in conn.execute(
+                'SELECT platform, state, failures, open_until, trips FROM breakers'):
+            platforms[platform] = {
+                'state': state,
+                'failures': failures,
+                'retry_after': max(0, int(open_until - now)) if state != 'closed' else 0,
+                'trips': trips,
+            }
+        for platform, (count, seconds) in self.limits.items():
+            row = conn.execute('SELECT tokens, updated_at FROM rate_buckets WHERE platform = ?',
+                               (platform,)).fetchone()
+            tokens = float(count) if row is None else min(count, row[0] + (now - row[1]) * count / seconds)
+            entry = platforms.setdefault(platform, {'state': 'closed', 'failures': 0, 'retry_after': 0, 'trips': 0})
+            entry['tokens'] = round(tokens, 2)
+        return platforms
+
+
+def create_platform_guard():
+    """Build the guard from PLATFORM_RATE_LIMITS, BREAKER_THRESHOLD and BREAKER_COOLDOWN"""
+    return PlatformGuard(
+        parse_rate_limits(os.environ.get('PLATFORM_RATE_LIMITS', 'instagram=20/60,tiktok=30/60')),
+        threshold=int(os.environ.get('BREAKER_THRESHOLD', 3)),
+        cooldown=int(os.environ.get('BREAKER_COOLDOWN', 300)),
+    )
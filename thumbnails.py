@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+
+import requests
+
+from audio import FFMPEG
+
+# Width previews are scaled down to; smaller images keep their size
+THUMBNAIL_WIDTH = int(os.environ.get('THUMBNAIL_WIDTH', 480))
+
+# Largest source image fetched, and seconds allowed for fetching it
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+FETCH_TIMEOUT = 10
+
+# Encoder settings per cached format: (extension, mimetype, ffmpeg output args)
+FORMATS = {
+    'webp': ('webp', 'image/webp', ['-c:v', 'libwebp', '-quality', '70', '-f', 'webp']),
+    'jpeg': ('jpg', 'image/jpeg', ['-c:v', 'mjpeg', '-q:v', '5', '-pix_fmt', 'yuvj420p', '-f', 'image2', '-update', '1']),
+}
+
+# Seconds between mtime refreshes of a cached thumbnail, the LRU clock for eviction
+TOUCH_INTERVAL = 600
+
+
+def thumbnail_key(info):
+    """Cache key for a media item's thumbnail: extractor and media id, independent of the signed URL"""
+    material = json.dumps([info.get('extractor_key') or info.get('extractor'), info.get('id')])
+    return hashlib.sha1(material.encode('utf-8')).hexdigest()
+
+
+def is_thumbnail_key(key):
+    return len(key) == 40 and all(c in '0123456789abcdef' for c in key)
+
+
+def fetch_source(record):
+    """Bytes of the original image, refusing anything larger than MAX_SOURCE_BYTES"""
+    with requests.get(record['url'], headers=record.get('http_headers') or {}, stream=True,
+                      timeout=FETCH_TIMEOUT) as response:
+        response.raise_for_status()
+        data = bytearray()
+        for chunk in response.iter_content(64 * 1024):
+            data += chunk
+            if len(data) > MAX_SOURCE_BYTES:
+                raise ValueError(f'Thumbnail larger than {MAX_SOURCE_BYTES} bytes')
+    return bytes(data)
+
+
+def encode_command(destination, fmt, width):
+    """ffmpeg invocation reading an image on stdin and writing one downscaled frame"""
+    return [FFMPEG, '-y', '-nostdin', '-loglevel', 'error', '-f', 'image2pipe', '-i', 'pipe:0',
+            '-vf', f"scale=w='min({width},iw)':h=-2", '-frames:v', '1',
+            *FORMATS[fmt][2], destination]
+
+
+class ThumbnailCache:
+    """Downscaled thumbnails on disk, one file per media item and format
+
+    The first request for a thumbnail fetches the platform's image,
+    re-encodes it at THUMBNAIL_WIDTH and stores it; later requests are
+    served from the folder. Concurrent misses for the same key in one
+    worker share a single fetch. The folder is kept under max_bytes by
+    removing the least recently used files, checked whenever this worker
+    has written another twentieth of the budget.
+    """
+
+    def __init__(self, folder, max_bytes, width=THUMBNAIL_WIDTH):
+        self.folder = os.path.abspath(folder)
+        self.max_bytes = max_bytes
+        self.width = width
+        self.webp = True
+        os.makedirs(self.folder, exist_ok=True)
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._written = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evicted = 0
+
+    def format_for(self, accept):
+        """WebP for clients that accept it while ffmpeg can encode it, JPEG otherwise"""
+        return 'webp' if self.webp and 'image/webp' in (accept or '') else 'jpeg'
+
+    @staticmethod
+    def mimetype(fmt):
+        return FORMATS[fmt][1]
+
+    def path(self, key, fmt):
+        return os.path.join(self.folder, f'{key}.{FORMATS[fmt][0]}')
+
+    def lookup(self, key, fmt):
+        """Path of the cached thumbnail, or None"""
+        path = self._cached(key, fmt)
+        if path is not None:
+            with self._lock:
+                self.hits += 1
+        return path
+
+    def _cached(self, key, fmt):
+        path = self.path(key, fmt)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        if time.time() - mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return path
+
+    def produce(self, key, record, fmt):
+        """Fetch, downscale and store the thumbnail described by record, returns (path, format)"""
+        with self._lock:
+            event = self._flights.get(key)
+            owner = event is None
+            if owner:
+                self.misses += 1
+                event = self._flights[key] = threading.Event()
+            else:
+                self.coalesced += 1
+        if not owner:
+            event.wait(FETCH_TIMEOUT * 2)
+            path = self._cached(key, fmt)
+            if path is None:
+                raise RuntimeError('Thumbnail could not be produced')
+            return path, fmt
+
+        try:
+            data = fetch_source(record)
+            try:
+                return self._encode(key, data, fmt), fmt
+            except RuntimeError:
+                if fmt != 'webp':
+                    raise
+                path = self._encode(key, data, 'jpeg')
+                # The image was fine, so ffmpeg lacks libwebp: serve JPEG from now on
+                print("WebP thumbnails unavailable, falling back to JPEG")
+                self.webp = False
+                return path, 'jpeg'
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            event.set()
+
+    def _encode(self, key, data, fmt):
+        path = self.path(key, fmt)
+        # Hidden until complete so readers and eviction never see a partial file
+        partial = os.path.join(self.folder, f'.{key}.{os.getpid()}.{threading.get_ident()}.{FORMATS[fmt][0]}')
+        try:
+            result = subprocess.run(encode_command(partial, fmt, self.width), input=data, capture_output=True)
+            if result.returncode != 0 or not os.path.exists(partial):
+                raise RuntimeError(f'ffmpeg {fmt} thumbnail failed: {result.stderr.decode(errors="replace").strip()[-300:]}')
+            size = os.path.getsize(partial)
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+        with self._lock:
+            self._written += size
+            due = self._written >= self.max_bytes // 20
+            if due:
+                self._written = 0
+        if due:
+            self.evict()
+        return path
+
+    def evict(self):
+        """Remove the least recently used thumbnails until the folder is under 90% of max_bytes"""
+        entries = []
+        total = 0
+        with os.scandir(self.folder) as scan:
+            for entry in scan:
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self._lock:
+            self.evicted += removed
+        return removed
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evicted': self.evicted,
+                'webp': self.webp,
+                'hit_rate': round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+            }
+
+
+def create_thumbnail_cache():
+    """Build the cache in THUMBNAIL_FOLDER, bounded to THUMBNAIL_CACHE_BYTES (default 200 MB)"""
+    return ThumbnailCache(os.environ.get('THUMBNAIL_FOLDER', 'thumbnails'),
+                          int(os.environ.get('THUMBNAIL_CACHE_BYTES', 200 * 1024 * 1024)))
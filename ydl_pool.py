@@ -0,0 +1,171 @@
+import collections
+import contextlib
+import os
+import sys
+import threading
+import time
+
+
+class _PooledYoutubeDL:
+    """A YoutubeDL instance whose hooks can be swapped between jobs
+
+    yt-dlp copies postprocessor hooks into each postprocessor when it is
+    registered, so instead of replacing hook lists the instance is built
+    with one dispatcher per hook type that forwards to the current job's
+    hooks.
+    """
+
+    def __init__(self, params):
+        self.progress_hooks = []
+        self.postprocessor_hooks = []
+        params = dict(params)
+        params['progress_hooks'] = [self._dispatch_progress]
+        params['postprocessor_hooks'] = [self._dispatch_postprocessor]
+        import yt_dlp
+        self.ydl = yt_dlp.YoutubeDL(params)
+        self.default_format = self.ydl.params.get('format')
+        self.default_outtmpl = self.ydl.params['outtmpl'].get('default')
+
+    def _dispatch_progress(self, d):
+        for hook in self.progress_hooks:
+            hook(d)
+
+    def _dispatch_postprocessor(self, d):
+        for hook in self.postprocessor_hooks:
+            hook(d)
+
+    def configure(self, format=None, outtmpl=None, progress_hooks=(), postprocessor_hooks=()):
+        self.set_format(format or self.default_format)
+        if outtmpl is not None:
+            self.ydl.params['outtmpl']['default'] = outtmpl
+        self.progress_hooks = list(progress_hooks)
+        self.postprocessor_hooks = list(postprocessor_hooks)
+
+    def set_format(self, format_spec):
+        if self.ydl.params.get('format') == format_spec:
+            return
+        self.ydl.params['format'] = format_spec
+        # The selector is normally compiled once in YoutubeDL.__init__
+        self.ydl.format_selector = self.ydl.build_format_selector(format_spec) if format_spec else None
+
+    def reset(self):
+        self.progress_hooks = []
+        self.postprocessor_hooks = []
+        if self.default_outtmpl is None:
+            self.ydl.params['outtmpl'].pop('default', None)
+        else:
+            self.ydl.params['outtmpl']['default'] = self.default_outtmpl
+
+    def close(self):
+        self.ydl.close()
+
+
+class YoutubeDLPool:
+    """Reusable YoutubeDL instances keyed by option profile
+
+    options_for(profile) returns the params dict for a profile. Instances
+    keep their extractor registry, cookie jar and HTTP connections between
+    jobs; each checkout gets its own format, output template and hooks. An
+    instance is closed instead of being reused when its job raised
+    something other than an expected failure: yt-dlp's DownloadError
+    (unavailable media, network errors) or whatever reusable(e) accepts.
+
+    yt-dlp itself is imported by the first checkout or by load_engine(),
+    not when this module is, so a worker can answer requests that never
+    extract anything before paying for its extractor modules. on_load runs
+    once right after the import.
+    """
+
+    def __init__(self, options_for, max_idle=4, on_load=None, reusable=None):
+        self.options_for = options_for
+        self.max_idle = max_idle
+        self.on_load = on_load
+        self.reusable = reusable
+        self.discarded = 0
+        self._idle = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.loaded = False
+        self.load_seconds = None
+        self.created = 0
+        self.reused = 0
+
+    def load_engine(self):
+        """Import yt-dlp and run on_load, once per process; a preloading master calls this before forking"""
+        if self.loaded:
+            return
+        with self._load_lock:
+            if self.loaded:
+                return
+            started = time.perf_counter()
+            import yt_dlp  # noqa: F401
+            if self.on_load is not None:
+                self.on_load()
+            self.load_seconds = time.perf_counter() - started
+            self.loaded = True
+
+    def _take(self, profile):
+        self.load_engine()
+        with self._lock:
+            if self._idle[profile]:
+                self.reused += 1
+                return self._idle[profile].pop()
+            self.created += 1
+        return _PooledYoutubeDL(self.options_for(profile))
+
+    def _give_back(self, profile, pooled):
+        pooled.reset()
+        with self._lock:
+            if len(self._idle[profile]) < self.max_idle:
+                self._idle[profile].append(pooled)
+                return
+        pooled.close()
+
+    @contextlib.contextmanager
+    def acquire(self, profile, format=None, outtmpl=None, progress_hooks=(), postprocessor_hooks=()):
+        pooled = self._take(profile)
+        try:
+            pooled.configure(format, outtmpl, progress_hooks, postprocessor_hooks)
+            yield pooled.ydl
+        except BaseException as e:
+            if self._reusable_after(e):
+                self._give_back(profile, pooled)
+            else:
+                with self._lock:
+                    self.discarded += 1
+                pooled.close()
+            raise
+        self._give_back(profile, pooled)
+
+    def _reusable_after(self, e):
+        if not isinstance(e, Exception):
+            return False
+        return is_download_error(e) or (self.reusable is not None and self.reusable(e))
+
+    def warm(self, profile, count=1):
+        """Build idle instances ahead of the first request"""
+        for _ in range(count):
+            self._give_back(profile, self._take(profile))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': self.loaded,
+                'load_seconds': round(self.load_seconds, 3) if self.load_seconds is not None else None,
+                'created': self.created,
+                'reused': self.reused,
+                'discarded': self.discarded,
+                'idle': {profile: len(idle) for profile, idle in self._idle.items()},
+            }
+
+
+def is_download_error(e):
+    """Whether e is yt-dlp's DownloadError, without importing yt-dlp to find out"""
+    yt_dlp = sys.modules.get('yt_dlp')
+    return yt_dlp is not None and isinstance(e, yt_dlp.utils.DownloadError)
+
+
+def create_ydl_pool(options_for, on_load=None, reusable=None):
+    """Build the pool, keeping up to YDL_POOL_IDLE idle instances per profile"""
+    return YoutubeDLPool(options_for, max_idle=int(os.environ.get('YDL_POOL_IDLE', 4)), on_load=on_load,
+                         reusable=reusable)
@@ -0,0 +1,49 @@
+import zipfile
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class _ZipSink:
+    """Write-only, non-seekable target that hands written bytes back to a generator"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(files):
+    """Yield a zip archive of (archive_name, path) pairs chunk by chunk
+
+    files may be a lazy iterable, so entries can be added as they become
+    available. Only one chunk of one file is held in memory at a time;
+    media is stored uncompressed since it is already compressed.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name, path in files:
+            with open(path, 'rb') as source, archive.open(name, 'w', force_zip64=True) as target:
+                while True:
+                    chunk = source.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    # Central directory
+    yield sink.drain()